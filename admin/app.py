@@ -9,17 +9,33 @@ import json
 import subprocess
 import logging
 import re
-import yaml
-import psycopg2
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+import urllib.error
+import urllib.parse
 from datetime import datetime, timedelta
 from pathlib import Path
 from functools import wraps
 
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-import boto3
-from botocore.exceptions import ClientError
+
+from media_index import MediaIndex
+from backup_archive import (
+    BACKUP_PREFIX,
+    DATABASE_DUMP_NAME,
+    LocalBackupStore,
+    S3BackupStore,
+    create_archive,
+    verify_archive,
+)
+from bulk_users import BulkUserJob
+from log_archive import LogArchive, LogCollector, LEVELS
+from nginx_logs import AccessLogStats, MediaCacheStats
+from resource_monitor import ResourceSampler
+from synapse_metrics import SynapseMetrics
 
 # Configure logging
 logging.basicConfig(
@@ -57,7 +73,20 @@ PROJECT_DIR = Path('/app/project')
 DOCKER_COMPOSE_FILE = PROJECT_DIR / 'docker-compose.yml'
 SCHEDULES_FILE = Path('/app/data/schedules.json')
 ENV_FILE = PROJECT_DIR / '.env'
-HOMESERVER_YAML = PROJECT_DIR / 'synapse_data' / 'homeserver.yaml'
+HOMESERVER_YAML = Path(os.environ.get('HOMESERVER_YAML', PROJECT_DIR / 'synapse_data' / 'homeserver.yaml'))
+MAINTENANCE_HISTORY_FILE = Path('/app/data/maintenance_history.json')
+DB_ANALYSIS_FILE = Path('/app/data/db_analysis.json')
+MEDIA_INDEX_FILE = Path('/app/data/media_index.sqlite3')
+LOG_ARCHIVE_DIR = Path('/app/data/logs')
+NGINX_LOGS_DIR = Path('/app/nginx_logs')
+MEDIA_CACHE_STATS_FILE = Path('/app/data/media_cache_stats.json')
+ACCESS_LOG_STATS_FILE = Path('/app/data/access_log_stats.json')
+PENDING_CHANGES_FILE = Path('/app/data/pending_changes.json')
+CONFIG_APPLY_HISTORY_FILE = Path('/app/data/config_apply_history.json')
+BULK_USER_JOB_FILE = Path('/app/data/bulk_user_job.json')
+BACKUP_HISTORY_FILE = Path('/app/data/backup_history.json')
+BACKUP_LOCAL_DIR = Path(os.environ.get('BACKUP_LOCAL_DIR', '/app/data/backups'))
+SYNAPSE_URL = os.environ.get('SYNAPSE_URL', 'http://synapse:8008')
 
 # Constants
 MAX_LOG_LINES = 10000
@@ -69,6 +98,62 @@ DB_HOST = os.environ.get('POSTGRES_HOST', 'postgres')
 DB_PORT = os.environ.get('POSTGRES_PORT', '5432')
 DB_NAME = 'synapse'
 DB_USER = 'synapse'
+# Database maintenance retention (days) and limits
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', '365'))
+REMOTE_MEDIA_RETENTION_DAYS = int(os.environ.get('REMOTE_MEDIA_RETENTION_DAYS', '90'))
+USER_IPS_RETENTION_DAYS = int(os.environ.get('USER_IPS_RETENTION_DAYS', '90'))
+VACUUM_TABLE_LIMIT = int(os.environ.get('VACUUM_TABLE_LIMIT', '10'))
+MAX_MAINTENANCE_HISTORY = 100
+PURGE_STATUS_TIMEOUT = 3600
+MAINTENANCE_TASKS = ['purge_history', 'purge_media', 'prune_user_ips', 'vacuum']
+# Database analysis
+DB_ANALYSIS_MAX_AGE = timedelta(hours=1)
+DB_ANALYSIS_TOP_N = 20
+# Media store scanning
+MEDIA_SCAN_WORKERS = int(os.environ.get('MEDIA_SCAN_WORKERS', '8'))
+MEDIA_SCAN_INTERVAL_HOURS = int(os.environ.get('MEDIA_SCAN_INTERVAL_HOURS', '6'))
+MAX_MEDIA_TOP_FILES = 500
+DEFAULT_MEDIA_TOP_FILES = 20
+MAX_TRAFFIC_MINUTES = 48 * 60
+DEFAULT_TRAFFIC_MINUTES = 60
+# Log archive
+LOG_ARCHIVE_MAX_MB = int(os.environ.get('LOG_ARCHIVE_MAX_MB', '1024'))
+MAX_LOG_SEARCH_RESULTS = 1000
+DEFAULT_LOG_SEARCH_RESULTS = 200
+# Staged configuration changes
+MAX_CONFIG_APPLY_HISTORY = 50
+SYNAPSE_RESTART_TIMEOUT = int(os.environ.get('SYNAPSE_RESTART_TIMEOUT', '300'))
+HEALTH_POLL_INTERVAL = 0.5
+# Server settings the console can stage, and the .env key each one is kept in
+SERVER_SETTINGS = {
+    'enable_registration': 'ENABLE_REGISTRATION',
+    'enable_federation': 'ENABLE_FEDERATION',
+}
+# Container resource sampling
+RESOURCE_SAMPLE_INTERVAL = int(os.environ.get('RESOURCE_SAMPLE_INTERVAL', '10'))
+RESOURCE_CPU_ALERT_PERCENT = float(os.environ.get('RESOURCE_CPU_ALERT_PERCENT', '90'))
+RESOURCE_MEMORY_ALERT_PERCENT = float(os.environ.get('RESOURCE_MEMORY_ALERT_PERCENT', '90'))
+# Synapse metrics (ENABLE_METRICS in .env)
+SYNAPSE_METRICS_URL = os.environ.get('SYNAPSE_METRICS_URL', 'http://synapse:9000/_synapse/metrics')
+SYNAPSE_METRICS_INTERVAL = int(os.environ.get('SYNAPSE_METRICS_INTERVAL', '30'))
+SYNAPSE_CACHE_HIT_RATIO_ALERT = float(os.environ.get('SYNAPSE_CACHE_HIT_RATIO_ALERT', '0.8'))
+SYNAPSE_SLOW_TRANSACTION_SECONDS = float(os.environ.get('SYNAPSE_SLOW_TRANSACTION_SECONDS', '0.5'))
+# Bulk user actions: worker threads and Synapse admin API calls per second
+BULK_USER_WORKERS = int(os.environ.get('BULK_USER_WORKERS', '4'))
+BULK_USER_RATE = float(os.environ.get('BULK_USER_RATE', '5'))
+BULK_USER_ACTIONS = ('deactivate', 'shadow_ban', 'purge_media')
+BULK_USER_PREVIEW = 20
+PURGE_MEDIA_PAGE_SIZE = 500
+# Stop purging one user's media after this many pages (100,000 files)
+MAX_PURGE_MEDIA_PAGES = 200
+# Backups and restore tests
+MAX_BACKUP_HISTORY = 100
+BACKUP_LOCAL_KEEP = int(os.environ.get('BACKUP_LOCAL_KEEP', '3'))
+RESTORE_TEST_DIR = os.environ.get('RESTORE_TEST_DIR', '/tmp/matrix-restore-test')
+RESTORE_TEST_POSTGRES_IMAGE = os.environ.get('RESTORE_TEST_POSTGRES_IMAGE', 'postgres:15-alpine')
+RESTORE_TEST_READY_TIMEOUT = 120
+# nginx logs on the shared volume are rotated to <name>.1 once read past this size
+NGINX_LOG_MAX_BYTES = 100 * 1024 * 1024
 
 # Warn about insecure defaults
 if app.secret_key == 'change-this-secret-key':
@@ -76,9 +161,35 @@ if app.secret_key == 'change-this-secret-key':
 if ADMIN_PASSWORD == 'admin':
     logger.warning("Using default admin password - this is insecure! Set ADMIN_CONSOLE_PASSWORD in .env")
 
-# Initialize scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
+# Maintenance tasks currently running (guards against overlapping runs)
+running_maintenance = set()
+running_maintenance_lock = threading.Lock()
+
+# Guards check-and-set of the single-instance background job states below
+background_job_lock = threading.Lock()
+
+# Database analysis background job state
+db_analysis_state = {'running': False}
+
+# Staged configuration apply job state
+config_apply_state = {'running': False}
+
+# Backup verification / restore test job state
+backup_check_state = {'running': False}
+
+# Background scheduler, created on first use and started by
+# start_background_services() rather than as a side effect of import
+scheduler = None
+background_services_started = False
+
+
+def get_scheduler():
+    """Return the background scheduler, creating it on first use."""
+    global scheduler
+    if scheduler is None:
+        from apscheduler.schedulers.background import BackgroundScheduler
+        scheduler = BackgroundScheduler()
+    return scheduler
 
 
 def login_required(f):
@@ -91,13 +202,14 @@ def login_required(f):
     return decorated_function
 
 
-def run_command(cmd, cwd=None):
+def run_command(cmd, cwd=None, input=None):
     """Run a shell command and return output."""
     try:
         result = subprocess.run(
             cmd,
             shell=True,
             cwd=cwd or PROJECT_DIR,
+            input=input,
             capture_output=True,
             text=True,
             timeout=300
@@ -158,11 +270,38 @@ def save_schedules(schedules):
         return False
 
 
+def parse_schedule_trigger(schedule):
+    """Build a cron trigger from "daily", "weekly", "monthly" or a 5-field cron expression.
+
+    Returns None if the schedule is not in a recognised format.
+    """
+    from apscheduler.triggers.cron import CronTrigger
+    if schedule == 'daily':
+        return CronTrigger(hour=3, minute=0)
+    elif schedule == 'weekly':
+        return CronTrigger(day_of_week='sun', hour=3, minute=0)
+    elif schedule == 'monthly':
+        return CronTrigger(day=1, hour=3, minute=0)
+
+    parts = schedule.split()
+    if len(parts) != 5:
+        return None
+    return CronTrigger(
+        minute=parts[0],
+        hour=parts[1],
+        day=parts[2],
+        month=parts[3],
+        day_of_week=parts[4]
+    )
+
+
 def create_scheduled_task(task_type):
     """Create a scheduled task function for a specific task type."""
     if task_type == 'update':
         def task():
-            return run_command('docker compose pull && docker compose up -d')
+            return run_command(
+                'docker compose pull && docker compose up -d && docker compose run --rm element-assets'
+            )
         return task
     elif task_type == 'restart':
         def task():
@@ -170,64 +309,275 @@ def create_scheduled_task(task_type):
         return task
     elif task_type == 'backup':
         return backup_to_s3
+    elif task_type == 'verify_backup':
+        return check_backup
+    elif task_type == 'restore_test':
+        def task():
+            return check_backup(restore=True)
+        return task
+    elif task_type in MAINTENANCE_TASKS:
+        def task():
+            return run_maintenance_task(task_type)
+        return task
     else:
         raise ValueError(f"Invalid task type: {task_type}")
 
 
+def get_backup_store():
+    """Return where backups are kept: the S3 bucket if configured, else BACKUP_LOCAL_DIR."""
+    aws_bucket = os.environ.get('AWS_S3_BUCKET')
+    if not aws_bucket:
+        return LocalBackupStore(BACKUP_LOCAL_DIR, keep=BACKUP_LOCAL_KEEP)
+    # boto3 is slow to import and only needed here
+    import boto3
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+        region_name=os.environ.get('AWS_REGION', 'us-east-1')
+    )
+    return S3BackupStore(s3_client, aws_bucket)
+
+
+def dump_database(path):
+    """Write a pg_dump (custom format) of the Synapse database to path."""
+    with open(path, 'wb') as f:
+        result = subprocess.run(
+            ['docker', 'compose', 'exec', '-T', 'postgres', 'pg_dump', '-U', 'synapse', '-Fc', 'synapse'],
+            cwd=PROJECT_DIR,
+            stdout=f,
+            stderr=subprocess.PIPE
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"pg_dump failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+
+
 def backup_to_s3():
-    """Create a backup and upload to S3."""
+    """Create a backup of synapse_data and the database and upload to S3."""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    backup_filename = f'{BACKUP_PREFIX}{timestamp}.tar.gz'
+    backup_path = f'/tmp/{backup_filename}'
+    dump_path = f'/tmp/{BACKUP_PREFIX}{timestamp}.pgdump'
+    entry = {'type': 'backup', 'filename': backup_filename, 'started': datetime.now().isoformat()}
+    start_time = time.monotonic()
     try:
-        # Create backup timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'matrix-backup-{timestamp}.tar.gz'
-        backup_path = f'/tmp/{backup_filename}'
-        
-        # Create backup (synapse_data only, .env not available in container)
+        # Create backup (synapse_data and a database dump; .env is not available in the container)
         logger.info(f"Creating backup: {backup_filename}")
-        result = run_command(
-            f'tar -czf {backup_path} -C {PROJECT_DIR} synapse_data',
-            cwd=PROJECT_DIR
-        )
+        try:
+            dump_database(dump_path)
+            with open(backup_path, 'wb') as f:
+                archive = create_archive(f, PROJECT_DIR, ['synapse_data'], [(DATABASE_DUMP_NAME, dump_path)])
+        finally:
+            if os.path.exists(dump_path):
+                os.remove(dump_path)
+        entry.update(archive)
         
-        if not result['success']:
-            logger.error(f"Backup creation failed: {result['stderr']}")
-            return {'success': False, 'error': 'Failed to create backup'}
+        store = get_backup_store()
+        logger.info(f"Saving backup {backup_filename} ({archive['size_bytes']} bytes) to {type(store).__name__}")
+        upload_start = time.monotonic()
+        location = store.save(backup_path, backup_filename, archive['sha256'])
+        upload_seconds = round(time.monotonic() - upload_start, 2)
+        entry.update({
+            'success': True,
+            'location': location,
+            'upload_seconds': upload_seconds,
+            'upload_bytes_per_second': round(archive['size_bytes'] / upload_seconds) if upload_seconds else None
+        })
         
-        # Upload to S3 if configured
-        aws_bucket = os.environ.get('AWS_S3_BUCKET')
-        if aws_bucket:
-            try:
-                s3_client = boto3.client(
-                    's3',
-                    aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-                    aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-                    region_name=os.environ.get('AWS_REGION', 'us-east-1')
-                )
-                
-                logger.info(f"Uploading to S3: {aws_bucket}/{backup_filename}")
-                s3_client.upload_file(backup_path, aws_bucket, backup_filename)
-                
-                # Clean up local backup
-                os.remove(backup_path)
-                
-                return {
-                    'success': True,
-                    'message': f'Backup uploaded to S3: {backup_filename}',
-                    'filename': backup_filename
-                }
-            except ClientError as e:
-                logger.error(f"S3 upload failed: {e}")
-                return {'success': False, 'error': f'S3 upload failed: {str(e)}'}
+        if isinstance(store, S3BackupStore):
+            result = {
+                'success': True,
+                'message': f'Backup uploaded to S3: {backup_filename}',
+                'filename': backup_filename
+            }
         else:
-            return {
+            result = {
                 'success': True,
-                'message': f'Backup created locally: {backup_path}',
+                'message': f'Backup created locally: {location}',
                 'filename': backup_filename,
-                'path': backup_path
+                'path': location
             }
     except Exception as e:
         logger.error(f"Backup failed: {e}")
-        return {'success': False, 'error': str(e)}
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        entry.update({'success': False, 'error': str(e)})
+        result = {'success': False, 'error': str(e)}
+    
+    entry['duration_seconds'] = round(time.monotonic() - start_time, 2)
+    record_backup_history(entry)
+    return result
+
+
+def restore_database_dump(dump):
+    """Restore a pg_dump stream into a throwaway Postgres container.
+
+    Returns how long the restore took and how many users and events came
+    back. The container has no network and is removed afterwards.
+    """
+    name = f'matrix-restore-test-{os.getpid()}'
+    result = run_command(
+        f'docker run -d --rm --name {name} --network none '
+        f'-e POSTGRES_USER=synapse -e POSTGRES_PASSWORD=restore-test -e POSTGRES_DB=synapse '
+        f'-e POSTGRES_INITDB_ARGS="--encoding=UTF8 --locale=C" {RESTORE_TEST_POSTGRES_IMAGE}'
+    )
+    if not result['success']:
+        return {'success': False, 'error': f"Failed to start scratch Postgres: {result['stderr'].strip()}"}
+    try:
+        # Postgres only listens on TCP once initialisation has finished; the
+        # restore itself uses the container's local socket, which needs no password
+        deadline = time.monotonic() + RESTORE_TEST_READY_TIMEOUT
+        while not run_command(f'docker exec {name} pg_isready -h 127.0.0.1 -U synapse')['success']:
+            if time.monotonic() > deadline:
+                return {'success': False, 'error': 'Scratch Postgres did not start in time'}
+            time.sleep(1)
+
+        start_time = time.monotonic()
+        with tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen(
+                ['docker', 'exec', '-i', name, 'pg_restore', '-U', 'synapse',
+                 '-d', 'synapse', '--no-owner', '--exit-on-error'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr
+            )
+            try:
+                while True:
+                    chunk = dump.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    proc.stdin.write(chunk)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = proc.wait()
+            stderr.seek(0)
+            errors = stderr.read().decode('utf-8', errors='replace').strip()
+        restore_seconds = round(time.monotonic() - start_time, 2)
+        if returncode != 0:
+            return {'success': False, 'error': f"pg_restore failed: {errors[-500:]}", 'restore_seconds': restore_seconds}
+
+        counts = run_command(
+            f'docker exec {name} psql -U synapse -d synapse -tA '
+            f'-c "SELECT (SELECT count(*) FROM users), (SELECT count(*) FROM events)"'
+        )
+        if not counts['success']:
+            return {'success': False, 'error': f"Restored database is unreadable: {counts['stderr'].strip()}"}
+        users, events = counts['stdout'].strip().split('|')
+        return {'success': True, 'users': int(users), 'events': int(events), 'restore_seconds': restore_seconds}
+    finally:
+        run_command(f'docker rm -f {name}')
+
+
+def check_backup(filename=None, restore=False, reserved=False):
+    """Stream a backup back from its store and check it against its checksums.
+
+    With restore, the files are also extracted into RESTORE_TEST_DIR and the
+    database restored into a throwaway Postgres, and the whole run is
+    recorded as the recovery time. Defaults to the newest backup. reserved
+    means the caller already marked backup_check_state as running.
+    """
+    if not reserved and not reserve_background_job(backup_check_state):
+        return None
+    entry = {'type': 'restore_test' if restore else 'verify', 'started': datetime.now().isoformat()}
+    start_time = time.monotonic()
+    try:
+        store = get_backup_store()
+        if not filename:
+            backups = store.list()
+            if not backups:
+                raise RuntimeError('No backups found')
+            filename = backups[0]['name']
+        entry['filename'] = filename
+        logger.info(f"{'Test-restoring' if restore else 'Verifying'} backup: {filename}")
+        
+        stream, sha256 = store.open(filename)
+        scratch_dir = RESTORE_TEST_DIR if restore else None
+        try:
+            if scratch_dir:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+                os.makedirs(scratch_dir)
+            report = verify_archive(
+                stream,
+                expected_sha256=sha256,
+                extract_to=scratch_dir,
+                restore_database=restore_database_dump if restore else None
+            )
+        finally:
+            stream.close()
+            if scratch_dir:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+        
+        entry.update(report)
+        entry['success'] = report['ok']
+        if restore:
+            database = report.get('database')
+            if database is None:
+                entry.update({'success': False, 'error': entry.get('error') or 'Backup has no database dump'})
+            elif not database['success']:
+                entry.update({'success': False, 'error': database['error']})
+            entry['recovery_seconds'] = round(time.monotonic() - start_time, 2)
+    except Exception as e:
+        logger.error(f"Backup check failed: {e}")
+        entry.update({'success': False, 'error': str(e)})
+    finally:
+        backup_check_state['running'] = False
+    
+    entry['duration_seconds'] = round(time.monotonic() - start_time, 2)
+    logger.info(f"Backup check of {entry.get('filename')} finished in {entry['duration_seconds']}s: "
+                f"{'ok' if entry['success'] else entry.get('error')}")
+    record_backup_history(entry)
+    return entry
+
+
+def start_backup_check(restore=False, filename=None):
+    """Run a backup verification or restore test in the background."""
+    # Reserved here, under the lock, so two requests can't both start one
+    # (concurrent restore tests would share RESTORE_TEST_DIR)
+    if not reserve_background_job(backup_check_state):
+        return False
+    try:
+        get_scheduler().add_job(
+            func=check_backup,
+            kwargs={'filename': filename, 'restore': restore, 'reserved': True},
+            id='backup_check',
+            name='Backup restore test' if restore else 'Backup verification',
+            replace_existing=True
+        )
+    except Exception:
+        backup_check_state['running'] = False
+        raise
+    return True
+
+
+def load_backup_history():
+    """Load backup, verification and restore test history from file."""
+    if BACKUP_HISTORY_FILE.exists():
+        try:
+            with open(BACKUP_HISTORY_FILE, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load backup history: {e}")
+    return []
+
+
+def save_backup_history(history):
+    """Save backup history, keeping the most recent entries."""
+    try:
+        BACKUP_HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(BACKUP_HISTORY_FILE, 'w') as f:
+            json.dump(history[-MAX_BACKUP_HISTORY:], f, indent=2)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save backup history: {e}")
+        return False
+
+
+def record_backup_history(entry):
+    """Append one backup, verification or restore test result to the history."""
+    history = load_backup_history()
+    history.append(entry)
+    save_backup_history(history)
 
 
 def read_env_file():
@@ -247,8 +597,27 @@ def read_env_file():
     return env_vars
 
 
+def write_file_in_place(path, text):
+    """Overwrite a file's contents in place and fsync it.
+
+    .env is bind-mounted into the admin container as a single file, so it
+    can't be replaced by renaming a temp file over it; rewriting the same
+    inode also keeps its owner and permissions.
+    """
+    with open(path, 'r+') as f:
+        f.write(text)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+
 def update_env_file(key, value):
     """Update a specific key in the .env file."""
+    return update_env_values({key: value})
+
+
+def update_env_values(values):
+    """Set several keys in the .env file with a single write, restored if it fails."""
     try:
         if not ENV_FILE.exists():
             logger.error(".env file does not exist")
@@ -258,27 +627,32 @@ def update_env_file(key, value):
         with open(ENV_FILE, 'r') as f:
             lines = f.readlines()
         
-        # Find and update the key
-        key_found = False
+        # Find and update the keys
+        found = set()
         updated_lines = []
         for line in lines:
             if line.strip() and not line.strip().startswith('#') and '=' in line:
                 current_key = line.split('=', 1)[0].strip()
-                if current_key == key:
-                    updated_lines.append(f"{key}={value}\n")
-                    key_found = True
+                if current_key in values:
+                    updated_lines.append(f"{current_key}={values[current_key]}\n")
+                    found.add(current_key)
                 else:
                     updated_lines.append(line)
             else:
                 updated_lines.append(line)
         
-        # If key not found, append it
-        if not key_found:
-            updated_lines.append(f"\n# Auto-added by admin console\n{key}={value}\n")
+        # Append keys that weren't found
+        for key, value in values.items():
+            if key not in found:
+                updated_lines.append(f"\n# Auto-added by admin console\n{key}={value}\n")
         
-        # Write back
-        with open(ENV_FILE, 'w') as f:
-            f.writelines(updated_lines)
+        # Write back, putting the original text back if the write fails part way
+        original = ''.join(lines)
+        try:
+            write_file_in_place(ENV_FILE, ''.join(updated_lines))
+        except OSError:
+            write_file_in_place(ENV_FILE, original)
+            raise
         
         return True
     except Exception as e:
@@ -292,6 +666,7 @@ def get_homeserver_config_value(key):
         if not HOMESERVER_YAML.exists():
             return None
         
+        import yaml
         with open(HOMESERVER_YAML, 'r') as f:
             config = yaml.safe_load(f)
         
@@ -301,6 +676,291 @@ def get_homeserver_config_value(key):
         return None
 
 
+def homeserver_values_for_setting(setting, enabled, server_name):
+    """Map a console setting to the homeserver.yaml keys that implement it.
+
+    These mirror what synapse-entrypoint.sh writes on first boot.
+    """
+    if setting == 'enable_registration':
+        return {
+            'enable_registration': enabled,
+            'enable_registration_without_verification': enabled,
+        }
+    return {
+        # An empty whitelist allows every server; our own name alone blocks federation
+        'federation_domain_whitelist': [] if enabled else [server_name],
+        'allow_public_rooms_over_federation': enabled,
+    }
+
+
+def set_yaml_top_level_keys(text, values):
+    """Set top-level keys in YAML text, keeping comments and every other line.
+
+    Every occurrence of a key is rewritten, since the generated config and
+    the entrypoint's additions can both define it and the last one wins.
+    Missing keys are appended.
+    """
+    import yaml
+    lines = text.splitlines(keepends=True)
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+
+    for key, value in values.items():
+        rendered = yaml.safe_dump({key: value}, default_flow_style=False).splitlines(keepends=True)
+        pattern = re.compile(rf'^{re.escape(key)}\s*:')
+        starts = [i for i, line in enumerate(lines) if pattern.match(line)]
+        if not starts:
+            lines += ['\n'] + rendered
+            continue
+        # Work backwards so earlier indices stay valid
+        for start in reversed(starts):
+            end = start + 1
+            # The value continues on indented lines and, for block lists,
+            # on unindented '- ' items
+            while end < len(lines) and lines[end].startswith((' ', '\t', '- ')):
+                end += 1
+            lines[start:end] = rendered
+    return ''.join(lines)
+
+
+def load_pending_changes():
+    """Load staged server settings that have not been applied yet."""
+    if PENDING_CHANGES_FILE.exists():
+        try:
+            with open(PENDING_CHANGES_FILE, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load pending changes: {e}")
+    return {}
+
+
+def save_pending_changes(pending):
+    """Save staged server settings, removing the file when nothing is staged."""
+    try:
+        if not pending:
+            PENDING_CHANGES_FILE.unlink(missing_ok=True)
+            return True
+        PENDING_CHANGES_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(PENDING_CHANGES_FILE, 'w') as f:
+            json.dump(pending, f, indent=2)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save pending changes: {e}")
+        return False
+
+
+def build_pending_diff(pending):
+    """Compare staged settings with .env and homeserver.yaml.
+
+    Returns the .env and homeserver.yaml changes, the rewritten
+    homeserver.yaml (None when it doesn't change) and whether a Synapse
+    restart is needed. Only homeserver.yaml changes need one: Synapse reads
+    .env values solely when generating its config on first boot, and none of
+    these settings are picked up by a SIGHUP config reload. Raises
+    ValueError if the staged changes would produce an invalid config.
+    """
+    import yaml
+    env_vars = read_env_file()
+    homeserver_text = HOMESERVER_YAML.read_text() if HOMESERVER_YAML.exists() else None
+    config = yaml.safe_load(homeserver_text) if homeserver_text else None
+    if homeserver_text and not isinstance(config, dict):
+        raise ValueError("homeserver.yaml is not a YAML mapping")
+
+    env_changes = []
+    homeserver_changes = []
+    homeserver_values = {}
+    for setting, enabled in pending.items():
+        env_key = SERVER_SETTINGS[setting]
+        new_value = 'true' if enabled else 'false'
+        current = env_vars.get(env_key)
+        if current is None or current.strip().lower() != new_value:
+            env_changes.append({'key': env_key, 'current': current, 'new': new_value})
+
+        if config is None:
+            # Not generated yet; first boot will use the new .env values
+            continue
+        server_name = config.get('server_name')
+        if not server_name:
+            raise ValueError("homeserver.yaml has no server_name")
+        for key, value in homeserver_values_for_setting(setting, enabled, server_name).items():
+            if config.get(key) != value:
+                homeserver_changes.append({'key': key, 'current': config.get(key), 'new': value})
+                homeserver_values[key] = value
+
+    new_homeserver_text = None
+    if homeserver_values:
+        new_homeserver_text = set_yaml_top_level_keys(homeserver_text, homeserver_values)
+        new_config = yaml.safe_load(new_homeserver_text)
+        for key, value in homeserver_values.items():
+            if new_config.get(key) != value:
+                raise ValueError(f"Rewritten homeserver.yaml does not set {key} correctly")
+        unchanged = {k: v for k, v in config.items() if k not in homeserver_values}
+        if any(new_config.get(k) != v for k, v in unchanged.items()):
+            raise ValueError("Rewriting homeserver.yaml would change other settings")
+
+    return {
+        'env': env_changes,
+        'homeserver': homeserver_changes,
+        'homeserver_text': new_homeserver_text,
+        'restart_required': bool(homeserver_changes),
+    }
+
+
+def write_homeserver_config(text):
+    """Replace homeserver.yaml inside the Synapse container, keeping a .bak copy.
+
+    The admin container only has a read-only view of synapse_data, so the
+    file is written by the Synapse container itself. The new text goes into
+    a copy of the file (keeping its owner and permissions) that is then
+    renamed over it, so a failed write leaves the old config in place.
+    """
+    result = run_command(
+        "docker compose exec -T synapse sh -c "
+        "'cp -p /data/homeserver.yaml /data/homeserver.yaml.bak"
+        " && cp -p /data/homeserver.yaml /data/homeserver.yaml.new"
+        " && cat > /data/homeserver.yaml.new"
+        " && mv /data/homeserver.yaml.new /data/homeserver.yaml'",
+        input=text
+    )
+    if not result['success']:
+        raise RuntimeError(f"Failed to write homeserver.yaml: {result['stderr']}")
+
+
+def synapse_healthy(timeout=2):
+    """Return True if Synapse's /health endpoint answers 200."""
+    try:
+        with urllib.request.urlopen(f"{SYNAPSE_URL}/health", timeout=timeout) as resp:
+            return resp.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def measure_synapse_downtime(restart):
+    """Run restart() while polling /health to time the unavailability window.
+
+    Returns restart()'s result and a measurement: how long the restart
+    command took, and the time from the first failed health check to the
+    first successful one after it.
+    """
+    outcome = {}
+
+    def run_restart():
+        started = time.monotonic()
+        outcome['result'] = restart()
+        outcome['restart_seconds'] = round(time.monotonic() - started, 2)
+
+    worker = threading.Thread(target=run_restart, daemon=True)
+    started = time.monotonic()
+    worker.start()
+
+    down_at = None
+    up_at = None
+    while time.monotonic() - started < SYNAPSE_RESTART_TIMEOUT:
+        healthy = synapse_healthy()
+        now = time.monotonic()
+        if not healthy and down_at is None:
+            down_at = now
+        elif healthy and (down_at is not None or not worker.is_alive()):
+            # Back up, or the restart finished without us catching it down
+            up_at = now
+            break
+        time.sleep(HEALTH_POLL_INTERVAL)
+    worker.join(timeout=max(0, SYNAPSE_RESTART_TIMEOUT - (time.monotonic() - started)))
+
+    unavailable = None
+    if up_at is not None:
+        unavailable = round(up_at - down_at, 2) if down_at is not None else 0.0
+    return outcome.get('result'), {
+        'restart_seconds': outcome.get('restart_seconds'),
+        'unavailable_seconds': unavailable,
+        'recovered': up_at is not None,
+        'poll_interval_seconds': HEALTH_POLL_INTERVAL,
+    }
+
+
+def load_config_apply_history():
+    """Load the history of applied configuration changes."""
+    if CONFIG_APPLY_HISTORY_FILE.exists():
+        try:
+            with open(CONFIG_APPLY_HISTORY_FILE, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load config apply history: {e}")
+    return []
+
+
+def save_config_apply_history(history):
+    """Save the configuration apply history, keeping the most recent runs."""
+    try:
+        CONFIG_APPLY_HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(CONFIG_APPLY_HISTORY_FILE, 'w') as f:
+            json.dump(history[-MAX_CONFIG_APPLY_HISTORY:], f, indent=2)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save config apply history: {e}")
+        return False
+
+
+def apply_pending_changes():
+    """Apply every staged change with at most one Synapse restart."""
+    started = time.time()
+    pending = load_pending_changes()
+    record = {
+        'started': datetime.now().isoformat(),
+        'settings': pending,
+        'success': False,
+    }
+    try:
+        diff = build_pending_diff(pending)
+        record['env'] = diff['env']
+        record['homeserver'] = diff['homeserver']
+        record['restarted'] = diff['restart_required']
+
+        env_values = {change['key']: change['new'] for change in diff['env']}
+        original_env = ENV_FILE.read_text() if env_values else None
+        if env_values and not update_env_values(env_values):
+            raise RuntimeError(f"Failed to update {', '.join(env_values)} in .env")
+
+        if diff['restart_required']:
+            try:
+                write_homeserver_config(diff['homeserver_text'])
+            except Exception as e:
+                if original_env is None:
+                    raise
+                # Put .env back so the two files keep agreeing
+                try:
+                    write_file_in_place(ENV_FILE, original_env)
+                except Exception as restore_error:
+                    raise RuntimeError(
+                        f"{e}. Restoring .env also failed ({restore_error}), "
+                        f"so .env and homeserver.yaml now disagree"
+                    ) from e
+                raise RuntimeError(f"{e}. .env was restored, so no settings were changed") from e
+            logger.info("Restarting Synapse to apply staged configuration changes")
+            result, measurement = measure_synapse_downtime(
+                lambda: run_command('docker compose restart synapse')
+            )
+            record.update(measurement)
+            if not result or not result['success']:
+                raise RuntimeError(f"Synapse restart failed: {result['stderr'] if result else 'no result'}")
+            if not measurement['recovered']:
+                raise RuntimeError(f"Synapse did not become healthy within {SYNAPSE_RESTART_TIMEOUT}s")
+
+        save_pending_changes({})
+        record['success'] = True
+        logger.info(f"Applied staged configuration changes: {record}")
+    except Exception as e:
+        logger.error(f"Failed to apply staged configuration changes: {e}")
+        record['error'] = str(e)
+    finally:
+        record['duration_seconds'] = round(time.time() - started, 2)
+        history = load_config_apply_history()
+        history.append(record)
+        save_config_apply_history(history)
+        config_apply_state['running'] = False
+    return record
+
+
 def get_db_connection():
     """Get a connection to the Synapse PostgreSQL database."""
     try:
@@ -313,6 +973,7 @@ def get_db_connection():
             return None
         
         # Connect to the Synapse database
+        import psycopg2
         conn = psycopg2.connect(
             dbname=DB_NAME,
             user=DB_USER,
@@ -327,36 +988,96 @@ def get_db_connection():
         return None
 
 
-def get_user_statistics():
-    """Get user statistics from Synapse database."""
+def parse_user_filters(params):
+    """Validate the user filters shared by the statistics view and bulk actions.
+
+    Supported filters: never_logged_in, created_after / created_before
+    (YYYY-MM-DD, inclusive) and inactive_days (no login for N days, or never).
+    Raises ValueError for invalid values.
+    """
+    filters = {}
+    if str(params.get('never_logged_in', '')).strip().lower() in ('1', 'true', 'yes'):
+        filters['never_logged_in'] = True
+    for key in ('created_after', 'created_before'):
+        value = (params.get(key) or '').strip()
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"{key} must be a date (YYYY-MM-DD)")
+            filters[key] = value
+    inactive_days = params.get('inactive_days')
+    if inactive_days not in (None, ''):
+        try:
+            inactive_days = int(inactive_days)
+        except (TypeError, ValueError):
+            raise ValueError('inactive_days must be a whole number of days')
+        if inactive_days < 1:
+            raise ValueError('inactive_days must be at least 1')
+        filters['inactive_days'] = inactive_days
+    return filters
+
+
+def user_matches_filters(creation_ts, last_login, filters, now=None):
+    """Check one user against parse_user_filters() output.
+
+    creation_ts is in seconds and last_login in milliseconds (None if the
+    user never logged in), as Synapse stores them.
+    """
+    now = now or datetime.now()
+    if filters.get('never_logged_in') and last_login:
+        return False
+    created = datetime.fromtimestamp(creation_ts) if creation_ts and creation_ts > 0 else None
+    if 'created_after' in filters:
+        if created is None or created < datetime.strptime(filters['created_after'], '%Y-%m-%d'):
+            return False
+    if 'created_before' in filters:
+        end = datetime.strptime(filters['created_before'], '%Y-%m-%d') + timedelta(days=1)
+        if created is None or created >= end:
+            return False
+    if 'inactive_days' in filters and last_login:
+        cutoff = int((now - timedelta(days=filters['inactive_days'])).timestamp() * SYNAPSE_TIMESTAMP_MULTIPLIER)
+        if last_login >= cutoff:
+            return False
+    return True
+
+
+def fetch_users(cursor):
+    """Return (name, creation_ts, admin, deactivated, last_login) for every local user."""
+    # Get all users with their details
+    cursor.execute("""
+        SELECT name, creation_ts, admin, deactivated 
+        FROM users 
+        WHERE name LIKE '@%'
+        AND name NOT LIKE '%:localhost'
+        ORDER BY creation_ts DESC
+    """)
+    users_data = cursor.fetchall()
+    
+    # Get login activity for all users
+    cursor.execute("""
+        SELECT 
+            user_id,
+            MAX(last_seen) as last_login
+        FROM user_ips
+        WHERE user_id LIKE '@%'
+        AND user_id NOT LIKE '%:localhost'
+        GROUP BY user_id
+    """)
+    login_data = {row[0]: row[1] for row in cursor.fetchall()}
+    return [tuple(user) + (login_data.get(user[0]),) for user in users_data]
+
+
+def get_user_statistics(filters=None):
+    """Get user statistics from Synapse database, listing only users matching filters."""
+    filters = filters or {}
     try:
         conn = get_db_connection()
         if not conn:
             return {'error': 'Failed to connect to database'}
         
         cursor = conn.cursor()
-        
-        # Get all users with their details
-        cursor.execute("""
-            SELECT name, creation_ts, admin, deactivated 
-            FROM users 
-            WHERE name LIKE '@%'
-            AND name NOT LIKE '%:localhost'
-            ORDER BY creation_ts DESC
-        """)
-        users_data = cursor.fetchall()
-        
-        # Get login activity for all users
-        cursor.execute("""
-            SELECT 
-                user_id,
-                MAX(last_seen) as last_login
-            FROM user_ips
-            WHERE user_id LIKE '@%'
-            AND user_id NOT LIKE '%:localhost'
-            GROUP BY user_id
-        """)
-        login_data = {row[0]: row[1] for row in cursor.fetchall()}
+        users_data = fetch_users(cursor)
         
         # Calculate timestamps for different periods
         # Synapse stores timestamps in milliseconds since epoch
@@ -398,14 +1119,9 @@ def get_user_statistics():
         
         # Process user data
         users = []
-        for user in users_data:
-            username = user[0]
-            creation_ts = user[1]
-            is_admin = user[2]
-            is_deactivated = user[3]
-            
-            # Get last login timestamp
-            last_login = login_data.get(username)
+        for username, creation_ts, is_admin, is_deactivated, last_login in users_data:
+            if not user_matches_filters(creation_ts, last_login, filters, now):
+                continue
             
             # Determine if user was active in each period
             active_in_1_day = False
@@ -433,6 +1149,8 @@ def get_user_statistics():
             'active_1_day': active_1_day,
             'active_7_days': active_7_days,
             'active_28_days': active_28_days,
+            'filters': filters,
+            'matching_users': len(users),
             'users': users
         }
     except Exception as e:
@@ -440,6 +1158,735 @@ def get_user_statistics():
         return {'error': str(e)}
 
 
+def get_synapse_admin_token():
+    """Get the Synapse admin access token from the environment or .env file."""
+    token = os.environ.get('SYNAPSE_ADMIN_TOKEN') or read_env_file().get('SYNAPSE_ADMIN_TOKEN', '')
+    return token.strip()
+
+
+def synapse_admin_request(method, path, body=None, timeout=60):
+    """Call the Synapse admin API and return the decoded JSON response."""
+    token = get_synapse_admin_token()
+    if not token:
+        raise RuntimeError('SYNAPSE_ADMIN_TOKEN is not configured')
+
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(
+        f"{SYNAPSE_URL}{path}",
+        data=data,
+        method=method,
+        headers={
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            payload = resp.read()
+    except urllib.error.HTTPError as e:
+        detail = e.read().decode('utf-8', errors='replace')
+        raise RuntimeError(f"Synapse admin API {method} {path} failed ({e.code}): {detail}")
+    return json.loads(payload) if payload else {}
+
+
+def select_bulk_users(action, filters):
+    """Return the user IDs a bulk action would apply to.
+
+    Admins are never selected, and deactivated users only for media purges.
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('Failed to connect to database')
+    try:
+        cursor = conn.cursor()
+        users_data = fetch_users(cursor)
+        cursor.close()
+    finally:
+        conn.close()
+
+    now = datetime.now()
+    return [
+        username
+        for username, creation_ts, is_admin, is_deactivated, last_login in users_data
+        if not is_admin
+        and (action == 'purge_media' or not is_deactivated)
+        and user_matches_filters(creation_ts, last_login, filters, now)
+    ]
+
+
+def perform_bulk_user_action(action, user_id):
+    """Apply one bulk action to one user through the Synapse admin API."""
+    quoted = urllib.parse.quote(user_id)
+    if action == 'deactivate':
+        synapse_admin_request('POST', f'/_synapse/admin/v1/deactivate/{quoted}', {'erase': False})
+    elif action == 'shadow_ban':
+        synapse_admin_request('POST', f'/_synapse/admin/v1/users/{quoted}/shadow_ban', {})
+    elif action == 'purge_media':
+        # Each call deletes one page of the user's media
+        for page in range(MAX_PURGE_MEDIA_PAGES):
+            if page:
+                # Later pages are paced like every other admin API call
+                bulk_user_job.acquire()
+            result = synapse_admin_request(
+                'DELETE', f'/_synapse/admin/v1/users/{quoted}/media?limit={PURGE_MEDIA_PAGE_SIZE}'
+            )
+            if result.get('total', 0) < PURGE_MEDIA_PAGE_SIZE:
+                break
+        else:
+            raise RuntimeError(
+                f"Stopped after deleting {MAX_PURGE_MEDIA_PAGES * PURGE_MEDIA_PAGE_SIZE} files; run the action again"
+            )
+    else:
+        raise ValueError(f"Unknown bulk action: {action}")
+
+
+def run_bulk_user_job():
+    """Run (or resume) the recorded bulk user job."""
+    try:
+        bulk_user_job.run(perform_bulk_user_action)
+    except Exception as e:
+        logger.error(f"Bulk user job failed: {e}")
+
+
+def start_bulk_user_job():
+    """Run the bulk user job in the background."""
+    get_scheduler().add_job(
+        func=run_bulk_user_job,
+        id='bulk_user_job',
+        name='Bulk user action',
+        replace_existing=True
+    )
+
+
+def load_maintenance_history():
+    """Load database maintenance run history from file."""
+    if MAINTENANCE_HISTORY_FILE.exists():
+        try:
+            with open(MAINTENANCE_HISTORY_FILE, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load maintenance history: {e}")
+    return []
+
+
+def save_maintenance_history(history):
+    """Save database maintenance run history, keeping the most recent runs."""
+    try:
+        MAINTENANCE_HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(MAINTENANCE_HISTORY_FILE, 'w') as f:
+            json.dump(history[-MAX_MAINTENANCE_HISTORY:], f, indent=2)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save maintenance history: {e}")
+        return False
+
+
+def get_table_sizes(cursor, tables):
+    """Return live rows, dead rows and total bytes for the given tables."""
+    cursor.execute("""
+        SELECT relname, n_live_tup, n_dead_tup, pg_total_relation_size(relid)
+        FROM pg_stat_user_tables
+        WHERE relname = ANY(%s)
+    """, (list(tables),))
+    return {
+        row[0]: {'rows': row[1], 'dead_rows': row[2], 'bytes': row[3]}
+        for row in cursor.fetchall()
+    }
+
+
+def diff_table_sizes(before, after):
+    """Summarise rows and bytes reclaimed between two get_table_sizes() snapshots."""
+    tables = {}
+    for name, stats in before.items():
+        new = after.get(name, stats)
+        tables[name] = {
+            'rows_reclaimed': max(stats['rows'] - new['rows'], 0),
+            'bytes_reclaimed': max(stats['bytes'] - new['bytes'], 0),
+            'bytes_after': new['bytes']
+        }
+    return {
+        'rows_reclaimed': sum(t['rows_reclaimed'] for t in tables.values()),
+        'bytes_reclaimed': sum(t['bytes_reclaimed'] for t in tables.values()),
+        'tables': tables
+    }
+
+
+def list_rooms():
+    """Return the IDs of all rooms known to Synapse via the admin API."""
+    rooms = []
+    next_batch = 0
+    while next_batch is not None:
+        data = synapse_admin_request('GET', f'/_synapse/admin/v1/rooms?from={next_batch}&limit=500')
+        rooms.extend(room['room_id'] for room in data.get('rooms', []))
+        next_batch = data.get('next_batch')
+    return rooms
+
+
+def purge_room_history():
+    """Purge room history older than HISTORY_RETENTION_DAYS via the admin API.
+
+    Local events are kept; only remote events and the state that is no
+    longer needed to serve them are removed.
+    """
+    cutoff_ts = int((datetime.now() - timedelta(days=HISTORY_RETENTION_DAYS)).timestamp() * SYNAPSE_TIMESTAMP_MULTIPLIER)
+    tables = ['events', 'event_json', 'state_groups_state', 'event_edges']
+
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'error': 'Failed to connect to database'}
+    try:
+        cursor = conn.cursor()
+        before = get_table_sizes(cursor, tables)
+
+        purged, failed, timed_out = 0, [], []
+        for room_id in list_rooms():
+            room_path = urllib.parse.quote(room_id, safe='')
+            try:
+                data = synapse_admin_request('POST', f'/_synapse/admin/v1/purge_history/{room_path}', {
+                    'delete_local_events': False,
+                    'purge_up_to_ts': cutoff_ts
+                })
+                purge_id = data.get('purge_id')
+                deadline = time.monotonic() + PURGE_STATUS_TIMEOUT
+                status = 'active'
+                while purge_id and status == 'active' and time.monotonic() < deadline:
+                    time.sleep(2)
+                    status = synapse_admin_request(
+                        'GET', f'/_synapse/admin/v1/purge_history_status/{purge_id}'
+                    ).get('status')
+                if status == 'failed':
+                    failed.append(room_id)
+                elif status == 'active':
+                    # Still running when we stopped polling, so it can't be counted as done
+                    timed_out.append(room_id)
+                else:
+                    purged += 1
+            except RuntimeError as e:
+                # Rooms with no events before the cutoff return 400; skip them
+                logger.info(f"Skipping history purge for {room_id}: {e}")
+            except (urllib.error.URLError, OSError) as e:
+                # Synapse unreachable or too slow for this room; carry on with the rest
+                logger.error(f"History purge for {room_id} failed: {e}")
+                failed.append(room_id)
+
+        # Refresh planner statistics so the row counts reflect the purge
+        conn.commit()
+        cursor.execute(f"ANALYZE {', '.join(tables)}")
+        conn.commit()
+        result = diff_table_sizes(before, get_table_sizes(cursor, tables))
+        cursor.close()
+    finally:
+        conn.close()
+
+    result.update({
+        'success': not failed and not timed_out,
+        'rooms_purged': purged,
+        'rooms_failed': failed,
+        'rooms_timed_out': timed_out
+    })
+    if timed_out:
+        result['error'] = 'timed out waiting for purge'
+    return result
+
+
+def purge_remote_media():
+    """Purge cached remote media not accessed in REMOTE_MEDIA_RETENTION_DAYS."""
+    cutoff_ts = int((datetime.now() - timedelta(days=REMOTE_MEDIA_RETENTION_DAYS)).timestamp() * SYNAPSE_TIMESTAMP_MULTIPLIER)
+
+    # Synapse only reports the number of files deleted, so measure the
+    # size of what is about to go from the remote_media_cache table first
+    bytes_reclaimed = 0
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COALESCE(SUM(media_length), 0)
+                FROM remote_media_cache
+                WHERE last_access_ts < %s
+            """, (cutoff_ts,))
+            bytes_reclaimed = cursor.fetchone()[0]
+            cursor.close()
+        finally:
+            conn.close()
+
+    data = synapse_admin_request('POST', f'/_synapse/admin/v1/purge_media_cache?before_ts={cutoff_ts}', {})
+    return {
+        'success': True,
+        'rows_reclaimed': data.get('deleted', 0),
+        'bytes_reclaimed': int(bytes_reclaimed)
+    }
+
+
+def prune_user_ips():
+    """Delete user_ips rows older than USER_IPS_RETENTION_DAYS.
+
+    The most recent row for each user is always kept so the last login
+    shown in the user statistics stays accurate.
+    """
+    cutoff_ts = int((datetime.now() - timedelta(days=USER_IPS_RETENTION_DAYS)).timestamp() * SYNAPSE_TIMESTAMP_MULTIPLIER)
+
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'error': 'Failed to connect to database'}
+    try:
+        cursor = conn.cursor()
+        before = get_table_sizes(cursor, ['user_ips'])
+        cursor.execute("""
+            DELETE FROM user_ips u
+            WHERE u.last_seen < %s
+            AND EXISTS (
+                SELECT 1 FROM user_ips newer
+                WHERE newer.user_id = u.user_id
+                AND newer.last_seen > u.last_seen
+            )
+        """, (cutoff_ts,))
+        rows_deleted = cursor.rowcount
+        conn.commit()
+        after = get_table_sizes(cursor, ['user_ips'])
+        cursor.close()
+    finally:
+        conn.close()
+
+    result = diff_table_sizes(before, after)
+    result.update({'success': True, 'rows_reclaimed': rows_deleted})
+    return result
+
+
+def vacuum_largest_tables():
+    """Run VACUUM (ANALYZE) on the VACUUM_TABLE_LIMIT largest tables."""
+    from psycopg2 import sql
+
+    conn = get_db_connection()
+    if not conn:
+        return {'success': False, 'error': 'Failed to connect to database'}
+    try:
+        # VACUUM cannot run inside a transaction block
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT schemaname, relname
+            FROM pg_stat_user_tables
+            ORDER BY pg_total_relation_size(relid) DESC
+            LIMIT %s
+        """, (VACUUM_TABLE_LIMIT,))
+        tables = cursor.fetchall()
+        before = get_table_sizes(cursor, [table for _, table in tables])
+
+        for schema, table in tables:
+            logger.info(f"Vacuuming table: {schema}.{table}")
+            cursor.execute(sql.SQL('VACUUM (ANALYZE) {}').format(sql.Identifier(schema, table)))
+
+        after = get_table_sizes(cursor, [table for _, table in tables])
+        cursor.close()
+    finally:
+        conn.close()
+
+    result = diff_table_sizes(before, after)
+    # Plain VACUUM marks dead rows reusable rather than shrinking files,
+    # so the dead rows cleared are the main measure of what was reclaimed
+    result.update({
+        'success': True,
+        'rows_reclaimed': sum(
+            max(stats['dead_rows'] - after.get(name, stats)['dead_rows'], 0)
+            for name, stats in before.items()
+        )
+    })
+    return result
+
+
+def reserve_background_job(state):
+    """Mark a single-instance background job as running; False if it already is."""
+    with background_job_lock:
+        if state['running']:
+            return False
+        state['running'] = True
+        return True
+
+
+def reserve_maintenance_task(task_type):
+    """Mark a maintenance task as running; False if it already is."""
+    with running_maintenance_lock:
+        if task_type in running_maintenance:
+            return False
+        running_maintenance.add(task_type)
+        return True
+
+
+def run_maintenance_task(task_type, reserved=False):
+    """Run a database maintenance task and record its result in the history.
+
+    reserved means the caller already added task_type to running_maintenance.
+    """
+    tasks = {
+        'purge_history': purge_room_history,
+        'purge_media': purge_remote_media,
+        'prune_user_ips': prune_user_ips,
+        'vacuum': vacuum_largest_tables
+    }
+    if task_type not in tasks:
+        raise ValueError(f"Invalid maintenance task: {task_type}")
+
+    if not reserved and not reserve_maintenance_task(task_type):
+        logger.warning(f"Maintenance task {task_type} is already running, skipping")
+        return {'success': False, 'error': f"{task_type} is already running"}
+
+    logger.info(f"Running maintenance task: {task_type}")
+    started = datetime.now()
+    start_time = time.monotonic()
+    try:
+        result = tasks[task_type]()
+    except Exception as e:
+        logger.error(f"Maintenance task {task_type} failed: {e}")
+        result = {'success': False, 'error': str(e)}
+    finally:
+        with running_maintenance_lock:
+            running_maintenance.discard(task_type)
+
+    result.update({
+        'task': task_type,
+        'started': started.isoformat(),
+        'duration_seconds': round(time.monotonic() - start_time, 2)
+    })
+    logger.info(
+        f"Maintenance task {task_type} finished in {result['duration_seconds']}s: "
+        f"{result.get('rows_reclaimed', 0)} rows, {result.get('bytes_reclaimed', 0)} bytes reclaimed"
+    )
+
+    history = load_maintenance_history()
+    history.append(result)
+    save_maintenance_history(history)
+    return result
+
+
+def load_db_analysis():
+    """Load the cached database analysis from file."""
+    if DB_ANALYSIS_FILE.exists():
+        try:
+            with open(DB_ANALYSIS_FILE, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load database analysis: {e}")
+    return None
+
+
+def save_db_analysis(analysis):
+    """Save the database analysis to the cache file."""
+    try:
+        DB_ANALYSIS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(DB_ANALYSIS_FILE, 'w') as f:
+            json.dump(analysis, f, indent=2)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to save database analysis: {e}")
+        return False
+
+
+def analyze_tables(cursor):
+    """Per-table size, dead tuple ratio, scan counts and estimated bloat."""
+    cursor.execute("""
+        SELECT relname,
+               pg_table_size(relid),
+               pg_indexes_size(relid),
+               pg_total_relation_size(relid),
+               n_live_tup,
+               n_dead_tup,
+               COALESCE(seq_scan, 0),
+               COALESCE(seq_tup_read, 0),
+               COALESCE(idx_scan, 0),
+               GREATEST(last_vacuum, last_autovacuum)
+        FROM pg_stat_user_tables
+        ORDER BY pg_total_relation_size(relid) DESC
+        LIMIT %s
+    """, (DB_ANALYSIS_TOP_N,))
+    tables = []
+    for row in cursor.fetchall():
+        live, dead = row[4], row[5]
+        seq_scan, idx_scan = row[6], row[8]
+        tables.append({
+            'table': row[0],
+            'table_bytes': row[1],
+            'index_bytes': row[2],
+            'total_bytes': row[3],
+            'live_rows': live,
+            'dead_rows': dead,
+            'dead_ratio': round(dead / (live + dead), 4) if live + dead else 0,
+            'seq_scans': seq_scan,
+            'seq_rows_read': row[7],
+            'index_scans': idx_scan,
+            'seq_scan_ratio': round(seq_scan / (seq_scan + idx_scan), 4) if seq_scan + idx_scan else 0,
+            'last_vacuum': row[9].isoformat() if row[9] else None
+        })
+
+    # Estimate bloat by comparing the pages a table uses with the pages its
+    # rows would need, from the average column widths in pg_stats. Each row
+    # costs a 24 byte header plus a 4 byte line pointer; each page loses 24
+    # bytes to its own header.
+    cursor.execute("""
+        SELECT c.relname,
+               c.relpages::bigint * current_setting('block_size')::bigint,
+               CEIL(c.reltuples * (28 + COALESCE(SUM((1 - s.null_frac) * s.avg_width), 0))
+                    / (current_setting('block_size')::int - 24))::bigint
+                    * current_setting('block_size')::bigint
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname
+        WHERE c.relkind = 'r'
+        AND n.nspname = 'public'
+        AND c.relname = ANY(%s)
+        GROUP BY c.relname, c.relpages, c.reltuples
+    """, ([t['table'] for t in tables],))
+    bloat = {}
+    for name, actual, expected in cursor.fetchall():
+        wasted = max((actual or 0) - (expected or 0), 0)
+        bloat[name] = (wasted, round(wasted / actual, 4) if actual else 0)
+
+    for table in tables:
+        table['bloat_bytes'], table['bloat_ratio'] = bloat.get(table['table'], (0, 0))
+    return tables
+
+
+def analyze_indexes(cursor):
+    """Per-index size and scan counts, largest first."""
+    cursor.execute("""
+        SELECT indexrelname, relname, pg_relation_size(indexrelid), COALESCE(idx_scan, 0)
+        FROM pg_stat_user_indexes
+        ORDER BY pg_relation_size(indexrelid) DESC
+        LIMIT %s
+    """, (DB_ANALYSIS_TOP_N,))
+    return [
+        {'index': row[0], 'table': row[1], 'bytes': row[2], 'scans': row[3]}
+        for row in cursor.fetchall()
+    ]
+
+
+def analyze_slow_statements(cursor, conn):
+    """Top statements by total execution time, if pg_stat_statements is installed."""
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    if not cursor.fetchone():
+        return None
+    try:
+        cursor.execute("""
+            SELECT query, calls, total_exec_time, mean_exec_time, rows
+            FROM pg_stat_statements
+            ORDER BY total_exec_time DESC
+            LIMIT %s
+        """, (DB_ANALYSIS_TOP_N,))
+        return [
+            {
+                'query': row[0],
+                'calls': row[1],
+                'total_ms': round(row[2], 1),
+                'mean_ms': round(row[3], 2),
+                'rows': row[4]
+            }
+            for row in cursor.fetchall()
+        ]
+    except Exception as e:
+        # The extension exists but is not loaded via shared_preload_libraries
+        logger.warning(f"pg_stat_statements unavailable: {e}")
+        conn.rollback()
+        return None
+
+
+def analyze_rooms(cursor):
+    """Largest rooms by event count and by state group row count."""
+    cursor.execute("""
+        SELECT e.room_id, r.name, COUNT(*)
+        FROM events e
+        LEFT JOIN room_stats_state r ON r.room_id = e.room_id
+        GROUP BY e.room_id, r.name
+        ORDER BY COUNT(*) DESC
+        LIMIT %s
+    """, (DB_ANALYSIS_TOP_N,))
+    by_events = [
+        {'room_id': row[0], 'name': row[1], 'events': row[2]}
+        for row in cursor.fetchall()
+    ]
+
+    cursor.execute("""
+        SELECT s.room_id, r.name, COUNT(*)
+        FROM state_groups_state s
+        LEFT JOIN room_stats_state r ON r.room_id = s.room_id
+        GROUP BY s.room_id, r.name
+        ORDER BY COUNT(*) DESC
+        LIMIT %s
+    """, (DB_ANALYSIS_TOP_N,))
+    by_state = [
+        {'room_id': row[0], 'name': row[1], 'state_rows': row[2]}
+        for row in cursor.fetchall()
+    ]
+    return {'by_events': by_events, 'by_state': by_state}
+
+
+def run_db_analysis(reserved=False):
+    """Analyze the Synapse database and cache the result.
+
+    reserved means the caller already marked db_analysis_state as running.
+    """
+    if not reserved and not reserve_background_job(db_analysis_state):
+        return None
+    start_time = time.monotonic()
+    try:
+        conn = get_db_connection()
+        if not conn:
+            analysis = {'error': 'Failed to connect to database'}
+        else:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT pg_database_size(current_database())")
+                database_bytes = cursor.fetchone()[0]
+                analysis = {
+                    'database_bytes': database_bytes,
+                    'tables': analyze_tables(cursor),
+                    'indexes': analyze_indexes(cursor),
+                    'slow_statements': analyze_slow_statements(cursor, conn),
+                    'rooms': analyze_rooms(cursor)
+                }
+                cursor.close()
+            finally:
+                conn.close()
+    except Exception as e:
+        logger.error(f"Database analysis failed: {e}")
+        analysis = {'error': str(e)}
+    finally:
+        db_analysis_state['running'] = False
+
+    analysis['generated'] = datetime.now().isoformat()
+    analysis['duration_seconds'] = round(time.monotonic() - start_time, 2)
+    save_db_analysis(analysis)
+    return analysis
+
+
+def start_db_analysis():
+    """Run the database analysis in the background unless it is already running."""
+    # Reserved here, under the lock, so two requests can't both start it
+    if not reserve_background_job(db_analysis_state):
+        return False
+    try:
+        get_scheduler().add_job(
+            func=run_db_analysis,
+            kwargs={'reserved': True},
+            id='db_analysis',
+            name='Database analysis',
+            replace_existing=True
+        )
+    except Exception:
+        db_analysis_state['running'] = False
+        raise
+    return True
+
+
+def get_media_store_dir():
+    """Return the media store path as seen from inside the admin container."""
+    # homeserver.yaml paths are relative to the Synapse container's /data
+    media_store_path = get_homeserver_config_value('media_store_path') or '/data/media_store'
+    if media_store_path.startswith('/data/'):
+        return PROJECT_DIR / 'synapse_data' / media_store_path[len('/data/'):]
+    return PROJECT_DIR / 'synapse_data' / 'media_store'
+
+
+# The media store path comes from homeserver.yaml, so it is resolved on first scan
+media_index = MediaIndex(get_media_store_dir, MEDIA_INDEX_FILE, workers=MEDIA_SCAN_WORKERS)
+bulk_user_job = BulkUserJob(BULK_USER_JOB_FILE, workers=BULK_USER_WORKERS, rate=BULK_USER_RATE)
+log_archive = LogArchive(LOG_ARCHIVE_DIR, max_bytes=LOG_ARCHIVE_MAX_MB * 1024 * 1024)
+media_cache_stats = MediaCacheStats(NGINX_LOGS_DIR / 'media-cache.log', MEDIA_CACHE_STATS_FILE)
+access_log_stats = AccessLogStats(NGINX_LOGS_DIR / 'access.json.log', ACCESS_LOG_STATS_FILE)
+
+
+def list_compose_containers():
+    """Return {service: container_id} for the running compose services."""
+    result = run_command('docker compose ps --format json')
+    if not result['success']:
+        raise RuntimeError(result['stderr'])
+    containers = {}
+    for line in result['stdout'].strip().split('\n'):
+        if line:
+            info = json.loads(line)
+            if info.get('State') == 'running':
+                containers[info.get('Service', info.get('Name', ''))] = info['ID']
+    return containers
+
+
+synapse_metrics = SynapseMetrics(
+    SYNAPSE_METRICS_URL,
+    interval=SYNAPSE_METRICS_INTERVAL,
+    cache_hit_ratio_threshold=SYNAPSE_CACHE_HIT_RATIO_ALERT,
+    slow_transaction_seconds=SYNAPSE_SLOW_TRANSACTION_SECONDS
+)
+
+
+def synapse_metrics_enabled():
+    """Whether the Synapse metrics listener is switched on in .env."""
+    return read_env_file().get('ENABLE_METRICS', 'false').strip().lower() == 'true'
+
+
+def scrape_synapse_metrics():
+    """Take a metrics snapshot if the metrics listener is enabled."""
+    if synapse_metrics_enabled():
+        synapse_metrics.scrape()
+
+
+resource_sampler = ResourceSampler(
+    list_compose_containers,
+    interval=RESOURCE_SAMPLE_INTERVAL,
+    cpu_alert_percent=RESOURCE_CPU_ALERT_PERCENT,
+    memory_alert_percent=RESOURCE_MEMORY_ALERT_PERCENT
+)
+
+
+def rotate_nginx_log(tailer, name):
+    """Rotate an nginx log on the shared volume once it has grown large.
+
+    The volume is read-only here, so nginx renames its own file to
+    <name>.1 and reopens its logs. Lines written after our last read stay in
+    <name>.1, which the tailer finishes before moving to the new file; the
+    previous <name>.1 is only replaced once the tailer has moved on from it.
+    """
+    if tailer.size() <= NGINX_LOG_MAX_BYTES:
+        return
+    try:
+        if os.stat(tailer.path).st_ino != tailer.inode:
+            # Not caught up with the current file yet
+            return
+    except FileNotFoundError:
+        return
+    logger.info(f"Rotating nginx log: {name}")
+    path = f"/var/log/nginx/shared/{name}"
+    result = run_command(
+        f"docker compose exec -T nginx sh -c 'mv -f {path} {path}.1 && nginx -s reopen'"
+    )
+    if not result['success']:
+        logger.error(f"Failed to rotate nginx log {name}: {result['stderr']}")
+
+
+def update_media_cache_stats():
+    """Read new media cache log lines and keep the log file bounded."""
+    try:
+        media_cache_stats.update()
+        rotate_nginx_log(media_cache_stats.tailer, 'media-cache.log')
+    except Exception as e:
+        logger.error(f"Failed to update media cache stats: {e}")
+
+
+def update_access_log_stats():
+    """Fold new access log lines into per-minute traffic stats."""
+    try:
+        access_log_stats.update()
+        rotate_nginx_log(access_log_stats.tailer, 'access.json.log')
+    except Exception as e:
+        logger.error(f"Failed to update access log stats: {e}")
+
+
+def scan_media_store():
+    """Update the media store index, logging rather than raising on failure."""
+    try:
+        return media_index.scan()
+    except Exception as e:
+        logger.error(f"Media store scan failed: {e}")
+        return None
+
+
 @app.route('/')
 def index():
     """Admin console home page."""
@@ -502,6 +1949,17 @@ def get_status():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/resources')
+@login_required
+def get_resources():
+    """Current and recent CPU, memory, disk and network use per service."""
+    try:
+        return jsonify({'success': True, **resource_sampler.report()})
+    except Exception as e:
+        logger.error(f"Failed to report resource usage: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/update-repo', methods=['POST'])
 @login_required
 def update_repo():
@@ -573,6 +2031,68 @@ def service_action(action):
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+def parse_time_param(value):
+    """Parse an epoch seconds or ISO 8601 query parameter."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def start_log_collector():
+    """Follow the logs of every compose service into the log archive."""
+    result = run_command('docker compose config --services')
+    if not result['success']:
+        logger.error(f"Failed to list services for log collection: {result['stderr']}")
+        return None
+    services = [sanitize_service_name(s) for s in result['stdout'].split() if s]
+    collector = LogCollector(log_archive, services, cwd=PROJECT_DIR)
+    collector.start()
+    return collector
+
+
+@app.route('/api/logs/search')
+@login_required
+def search_logs():
+    """Search the log archive by text, service, level and time range."""
+    try:
+        services = [
+            sanitize_service_name(s)
+            for s in request.args.get('service', '').split(',') if s
+        ]
+        level = request.args.get('level') or None
+        if level and level not in LEVELS:
+            return jsonify({'success': False, 'error': f"Invalid level: {level}"}), 400
+        start = parse_time_param(request.args.get('since'))
+        end = parse_time_param(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_LOG_SEARCH_RESULTS))
+        if limit < 1 or limit > MAX_LOG_SEARCH_RESULTS:
+            limit = DEFAULT_LOG_SEARCH_RESULTS
+    except ValueError:
+        limit = DEFAULT_LOG_SEARCH_RESULTS
+
+    try:
+        result = log_archive.search(
+            query=request.args.get('q', ''),
+            services=services or None,
+            min_level=level,
+            start=start,
+            end=end,
+            limit=limit
+        )
+        result['archive'] = log_archive.stats()
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        logger.error(f"Log search failed: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/logs/<service>')
 @login_required
 def get_logs(service):
@@ -615,6 +2135,198 @@ def create_backup():
         return jsonify(result), 500
 
 
+@app.route('/api/backup/verify', methods=['POST'])
+@login_required
+def verify_backup():
+    """Start checking a backup's checksums, optionally with a full test restore."""
+    data = request.get_json(silent=True) or {}
+    restore = bool(data.get('restore'))
+    filename = data.get('filename') or None
+    if filename is not None and not str(filename).startswith(BACKUP_PREFIX):
+        return jsonify({'success': False, 'error': 'Invalid backup name'}), 400
+    try:
+        if not start_backup_check(restore=restore, filename=filename):
+            return jsonify({'success': False, 'error': 'A backup check is already running'}), 409
+    except Exception as e:
+        logger.error(f"Failed to start backup check: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    message = 'Test restore started' if restore else 'Backup verification started'
+    return jsonify({'success': True, 'message': message})
+
+
+@app.route('/api/backup/history', methods=['GET'])
+@login_required
+def get_backup_history():
+    """Get recent backups, verifications and restore tests."""
+    return jsonify({
+        'success': True,
+        'running': backup_check_state['running'],
+        'history': list(reversed(load_backup_history()))
+    })
+
+
+@app.route('/api/maintenance/history', methods=['GET'])
+@login_required
+def get_maintenance_history():
+    """Get the results of recent database maintenance runs."""
+    history = load_maintenance_history()
+    return jsonify({'success': True, 'history': list(reversed(history))})
+
+
+@app.route('/api/maintenance/<task_type>', methods=['POST'])
+@login_required
+def run_maintenance(task_type):
+    """Start a database maintenance task in the background."""
+    if task_type not in MAINTENANCE_TASKS:
+        return jsonify({'success': False, 'error': f"Invalid maintenance task: {task_type}"}), 400
+
+    # Reserved here, under the lock, so two requests can't both start it
+    if not reserve_maintenance_task(task_type):
+        return jsonify({'success': False, 'error': f"{task_type} is already running"}), 409
+
+    logger.info(f"Starting maintenance task: {task_type}")
+    try:
+        get_scheduler().add_job(
+            func=run_maintenance_task,
+            args=[task_type],
+            kwargs={'reserved': True},
+            id=f"maintenance_now_{task_type}",
+            name=f"Maintenance - {task_type}",
+            replace_existing=True
+        )
+    except Exception:
+        with running_maintenance_lock:
+            running_maintenance.discard(task_type)
+        raise
+    return jsonify({
+        'success': True,
+        'message': f"{task_type} started. Results will appear in the maintenance history."
+    })
+
+
+@app.route('/api/db/analysis', methods=['GET'])
+@login_required
+def get_db_analysis():
+    """Get the cached database analysis, refreshing it in the background when stale."""
+    analysis = load_db_analysis()
+
+    stale = True
+    if analysis and analysis.get('generated'):
+        stale = datetime.now() - datetime.fromisoformat(analysis['generated']) > DB_ANALYSIS_MAX_AGE
+    if stale:
+        start_db_analysis()
+
+    return jsonify({
+        'success': True,
+        'analysis': analysis,
+        'running': db_analysis_state['running'] or stale
+    })
+
+
+@app.route('/api/db/analysis', methods=['POST'])
+@login_required
+def refresh_db_analysis():
+    """Start a fresh database analysis in the background."""
+    logger.info("Starting database analysis")
+    start_db_analysis()
+    return jsonify({'success': True, 'message': 'Database analysis started'})
+
+
+@app.route('/api/media/usage', methods=['GET'])
+@login_required
+def get_media_usage():
+    """Get media store usage from the index built by the last scan."""
+    try:
+        top_n = int(request.args.get('top', DEFAULT_MEDIA_TOP_FILES))
+        if top_n < 1 or top_n > MAX_MEDIA_TOP_FILES:
+            top_n = DEFAULT_MEDIA_TOP_FILES
+    except ValueError:
+        top_n = DEFAULT_MEDIA_TOP_FILES
+
+    try:
+        report = media_index.report(top_n=top_n)
+        return jsonify({
+            'success': True,
+            'usage': report,
+            'scanning': media_index.scanning
+        })
+    except Exception as e:
+        logger.error(f"Failed to read media index: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/media-cache', methods=['GET'])
+@login_required
+def get_media_cache_stats():
+    """Get media cache hit ratio and bytes served from the nginx cache."""
+    try:
+        media_cache_stats.update()
+        env_vars = read_env_file()
+        return jsonify({
+            'success': True,
+            'enabled': env_vars.get('ENABLE_MEDIA_CACHE', 'false').strip().lower() == 'true',
+            'stats': media_cache_stats.report(hours=24)
+        })
+    except Exception as e:
+        logger.error(f"Failed to get media cache stats: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/nginx/traffic', methods=['GET'])
+@login_required
+def get_nginx_traffic():
+    """Get request rates, status codes and latency percentiles per endpoint group."""
+    try:
+        minutes = int(request.args.get('minutes', DEFAULT_TRAFFIC_MINUTES))
+        if minutes < 1 or minutes > MAX_TRAFFIC_MINUTES:
+            minutes = DEFAULT_TRAFFIC_MINUTES
+    except ValueError:
+        minutes = DEFAULT_TRAFFIC_MINUTES
+
+    try:
+        access_log_stats.update()
+        return jsonify({
+            'success': True,
+            'minutes': minutes,
+            'traffic': access_log_stats.report(minutes=minutes)
+        })
+    except Exception as e:
+        logger.error(f"Failed to get nginx traffic stats: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/synapse/performance')
+@login_required
+def get_synapse_performance():
+    """Synapse cache, /sync, reactor and database metrics with alerts."""
+    try:
+        return jsonify({
+            'success': True,
+            'enabled': synapse_metrics_enabled(),
+            **synapse_metrics.report()
+        })
+    except Exception as e:
+        logger.error(f"Failed to report Synapse performance: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/media/scan', methods=['POST'])
+@login_required
+def start_media_scan():
+    """Start an incremental media store scan in the background."""
+    if media_index.scanning:
+        return jsonify({'success': False, 'error': 'A media scan is already running'}), 409
+
+    logger.info("Starting media store scan")
+    get_scheduler().add_job(
+        func=scan_media_store,
+        id='media_scan_now',
+        name='Media store scan',
+        replace_existing=True
+    )
+    return jsonify({'success': True, 'message': 'Media scan started'})
+
+
 @app.route('/api/schedules', methods=['GET'])
 @login_required
 def get_schedules():
@@ -623,7 +2335,7 @@ def get_schedules():
     
     # Get currently running jobs from APScheduler
     jobs = []
-    for job in scheduler.get_jobs():
+    for job in get_scheduler().get_jobs():
         jobs.append({
             'id': job.id,
             'name': job.name,
@@ -642,7 +2354,7 @@ def add_schedule():
     """Add a new scheduled task."""
     data = request.get_json()
     
-    task_type = data.get('type')  # 'update', 'restart', 'backup'
+    task_type = data.get('type')  # 'update', 'restart', 'backup' or a MAINTENANCE_TASKS entry
     schedule = data.get('schedule')  # cron expression or simple format
     enabled = data.get('enabled', True)
     
@@ -651,25 +2363,9 @@ def add_schedule():
     
     # Parse schedule (simple format: "daily", "weekly", "monthly" or cron)
     try:
-        if schedule == 'daily':
-            trigger = CronTrigger(hour=3, minute=0)
-        elif schedule == 'weekly':
-            trigger = CronTrigger(day_of_week='sun', hour=3, minute=0)
-        elif schedule == 'monthly':
-            trigger = CronTrigger(day=1, hour=3, minute=0)
-        else:
-            # Assume it's a cron expression
-            parts = schedule.split()
-            if len(parts) == 5:
-                trigger = CronTrigger(
-                    minute=parts[0],
-                    hour=parts[1],
-                    day=parts[2],
-                    month=parts[3],
-                    day_of_week=parts[4]
-                )
-            else:
-                return jsonify({'error': 'Invalid schedule format'}), 400
+        trigger = parse_schedule_trigger(schedule)
+        if trigger is None:
+            return jsonify({'error': 'Invalid schedule format'}), 400
         
         # Create scheduled task function
         try:
@@ -682,7 +2378,7 @@ def add_schedule():
         
         if enabled:
             # Add job to scheduler
-            scheduler.add_job(
+            get_scheduler().add_job(
                 func=func,
                 trigger=trigger,
                 id=schedule_id,
@@ -716,8 +2412,8 @@ def delete_schedule(schedule_id):
     """Delete a scheduled task."""
     try:
         # Remove from scheduler
-        if scheduler.get_job(schedule_id):
-            scheduler.remove_job(schedule_id)
+        if get_scheduler().get_job(schedule_id):
+            get_scheduler().remove_job(schedule_id)
         
         # Remove from file
         schedules = load_schedules()
@@ -757,65 +2453,148 @@ def get_server_settings():
                 'enable_federation': enable_federation,
                 'actual_registration': actual_registration,
                 'actual_federation_enabled': actual_federation_allows_all
-            }
+            },
+            'pending': load_pending_changes()
         })
     except Exception as e:
         logger.error(f"Failed to get server settings: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+def pending_changes_response(pending):
+    """Describe staged settings and the diff they would apply."""
+    diff = build_pending_diff(pending)
+    return {
+        'success': True,
+        'pending': pending,
+        'env': diff['env'],
+        'homeserver': diff['homeserver'],
+        'restart_required': diff['restart_required'],
+        'applying': config_apply_state['running']
+    }
+
+
 @app.route('/api/config/server-settings', methods=['POST'])
 @login_required
 def update_server_settings():
-    """Update registration and federation settings."""
+    """Stage registration and federation settings to be applied together."""
     try:
-        data = request.get_json()
-        enable_registration = data.get('enable_registration')
-        enable_federation = data.get('enable_federation')
+        data = request.get_json() or {}
+        staged = {key: data[key] for key in SERVER_SETTINGS if data.get(key) is not None}
         
         # Validate inputs
-        if enable_registration is None and enable_federation is None:
+        if not staged:
             return jsonify({'error': 'No settings provided'}), 400
+        if not all(isinstance(value, bool) for value in staged.values()):
+            return jsonify({'error': 'Settings must be true or false'}), 400
         
-        # Update .env file
-        if enable_registration is not None:
-            value = 'true' if enable_registration else 'false'
-            if not update_env_file('ENABLE_REGISTRATION', value):
-                return jsonify({'error': 'Failed to update ENABLE_REGISTRATION in .env'}), 500
-            logger.info(f"Updated ENABLE_REGISTRATION to {value}")
-        
-        if enable_federation is not None:
-            value = 'true' if enable_federation else 'false'
-            if not update_env_file('ENABLE_FEDERATION', value):
-                return jsonify({'error': 'Failed to update ENABLE_FEDERATION in .env'}), 500
-            logger.info(f"Updated ENABLE_FEDERATION to {value}")
-        
-        # Restart synapse to apply changes
-        logger.info("Restarting Synapse to apply configuration changes")
-        restart_result = run_command('docker compose restart synapse')
-        
-        if not restart_result['success']:
-            return jsonify({
-                'success': False,
-                'warning': 'Settings updated in .env but Synapse restart failed. Please restart manually.',
-                'error': restart_result['stderr']
-            }), 500
+        pending = load_pending_changes()
+        pending.update(staged)
+        # Drop settings that are staged back to their current value
+        for setting in list(pending):
+            diff = build_pending_diff({setting: pending[setting]})
+            if not diff['env'] and not diff['homeserver']:
+                del pending[setting]
         
-        return jsonify({
-            'success': True,
-            'message': 'Settings updated successfully. Synapse is restarting...'
-        })
+        if not save_pending_changes(pending):
+            return jsonify({'error': 'Failed to save pending changes'}), 500
+        logger.info(f"Staged server settings: {pending}")
+        
+        return jsonify(pending_changes_response(pending))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Failed to update server settings: {e}")
+        logger.error(f"Failed to stage server settings: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/config/pending', methods=['GET'])
+@login_required
+def get_pending_changes():
+    """Show staged settings as a diff against .env and homeserver.yaml."""
+    try:
+        return jsonify(pending_changes_response(load_pending_changes()))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Failed to get pending changes: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/config/pending', methods=['DELETE'])
+@login_required
+def discard_pending_changes():
+    """Discard all staged settings."""
+    if config_apply_state['running']:
+        return jsonify({'success': False, 'error': 'Changes are being applied'}), 409
+    if not save_pending_changes({}):
+        return jsonify({'success': False, 'error': 'Failed to discard pending changes'}), 500
+    return jsonify({'success': True, 'message': 'Pending changes discarded'})
+
+
+@app.route('/api/config/apply', methods=['POST'])
+@login_required
+def apply_config_changes():
+    """Validate staged settings and apply them with a single Synapse restart."""
+    if config_apply_state['running']:
+        return jsonify({'success': False, 'error': 'Changes are already being applied'}), 409
+    
+    pending = load_pending_changes()
+    if not pending:
+        return jsonify({'success': False, 'error': 'No pending changes'}), 400
+    
+    try:
+        diff = build_pending_diff(pending)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f"Validation failed: {e}"}), 400
+    except Exception as e:
+        logger.error(f"Failed to validate pending changes: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    config_apply_state['running'] = True
+    try:
+        get_scheduler().add_job(
+            func=apply_pending_changes,
+            id='config_apply',
+            name='Apply staged configuration',
+            replace_existing=True
+        )
+    except Exception as e:
+        config_apply_state['running'] = False
+        logger.error(f"Failed to start applying changes: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    message = ('Applying changes and restarting Synapse once'
+               if diff['restart_required'] else 'Applying changes (no restart needed)')
+    return jsonify({
+        'success': True,
+        'message': message,
+        'restart_required': diff['restart_required']
+    })
+
+
+@app.route('/api/config/apply/history', methods=['GET'])
+@login_required
+def get_config_apply_history():
+    """Get past configuration applies with their measured downtime."""
+    return jsonify({
+        'success': True,
+        'running': config_apply_state['running'],
+        'history': list(reversed(load_config_apply_history()))
+    })
+
+
 @app.route('/api/users/statistics', methods=['GET'])
 @login_required
 def get_users_statistics():
     """Get user statistics including total users and login activity."""
     try:
-        stats = get_user_statistics()
+        filters = parse_user_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        stats = get_user_statistics(filters)
         
         if 'error' in stats:
             return jsonify({'success': False, 'error': stats['error']}), 500
@@ -829,34 +2608,105 @@ def get_users_statistics():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-if __name__ == '__main__':
-    # Restore schedules on startup
-    schedules = load_schedules()
-    for schedule in schedules:
+@app.route('/api/users/bulk', methods=['GET'])
+@login_required
+def get_bulk_user_job():
+    """Get progress of the current or last bulk user action."""
+    try:
+        return jsonify({'success': True, 'job': bulk_user_job.status()})
+    except Exception as e:
+        logger.error(f"Failed to read bulk user job: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/users/bulk', methods=['POST'])
+@login_required
+def create_bulk_user_job():
+    """Count (dry_run) or start a bulk action on the users matching the filters."""
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action not in BULK_USER_ACTIONS:
+        return jsonify({'success': False, 'error': f"action must be one of: {', '.join(BULK_USER_ACTIONS)}"}), 400
+    try:
+        filters = parse_user_filters(data.get('filters') or {})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if not filters:
+        return jsonify({'success': False, 'error': 'Choose at least one filter'}), 400
+    if bulk_user_job.running:
+        return jsonify({'success': False, 'error': 'A bulk action is already running'}), 409
+    
+    try:
+        users = select_bulk_users(action, filters)
+    except Exception as e:
+        logger.error(f"Failed to select users for bulk {action}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    if data.get('dry_run', True):
+        return jsonify({
+            'success': True,
+            'dry_run': True,
+            'count': len(users),
+            'sample': users[:BULK_USER_PREVIEW]
+        })
+    
+    # Refuse if the selection changed since the dry run the user confirmed
+    expected = data.get('expected_count')
+    if expected is not None and expected != len(users):
+        return jsonify({
+            'success': False,
+            'error': f"{len(users)} users now match, not {expected}. Run the dry run again.",
+            'count': len(users)
+        }), 409
+    if not users:
+        return jsonify({'success': False, 'error': 'No users match the filters'}), 400
+    
+    try:
+        bulk_user_job.create(action, users, filters)
+        start_bulk_user_job()
+    except Exception as e:
+        logger.error(f"Failed to start bulk {action}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'message': f"Started {action} for {len(users)} users", 'count': len(users)})
+
+
+@app.route('/api/users/bulk/pause', methods=['POST'])
+@login_required
+def pause_bulk_user_job():
+    """Stop the running bulk action after the calls in flight; it can be resumed."""
+    if not bulk_user_job.pause():
+        return jsonify({'success': False, 'error': 'No bulk action is running'}), 400
+    return jsonify({'success': True, 'message': 'Pausing bulk action'})
+
+
+@app.route('/api/users/bulk/resume', methods=['POST'])
+@login_required
+def resume_bulk_user_job():
+    """Continue a paused or interrupted bulk action with the users not yet processed."""
+    status = bulk_user_job.status()
+    if bulk_user_job.running:
+        return jsonify({'success': False, 'error': 'A bulk action is already running'}), 409
+    if not status or status['state'] == 'completed':
+        return jsonify({'success': False, 'error': 'No bulk action to resume'}), 400
+    try:
+        start_bulk_user_job()
+    except Exception as e:
+        logger.error(f"Failed to resume bulk action: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, 'message': f"Resuming {status['action']} for {status['remaining']} users"})
+
+
+def restore_schedules():
+    """Re-add saved, enabled schedules to the scheduler."""
+    for schedule in load_schedules():
         if schedule.get('enabled'):
             try:
                 task_type = schedule['type']
                 schedule_str = schedule['schedule']
                 
-                # Re-add job to scheduler
-                if schedule_str == 'daily':
-                    trigger = CronTrigger(hour=3, minute=0)
-                elif schedule_str == 'weekly':
-                    trigger = CronTrigger(day_of_week='sun', hour=3, minute=0)
-                elif schedule_str == 'monthly':
-                    trigger = CronTrigger(day=1, hour=3, minute=0)
-                else:
-                    parts = schedule_str.split()
-                    if len(parts) == 5:
-                        trigger = CronTrigger(
-                            minute=parts[0],
-                            hour=parts[1],
-                            day=parts[2],
-                            month=parts[3],
-                            day_of_week=parts[4]
-                        )
-                    else:
-                        continue
+                trigger = parse_schedule_trigger(schedule_str)
+                if trigger is None:
+                    continue
                 
                 # Create scheduled task function
                 try:
@@ -864,7 +2714,7 @@ if __name__ == '__main__':
                 except ValueError:
                     continue
                 
-                scheduler.add_job(
+                get_scheduler().add_job(
                     func=func,
                     trigger=trigger,
                     id=schedule['id'],
@@ -874,5 +2724,68 @@ if __name__ == '__main__':
                 logger.info(f"Restored schedule: {schedule['id']}")
             except Exception as e:
                 logger.error(f"Failed to restore schedule {schedule.get('id')}: {e}")
+
+
+def start_background_services():
+    """Start the scheduler, saved schedules and background collectors.
+
+    Called once when the server starts, never on import, so importing the
+    app (tests, tooling) stays fast and free of side effects.
+    """
+    global background_services_started
+    if background_services_started:
+        return
+    background_services_started = True
+    
+    from apscheduler.triggers.interval import IntervalTrigger
+    
+    get_scheduler().start()
+    restore_schedules()
+    
+    # Archive container logs so they can be searched after Docker rotates them
+    start_log_collector()
     
+    # Sample CPU, memory and I/O of every container
+    resource_sampler.start()
+    
+    # Scrape Synapse's metrics listener (when ENABLE_METRICS is on)
+    get_scheduler().add_job(
+        func=scrape_synapse_metrics,
+        trigger=IntervalTrigger(seconds=SYNAPSE_METRICS_INTERVAL),
+        id='synapse_metrics',
+        name='Synapse metrics scrape',
+        replace_existing=True
+    )
+    
+    # Keep the media store index up to date, starting with a scan at boot
+    get_scheduler().add_job(
+        func=scan_media_store,
+        trigger=IntervalTrigger(hours=MEDIA_SCAN_INTERVAL_HOURS),
+        id='media_scan',
+        name='Media store scan',
+        next_run_time=datetime.now(),
+        replace_existing=True
+    )
+    
+    # Fold the nginx media cache log into hourly stats before it grows large
+    get_scheduler().add_job(
+        func=update_media_cache_stats,
+        trigger=IntervalTrigger(minutes=5),
+        id='media_cache_stats',
+        name='Media cache stats',
+        replace_existing=True
+    )
+    
+    # Fold the JSON access log into per-minute traffic stats
+    get_scheduler().add_job(
+        func=update_access_log_stats,
+        trigger=IntervalTrigger(minutes=1),
+        id='access_log_stats',
+        name='Access log stats',
+        replace_existing=True
+    )
+
+
+if __name__ == '__main__':
+    start_background_services()
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,298 @@
+"""
+Backup archives that can be checked without staging them on disk.
+
+create_archive() writes a .tar.gz and hashes every file on its way in,
+appending a MANIFEST.json of per-file SHA-256 checksums as the last member
+and returning the SHA-256 of the compressed archive itself. verify_archive()
+reads an archive as a stream (an S3 response body or a local file), hashes
+each member as it passes and compares against the manifest, optionally
+extracting files into a scratch directory and handing the database dump to
+a restore function on the way. Memory use is one chunk plus one checksum
+per file, whatever the size of the backup.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_NAME = 'MANIFEST.json'
+DATABASE_DUMP_NAME = 'synapse.pgdump'
+BACKUP_PREFIX = 'matrix-backup-'
+# How many problem paths a report lists
+MAX_REPORTED_PATHS = 20
+
+
+class HashingReader:
+    """File-like wrapper that hashes and counts everything read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return data
+
+    def drain(self):
+        """Read (and hash) whatever the consumer left unread."""
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+class HashingWriter:
+    """File-like wrapper that hashes and counts everything written through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.bytes = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes += len(data)
+        return self.fileobj.write(data)
+
+
+def create_archive(fileobj, root, paths, extra_files=()):
+    """Write a .tar.gz of `paths` (relative to root) plus extra_files to fileobj.
+
+    extra_files is a list of (name in archive, path on disk). Returns the
+    file count, uncompressed bytes and the compressed size and SHA-256.
+    """
+    writer = HashingWriter(fileobj)
+    manifest = {}
+
+    def add_file(tar, path, arcname):
+        tarinfo = tar.gettarinfo(path, arcname)
+        if tarinfo is None:
+            # Sockets can't be archived
+            return
+        if not tarinfo.isfile():
+            tar.addfile(tarinfo)
+            return
+        with open(path, 'rb') as f:
+            reader = HashingReader(f)
+            tar.addfile(tarinfo, reader)
+        manifest[arcname] = {'size': tarinfo.size, 'sha256': reader.sha256.hexdigest()}
+
+    with tarfile.open(fileobj=writer, mode='w|gz') as tar:
+        for rel_path in paths:
+            top = os.path.join(root, rel_path)
+            for dirpath, dirnames, filenames in os.walk(top):
+                dirnames.sort()
+                add_file(tar, dirpath, os.path.relpath(dirpath, root))
+                for name in sorted(filenames):
+                    path = os.path.join(dirpath, name)
+                    add_file(tar, path, os.path.relpath(path, root))
+        for arcname, path in extra_files:
+            add_file(tar, path, arcname)
+
+        data = json.dumps({
+            'created': datetime.now().isoformat(),
+            'files': manifest,
+        }, indent=1).encode('utf-8')
+        tarinfo = tarfile.TarInfo(MANIFEST_NAME)
+        tarinfo.size = len(data)
+        tarinfo.mtime = int(time.time())
+        tar.addfile(tarinfo, io.BytesIO(data))
+
+    return {
+        'files': len(manifest),
+        'bytes': sum(entry['size'] for entry in manifest.values()),
+        'size_bytes': writer.bytes,
+        'sha256': writer.sha256.hexdigest(),
+    }
+
+
+def _scratch_path(root, name):
+    """Where a member is extracted to; refuses names that escape root."""
+    path = os.path.normpath(os.path.join(root, name))
+    if os.path.isabs(name) or not path.startswith(os.path.normpath(root) + os.sep):
+        raise ValueError(f"Unsafe path in backup: {name}")
+    return path
+
+
+def _copy(source, sink):
+    """Copy a stream in chunks, returning its SHA-256."""
+    reader = HashingReader(source)
+    while True:
+        chunk = reader.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if sink is not None:
+            sink.write(chunk)
+    return reader
+
+
+def verify_archive(fileobj, expected_sha256=None, extract_to=None, restore_database=None,
+                   clock=time.monotonic):
+    """Check an archive stream against its manifest and, optionally, restore it.
+
+    With extract_to, files are written below that directory as they are
+    verified. restore_database is called with a file-like object reading
+    the database dump, and its return value is included in the report.
+    """
+    start = clock()
+    source = HashingReader(fileobj)
+    computed = {}
+    manifest = None
+    database = None
+    database_seconds = None
+
+    with tarfile.open(fileobj=source, mode='r|gz') as tar:
+        for member in tar:
+            if member.name == MANIFEST_NAME:
+                manifest = json.load(tar.extractfile(member))['files']
+                continue
+            target = _scratch_path(extract_to, member.name) if extract_to else None
+            if member.isdir():
+                if target:
+                    os.makedirs(target, exist_ok=True)
+                continue
+            if not member.isfile():
+                # Links and devices aren't part of a Synapse data directory
+                continue
+
+            data = tar.extractfile(member)
+            if member.name == DATABASE_DUMP_NAME and restore_database:
+                reader = HashingReader(data)
+                db_start = clock()
+                database = restore_database(reader)
+                reader.drain()
+                database_seconds = round(clock() - db_start, 2)
+            elif target:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as out:
+                    reader = _copy(data, out)
+            else:
+                reader = _copy(data, None)
+            computed[member.name] = {'size': reader.bytes, 'sha256': reader.sha256.hexdigest()}
+    source.drain()
+
+    report = {
+        'manifest': manifest is not None,
+        'files': len(computed),
+        'bytes': sum(entry['size'] for entry in computed.values()),
+        'compressed_bytes': source.bytes,
+        'sha256': source.sha256.hexdigest(),
+        'sha256_ok': None if expected_sha256 is None else source.sha256.hexdigest() == expected_sha256,
+        'missing': [],
+        'mismatched': [],
+        'unexpected': [],
+    }
+    if manifest is not None:
+        report['missing'] = sorted(name for name in manifest if name not in computed)
+        report['mismatched'] = sorted(
+            name for name, entry in computed.items()
+            if name in manifest and manifest[name] != entry
+        )
+        report['unexpected'] = sorted(name for name in computed if name not in manifest)
+    problems = len(report['missing']) + len(report['mismatched']) + len(report['unexpected'])
+    for key in ('missing', 'mismatched', 'unexpected'):
+        report[key] = report[key][:MAX_REPORTED_PATHS]
+
+    report['ok'] = manifest is not None and problems == 0 and report['sha256_ok'] is not False
+    if manifest is None:
+        report['error'] = 'Backup has no checksum manifest (it was created before verification was added)'
+    elif not report['ok']:
+        report['error'] = f"{problems} file(s) do not match the manifest" if problems else 'Archive checksum does not match'
+    if restore_database:
+        report['database'] = database
+        report['database_seconds'] = database_seconds
+
+    report['seconds'] = round(clock() - start, 2)
+    report['bytes_per_second'] = round(source.bytes / report['seconds']) if report['seconds'] else None
+    return report
+
+
+class LocalBackupStore:
+    """Backups kept in a local directory, with a .sha256 file beside each."""
+
+    def __init__(self, directory, keep=3):
+        self.directory = str(directory)
+        self.keep = keep
+
+    def list(self):
+        """Backups, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        backups = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(BACKUP_PREFIX) and entry.name.endswith('.tar.gz'):
+                stat = entry.stat()
+                backups.append({'name': entry.name, 'size': stat.st_size, 'modified': stat.st_mtime})
+        return sorted(backups, key=lambda b: b['name'], reverse=True)
+
+    def save(self, path, name, sha256):
+        """Move a finished archive into the store and drop the oldest beyond `keep`."""
+        os.makedirs(self.directory, exist_ok=True)
+        # The archive is usually built on another filesystem (/tmp), where a
+        # rename can't reach; copy it in under a temp name, then rename it
+        # within the store so a half-copied file never looks like a backup
+        tmp_path = os.path.join(self.directory, '.' + name + '.tmp')
+        shutil.move(path, tmp_path)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        with open(os.path.join(self.directory, name + '.sha256'), 'w') as f:
+            f.write(f"{sha256}  {name}\n")
+        for old in self.list()[self.keep:]:
+            for suffix in ('', '.sha256'):
+                try:
+                    os.remove(os.path.join(self.directory, old['name'] + suffix))
+                except FileNotFoundError:
+                    pass
+        return os.path.join(self.directory, name)
+
+    def open(self, name):
+        """Return (readable stream, recorded SHA-256 or None)."""
+        if os.sep in name or name.startswith('.'):
+            raise ValueError(f"Invalid backup name: {name}")
+        sha256 = None
+        try:
+            with open(os.path.join(self.directory, name + '.sha256')) as f:
+                sha256 = f.read().split()[0]
+        except (FileNotFoundError, IndexError):
+            pass
+        return open(os.path.join(self.directory, name), 'rb'), sha256
+
+
+class S3BackupStore:
+    """Backups in an S3 bucket, with the archive SHA-256 in the object metadata."""
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def list(self):
+        """Backups, newest first."""
+        backups = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=BACKUP_PREFIX):
+            for obj in page.get('Contents', []):
+                backups.append({
+                    'name': obj['Key'],
+                    'size': obj['Size'],
+                    'modified': obj['LastModified'].timestamp(),
+                })
+        return sorted(backups, key=lambda b: b['name'], reverse=True)
+
+    def save(self, path, name, sha256):
+        self.client.upload_file(path, self.bucket, name, ExtraArgs={'Metadata': {'sha256': sha256}})
+        os.remove(path)
+        return f"s3://{self.bucket}/{name}"
+
+    def open(self, name):
+        """Return (streaming body, recorded SHA-256 or None)."""
+        response = self.client.get_object(Bucket=self.bucket, Key=name)
+        return response['Body'], response.get('Metadata', {}).get('sha256')
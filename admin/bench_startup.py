@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Admin console startup benchmark.
+
+Imports the app in fresh interpreters and reports import time, time to
+serve the first request, resident memory after boot and which of the
+heavy optional backends were loaded. Results can be appended to a JSON
+lines file to track startup cost over time.
+
+Usage:
+    python bench_startup.py [--runs 5] [--record startup-history.jsonl] [--max-import-ms 800]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Backends that should only be imported on first use
+HEAVY_MODULES = ['boto3', 'botocore', 'psycopg2', 'yaml', 'apscheduler']
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def measure_once():
+    """Measure a single cold import and first request in this process."""
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    start = time.perf_counter()
+    import app as app_module
+    import_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with app_module.app.test_client() as client:
+        client.get('/login')
+    first_request_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'import_ms': round(import_ms, 1),
+        'first_request_ms': round(first_request_ms, 1),
+        'rss_mb': current_rss_mb(),
+        'heavy_modules_loaded': sorted(
+            name for name in HEAVY_MODULES if name in sys.modules
+        ),
+        'scheduler_started': bool(app_module.scheduler and app_module.scheduler.running),
+    }
+
+
+def run(runs):
+    """Run measure_once() in `runs` fresh interpreters and summarise."""
+    samples = []
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, __file__, '--child'],
+            capture_output=True, text=True, env=env, check=True
+        )
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'runs': runs,
+        'python': sys.version.split()[0],
+        'import_ms': statistics.median(s['import_ms'] for s in samples),
+        'first_request_ms': statistics.median(s['first_request_ms'] for s in samples),
+        'rss_mb': statistics.median(s['rss_mb'] for s in samples),
+        'heavy_modules_loaded': samples[-1]['heavy_modules_loaded'],
+        'scheduler_started': samples[-1]['scheduler_started'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark admin console startup')
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh interpreters to measure')
+    parser.add_argument('--record', help='append the result to this JSON lines file')
+    parser.add_argument('--max-import-ms', type=float, help='exit non-zero if the median import time is higher')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_once()))
+        return 0
+
+    summary = run(args.runs)
+    print(json.dumps(summary, indent=2))
+
+    if args.record:
+        with open(args.record, 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+
+    if args.max_import_ms is not None and summary['import_ms'] > args.max_import_ms:
+        print(f"Import time {summary['import_ms']} ms exceeds {args.max_import_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+Bulk user operations against the Synapse admin API.
+
+A BulkUserJob applies one action (deactivate, shadow-ban, purge media) to
+a fixed list of users with a small pool of worker threads. Calls are
+spaced by a shared rate limiter so a cleanup of thousands of spam accounts
+doesn't starve Synapse. Every finished user is appended to a progress log
+next to the job file, so a job that was paused or interrupted by a restart
+resumes where it stopped instead of starting over.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# How many recent failures are kept in the job status
+MAX_REPORTED_ERRORS = 20
+
+
+class RateLimiter:
+    """Token bucket shared by all workers: `rate` calls per second, bursts up to `burst`."""
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a call is allowed."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            self.sleep(wait_seconds)
+
+
+class BulkUserJob:
+    """One resumable bulk action over a list of users.
+
+    The job definition (action, filters, users) is written to job_file when
+    the job is created; results are appended to job_file + '.progress' as
+    JSON lines as each user finishes.
+    """
+
+    def __init__(self, job_file, workers=4, rate=5.0):
+        self.job_file = str(job_file)
+        self.progress_file = self.job_file + '.progress'
+        self.workers = max(1, workers)
+        self.rate = rate
+        self._run_lock = threading.Lock()
+        self._pause = threading.Event()
+        self._status_lock = threading.Lock()
+        self._counts = None
+        self._limiter = None
+
+    @property
+    def running(self):
+        return self._run_lock.locked()
+
+    def _load_job(self):
+        if not os.path.exists(self.job_file):
+            return None
+        with open(self.job_file, 'r') as f:
+            return json.load(f)
+
+    def _save_job(self, job):
+        os.makedirs(os.path.dirname(self.job_file) or '.', exist_ok=True)
+        with open(self.job_file + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(self.job_file + '.tmp', self.job_file)
+
+    def _load_progress(self):
+        """Return ({user: error or None}) for users already processed."""
+        finished = {}
+        if not os.path.exists(self.progress_file):
+            return finished
+        with open(self.progress_file, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; that user is simply retried
+                    continue
+                finished[entry['user']] = entry.get('error')
+        return finished
+
+    def create(self, action, users, filters=None):
+        """Record a new job, replacing a finished one. Raises RuntimeError while one runs."""
+        if self.running:
+            raise RuntimeError('A bulk user job is already running')
+        job = {
+            'action': action,
+            'filters': filters or {},
+            'users': list(users),
+            'created': datetime.now().isoformat(),
+            'state': 'pending',
+        }
+        if os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
+        self._save_job(job)
+        self._counts = None
+        return job
+
+    def acquire(self):
+        """Wait for the running job's rate limiter.
+
+        Each user's first call is already paced; actions that make more than
+        one API call per user take a slot for every extra call.
+        """
+        limiter = self._limiter
+        if limiter is not None:
+            limiter.acquire()
+
+    def pause(self):
+        """Ask the running job to stop after the calls already in flight."""
+        if not self.running:
+            return False
+        self._pause.set()
+        return True
+
+    def run(self, perform):
+        """Apply perform(action, user) to every user not yet processed.
+
+        Returns the final status, or None if the job is already running.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return None
+        try:
+            self._pause.clear()
+            self._run(perform)
+            return self.status()
+        finally:
+            self._run_lock.release()
+
+    def _run(self, perform):
+        job = self._load_job()
+        if job is None or job['state'] == 'completed':
+            return
+        finished = self._load_progress()
+        todo = [user for user in job['users'] if user not in finished]
+        self._counts = {
+            'done': sum(1 for error in finished.values() if error is None),
+            'failed': sum(1 for error in finished.values() if error is not None),
+            'errors': [
+                {'user': user, 'error': error}
+                for user, error in finished.items() if error is not None
+            ][-MAX_REPORTED_ERRORS:],
+        }
+        job['state'] = 'running'
+        job['started'] = datetime.now().isoformat()
+        self._save_job(job)
+        logger.info(f"Bulk {job['action']}: {len(todo)} of {len(job['users'])} users to process")
+
+        self._limiter = RateLimiter(self.rate, burst=self.workers)
+
+        def call(user):
+            self._limiter.acquire()
+            perform(job['action'], user)
+
+        remaining = iter(todo)
+        with open(self.progress_file, 'a') as progress, \
+                ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+
+            def submit_next():
+                if self._pause.is_set():
+                    return
+                user = next(remaining, None)
+                if user is not None:
+                    pending[pool.submit(call, user)] = user
+
+            # Keep only a couple of calls per worker queued at a time
+            for _ in range(self.workers * 2):
+                submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    user = pending.pop(future)
+                    try:
+                        future.result()
+                        error = None
+                    except Exception as e:
+                        error = str(e)
+                        logger.warning(f"Bulk {job['action']} failed for {user}: {e}")
+                    progress.write(json.dumps({'user': user, 'error': error}) + '\n')
+                    progress.flush()
+                    with self._status_lock:
+                        if error is None:
+                            self._counts['done'] += 1
+                        else:
+                            self._counts['failed'] += 1
+                            self._counts['errors'] = (
+                                self._counts['errors'] + [{'user': user, 'error': error}]
+                            )[-MAX_REPORTED_ERRORS:]
+                    submit_next()
+
+        self._limiter = None
+        job['state'] = 'paused' if self._pause.is_set() else 'completed'
+        job['finished'] = datetime.now().isoformat()
+        self._save_job(job)
+        logger.info(f"Bulk {job['action']} {job['state']}: {self._counts['done']} done, {self._counts['failed']} failed")
+
+    def status(self):
+        """Progress of the current or last job, or None if there has been none."""
+        job = self._load_job()
+        if job is None:
+            return None
+        if self._counts is None:
+            finished = self._load_progress()
+            failed = [
+                {'user': user, 'error': error}
+                for user, error in finished.items() if error is not None
+            ]
+            self._counts = {
+                'done': len(finished) - len(failed),
+                'failed': len(failed),
+                'errors': failed[-MAX_REPORTED_ERRORS:],
+            }
+        with self._status_lock:
+            counts = dict(self._counts)
+        state = job['state']
+        if state == 'running' and not self.running:
+            # Still marked running on disk, so the admin console was restarted mid-job
+            state = 'interrupted'
+        return {
+            'action': job['action'],
+            'filters': job['filters'],
+            'state': state,
+            'total': len(job['users']),
+            'done': counts['done'],
+            'failed': counts['failed'],
+            'remaining': len(job['users']) - counts['done'] - counts['failed'],
+            'errors': counts['errors'],
+            'created': job['created'],
+            'started': job.get('started'),
+            'finished': job.get('finished'),
+        }
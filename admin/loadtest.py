@@ -0,0 +1,713 @@
+#!/usr/bin/env python3
+"""
+Synthetic load generator for sizing a Matrix server.
+
+Creates test users through the Synapse admin API, puts them in rooms and
+drives client traffic with asyncio: every user keeps a /sync long-poll
+open and, at random intervals, sends messages and uploads media. The
+report gives latency percentiles, throughput and errors per operation,
+with rate-limited responses (429 from Synapse, 503 from nginx's
+limit_req) counted separately, plus how long a message took to reach
+other room members' /sync.
+
+Uses only the standard library. StandInHomeserver is a small in-memory
+homeserver for running the tool (and its tests) without a real stack.
+
+Usage:
+    python loadtest.py --url http://synapse:8008 --users 50 --duration 120
+    python loadtest.py --url https://matrix.example.com --admin-url http://synapse:8008 --users 20 \
+        --record /app/data/loadtest-history.jsonl
+    python loadtest.py --stand-in --users 20 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import ssl
+import sys
+import time
+import urllib.parse
+from collections import deque
+from datetime import datetime
+
+from nginx_logs import LatencySketch
+
+USER_PREFIX = 'loadtest'
+MESSAGE_PREFIX = 'loadtest '
+
+
+class HTTPClient:
+    """Minimal HTTP/1.1 client over one keep-alive connection.
+
+    Like a real Matrix client, each simulated user holds its own
+    connections, so per-connection limits in nginx apply as they would.
+    """
+
+    def __init__(self, base_url, timeout=60, verify_tls=True):
+        parsed = urllib.parse.urlsplit(base_url)
+        secure = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if secure else 80)
+        self.host_header = parsed.netloc
+        self.base_path = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.ssl = None
+        if secure:
+            self.ssl = ssl.create_default_context()
+            if not verify_tls:
+                self.ssl.check_hostname = False
+                self.ssl.verify_mode = ssl.CERT_NONE
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request and return (status, body bytes).
+
+        body may be bytes or a JSON-serialisable value. A kept-alive
+        connection the server has closed is retried once on a new one.
+        """
+        if body is not None and not isinstance(body, (bytes, bytearray)):
+            body = json.dumps(body).encode('utf-8')
+        async with self._lock:
+            for attempt in range(2):
+                reused = self._writer is not None
+                if not reused:
+                    self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+                try:
+                    return await asyncio.wait_for(
+                        self._exchange(method, path, body or b'', headers or {}),
+                        timeout or self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    await self.close()
+                    if not reused or attempt:
+                        raise
+                except BaseException:
+                    # Timeouts and cancellation leave the connection mid-response
+                    await self.close()
+                    raise
+
+    async def _exchange(self, method, path, body, headers):
+        lines = [
+            f'{method} {self.base_path}{path} HTTP/1.1',
+            f'Host: {self.host_header}',
+            f'Content-Length: {len(body)}',
+        ]
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if method == 'HEAD' or status in (204, 304):
+            payload = b''
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await self._reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            payload = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            payload = await self._reader.readexactly(int(response_headers['content-length']))
+        else:
+            payload = await self._reader.read()
+            response_headers['connection'] = 'close'
+
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, payload
+
+
+def classify_outcome(status):
+    """Name the outcome of a response: ok, rate_limited or http_<status>."""
+    if 200 <= status < 300:
+        return 'ok'
+    # nginx's limit_req and limit_conn answer 503 by default
+    if status in (429, 503):
+        return 'rate_limited'
+    return f'http_{status}'
+
+
+class OperationStats:
+    """Latency and outcomes of one kind of request."""
+
+    def __init__(self):
+        self.latency = LatencySketch()
+        self.outcomes = {}
+
+    def record(self, outcome, seconds=None):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        if outcome == 'ok' and seconds is not None:
+            self.latency.add(seconds)
+
+    def summary(self, duration):
+        total = sum(self.outcomes.values())
+        ok = self.outcomes.get('ok', 0)
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 1)
+        return {
+            'requests': total,
+            'ok': ok,
+            'per_second': round(ok / duration, 2) if duration else None,
+            'errors': {k: v for k, v in sorted(self.outcomes.items()) if k != 'ok'},
+            'error_ratio': round((total - ok) / total, 4) if total else None,
+            'p50_ms': ms(self.latency.quantile(0.5)),
+            'p95_ms': ms(self.latency.quantile(0.95)),
+            'p99_ms': ms(self.latency.quantile(0.99)),
+            'max_ms': ms(self.latency.max) if self.latency.count else None,
+        }
+
+
+class LoadTest:
+    """One load test run against a homeserver.
+
+    Client traffic goes to url; creating, logging in and deactivating the
+    test users goes to admin_url (default: url), because nginx does not
+    proxy /_synapse/admin.
+    message_rate and upload_rate are per user per minute; the time between
+    actions is exponentially distributed so users don't act in lockstep.
+    """
+
+    def __init__(self, url, admin_token, users=10, users_per_room=10, duration=60, ramp_up=10,
+                 message_rate=2.0, upload_rate=0.2, upload_size=64 * 1024, sync_timeout=30,
+                 server_name=None, setup_concurrency=5, verify_tls=True, cleanup=True, admin_url=None):
+        self.url = url
+        self.admin_url = admin_url or url
+        self.admin_token = admin_token
+        self.users = users
+        self.users_per_room = max(1, users_per_room)
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.message_rate = message_rate
+        self.upload_rate = upload_rate
+        self.upload_size = upload_size
+        self.sync_timeout = sync_timeout
+        self.server_name = server_name
+        self.setup_concurrency = setup_concurrency
+        self.verify_tls = verify_tls
+        self.cleanup = cleanup
+        self.run_id = secrets.token_hex(3)
+        self.stats = {}
+        self.accounts = []
+        # Every user created on the server, logged in or not, for cleanup
+        self.created_users = []
+        self._stop = None
+
+    def _client(self, timeout=60):
+        return HTTPClient(self.url, timeout=timeout, verify_tls=self.verify_tls)
+
+    def _admin_client(self):
+        return HTTPClient(self.admin_url, verify_tls=self.verify_tls)
+
+    def record(self, operation, outcome, seconds=None):
+        self.stats.setdefault(operation, OperationStats()).record(outcome, seconds)
+
+    async def call(self, operation, client, method, path, token, body=None, headers=None, timeout=None):
+        """Make one timed request; returns the decoded JSON body, or None on failure."""
+        headers = dict(headers or {}, Authorization=f'Bearer {token}')
+        if body is not None and not isinstance(body, (bytes, bytearray)):
+            headers.setdefault('Content-Type', 'application/json')
+        start = time.perf_counter()
+        try:
+            status, payload = await client.request(method, path, body, headers, timeout)
+        except asyncio.TimeoutError:
+            self.record(operation, 'timeout')
+            return None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.record(operation, 'connection_error')
+            return None
+        outcome = classify_outcome(status)
+        self.record(operation, outcome, time.perf_counter() - start)
+        if outcome != 'ok':
+            return None
+        try:
+            return json.loads(payload) if payload else {}
+        except ValueError:
+            return {}
+
+    async def _sleep(self, seconds):
+        """Sleep, returning early (True) once the test is stopping."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+            return True
+        except asyncio.TimeoutError:
+            return self._stop.is_set()
+
+    async def setup(self):
+        """Create the test users, log them in and put them in rooms."""
+        admin = self._admin_client()
+        try:
+            if not self.server_name:
+                whoami = await self.call('setup_whoami', admin, 'GET', '/_matrix/client/v3/account/whoami',
+                                         self.admin_token)
+                if not whoami:
+                    raise RuntimeError('Admin token was rejected (GET /account/whoami failed)')
+                self.server_name = whoami['user_id'].split(':', 1)[1]
+        finally:
+            await admin.close()
+
+        limit = asyncio.Semaphore(self.setup_concurrency)
+
+        async def create_account(n):
+            user_id = f'@{USER_PREFIX}_{self.run_id}_{n}:{self.server_name}'
+            quoted = urllib.parse.quote(user_id)
+            async with limit:
+                client = self._admin_client()
+                try:
+                    try:
+                        created = await self.call(
+                            'setup_create_user', client, 'PUT', f'/_synapse/admin/v2/users/{quoted}',
+                            self.admin_token, {'password': secrets.token_urlsafe(18), 'displayname': f'Load test {n}'}
+                        )
+                    except asyncio.CancelledError:
+                        # The server may have created the user before we stopped waiting
+                        self.created_users.append(user_id)
+                        raise
+                    if created is not None:
+                        self.created_users.append(user_id)
+                    # The admin login API skips the login rate limits a real /login would hit
+                    login = created is not None and await self.call(
+                        'setup_login', client, 'POST', f'/_synapse/admin/v1/users/{quoted}/login', self.admin_token, {}
+                    )
+                finally:
+                    await client.close()
+            if login:
+                return {'user_id': user_id, 'token': login['access_token'], 'room_id': None}
+            return None
+
+        accounts = await asyncio.gather(*(create_account(n) for n in range(self.users)))
+        self.accounts = [account for account in accounts if account]
+        if not self.accounts:
+            raise RuntimeError('No test users could be created; check the admin token and the setup errors')
+
+        async def fill_room(group):
+            client = self._client()
+            try:
+                room = await self.call('setup_create_room', client, 'POST', '/_matrix/client/v3/createRoom',
+                                       group[0]['token'], {'preset': 'public_chat', 'name': f'Load test {self.run_id}'})
+                if not room:
+                    return
+                group[0]['room_id'] = room['room_id']
+                for account in group[1:]:
+                    joined = await self.call(
+                        'setup_join', client, 'POST',
+                        f"/_matrix/client/v3/join/{urllib.parse.quote(room['room_id'])}", account['token'], {}
+                    )
+                    if joined is not None:
+                        account['room_id'] = room['room_id']
+            finally:
+                await client.close()
+
+        groups = [self.accounts[i:i + self.users_per_room] for i in range(0, len(self.accounts), self.users_per_room)]
+        async with asyncio.TaskGroup() as tasks:
+            for group in groups:
+                tasks.create_task(fill_room(group))
+
+    async def sync_loop(self, account):
+        """Keep a /sync long-poll open, measuring delivery of other users' messages."""
+        client = self._client(timeout=self.sync_timeout + 30)
+        since = None
+        try:
+            while not self._stop.is_set():
+                params = {'timeout': int(self.sync_timeout * 1000) if since else 0}
+                if since:
+                    params['since'] = since
+                response = await self.call(
+                    'sync' if since else 'initial_sync', client, 'GET',
+                    f'/_matrix/client/v3/sync?{urllib.parse.urlencode(params)}', account['token']
+                )
+                if response is None:
+                    if await self._sleep(1):
+                        break
+                    continue
+                if since:
+                    self._record_deliveries(account, response)
+                since = response.get('next_batch', since)
+        finally:
+            await client.close()
+
+    def _record_deliveries(self, account, response):
+        now = time.time()
+        for room in response.get('rooms', {}).get('join', {}).values():
+            for event in room.get('timeline', {}).get('events', []):
+                body = event.get('content', {}).get('body', '')
+                if event.get('sender') == account['user_id'] or not body.startswith(MESSAGE_PREFIX):
+                    continue
+                try:
+                    sent = float(body[len(MESSAGE_PREFIX):].split()[0])
+                except (ValueError, IndexError):
+                    continue
+                self.record('message_delivery', 'ok', max(now - sent, 0))
+
+    async def activity_loop(self, account):
+        """Send messages and upload media at random intervals."""
+        client = self._client()
+        rate = (self.message_rate + self.upload_rate) / 60
+        if rate <= 0:
+            return
+        txn = 0
+        try:
+            while not await self._sleep(random.expovariate(rate)):
+                if account['room_id'] and random.random() * rate * 60 < self.message_rate:
+                    txn += 1
+                    room = urllib.parse.quote(account['room_id'])
+                    await self.call(
+                        'send_message', client, 'PUT',
+                        f'/_matrix/client/v3/rooms/{room}/send/m.room.message/{self.run_id}-{txn}',
+                        account['token'], {'msgtype': 'm.text', 'body': f'{MESSAGE_PREFIX}{time.time():.6f}'}
+                    )
+                elif self.upload_rate > 0:
+                    await self.call(
+                        'upload_media', client, 'POST', '/_matrix/media/v3/upload?filename=loadtest.bin',
+                        account['token'], os.urandom(self.upload_size),
+                        {'Content-Type': 'application/octet-stream'}
+                    )
+        finally:
+            await client.close()
+
+    async def user(self, account, delay):
+        if await self._sleep(delay):
+            return
+        await asyncio.gather(self.sync_loop(account), self.activity_loop(account))
+
+    async def deactivate_accounts(self):
+        """Deactivate every user this run created, which also revokes their access tokens."""
+        limit = asyncio.Semaphore(self.setup_concurrency)
+
+        async def deactivate(user_id):
+            async with limit:
+                client = self._admin_client()
+                try:
+                    await self.call('cleanup_deactivate', client, 'POST',
+                                    f"/_synapse/admin/v1/deactivate/{urllib.parse.quote(user_id)}",
+                                    self.admin_token, {'erase': False})
+                finally:
+                    await client.close()
+        await asyncio.gather(*(deactivate(user_id) for user_id in self.created_users))
+
+    async def run(self):
+        """Set up, generate load for `duration` seconds, clean up and return the report.
+
+        The test users are deactivated however the run ends, including
+        when it fails during setup or is cancelled (Ctrl-C).
+        """
+        self._stop = asyncio.Event()
+        started = datetime.now()
+        tasks = []
+        try:
+            setup_start = time.monotonic()
+            await self.setup()
+            setup_seconds = time.monotonic() - setup_start
+
+            load_start = time.monotonic()
+            spacing = self.ramp_up / len(self.accounts)
+            tasks = [asyncio.create_task(self.user(account, i * spacing)) for i, account in enumerate(self.accounts)]
+            await asyncio.sleep(self.duration)
+            self._stop.set()
+            # Long-polls still waiting at the end are abandoned, not counted
+            await asyncio.wait(tasks, timeout=5)
+            load_seconds = time.monotonic() - load_start
+        finally:
+            self._stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.cleanup and self.created_users:
+                await self.deactivate_accounts()
+        return self.report(started, setup_seconds, load_seconds)
+
+    def report(self, started, setup_seconds, load_seconds):
+        def is_traffic(name):
+            return not name.startswith(('setup_', 'cleanup_'))
+        # Setup and cleanup happen outside the load window, so they get no rate
+        operations = {
+            name: stats.summary(load_seconds if is_traffic(name) else None)
+            for name, stats in sorted(self.stats.items())
+        }
+        traffic = [s for name, s in operations.items() if is_traffic(name) and name != 'message_delivery']
+        requests = sum(s['requests'] for s in traffic)
+        ok = sum(s['ok'] for s in traffic)
+        return {
+            'timestamp': started.isoformat(),
+            'url': self.url,
+            'users': len(self.accounts),
+            'users_requested': self.users,
+            'users_per_room': self.users_per_room,
+            'message_rate_per_minute': self.message_rate,
+            'upload_rate_per_minute': self.upload_rate,
+            'upload_size': self.upload_size,
+            'setup_seconds': round(setup_seconds, 2),
+            'duration_seconds': round(load_seconds, 2),
+            'requests': requests,
+            'requests_per_second': round(ok / load_seconds, 2) if load_seconds else None,
+            'error_ratio': round((requests - ok) / requests, 4) if requests else None,
+            'operations': operations,
+        }
+
+
+def format_report(report):
+    """Render a report as a plain text table."""
+    lines = [
+        f"{report['users']} users for {report['duration_seconds']}s against {report['url']}",
+        f"{report['requests']} requests, {report['requests_per_second']}/s successful, "
+        f"error ratio {report['error_ratio']}",
+        '',
+        f"{'operation':<20}{'requests':>9}{'ok/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  errors",
+    ]
+    for name, op in report['operations'].items():
+        errors = ', '.join(f'{k}: {v}' for k, v in op['errors'].items()) or '-'
+        cells = [op[key] if op[key] is not None else '-' for key in ('per_second', 'p50_ms', 'p95_ms', 'p99_ms')]
+        lines.append(f"{name:<20}{op['requests']:>9}{cells[0]:>9}{cells[1]:>10}{cells[2]:>10}{cells[3]:>10}  {errors}")
+    return '\n'.join(lines)
+
+
+class StandInHomeserver:
+    """In-memory homeserver with just the endpoints the load test uses.
+
+    Long-polling /sync wakes up when a message is sent to one of the
+    user's rooms. delay adds fixed latency to every response.
+    """
+
+    MAX_EVENTS = 1000
+
+    def __init__(self, server_name='loadtest.local', admin_token='stand-in-admin-token', delay=0.0):
+        self.server_name = server_name
+        self.admin_token = admin_token
+        self.delay = delay
+        self.tokens = {admin_token: f'@admin:{server_name}'}
+        self.users = {}
+        self.rooms = {}
+        self.events = deque(maxlen=self.MAX_EVENTS)
+        self.position = 0
+        self.uploads = 0
+        self._server = None
+        self._changed = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening; returns the base URL."""
+        self._changed = asyncio.Condition()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                status, payload = await self._route(method, target, headers, body)
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f'HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n\r\n'.encode('latin-1') + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, target, headers, body):
+        url = urllib.parse.urlsplit(target)
+        path = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/')]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        token = headers.get('authorization', '').removeprefix('Bearer ')
+        user_id = self.tokens.get(token)
+        if user_id is None or self.users.get(user_id, {}).get('deactivated'):
+            return 401, {'errcode': 'M_UNKNOWN_TOKEN', 'error': 'Unknown token'}
+        content = json.loads(body) if body and headers.get('content-type') == 'application/json' else {}
+
+        if path[:2] == ['_synapse', 'admin']:
+            if token != self.admin_token:
+                return 403, {'errcode': 'M_FORBIDDEN', 'error': 'You are not a server admin'}
+            if method == 'PUT' and path[2:4] == ['v2', 'users']:
+                self.users.setdefault(path[4], {'displayname': content.get('displayname')})
+                return 201, {'name': path[4]}
+            if method == 'POST' and path[2:4] == ['v1', 'users'] and path[5:] == ['login']:
+                if path[4] not in self.users:
+                    return 404, {'errcode': 'M_NOT_FOUND', 'error': 'User not found'}
+                access_token = secrets.token_hex(16)
+                self.tokens[access_token] = path[4]
+                return 200, {'access_token': access_token}
+            if method == 'POST' and path[2:4] == ['v1', 'deactivate']:
+                self.users.get(path[4], {})['deactivated'] = True
+                return 200, {'id_server_unbind_result': 'success'}
+
+        elif path[:3] == ['_matrix', 'client', 'v3']:
+            endpoint = path[3:]
+            if method == 'GET' and endpoint == ['account', 'whoami']:
+                return 200, {'user_id': user_id}
+            if method == 'POST' and endpoint == ['createRoom']:
+                room_id = f'!{secrets.token_hex(8)}:{self.server_name}'
+                self.rooms[room_id] = {user_id}
+                return 200, {'room_id': room_id}
+            if method == 'POST' and endpoint[:1] == ['join'] and endpoint[1] in self.rooms:
+                self.rooms[endpoint[1]].add(user_id)
+                return 200, {'room_id': endpoint[1]}
+            if method == 'PUT' and endpoint[:1] == ['rooms'] and endpoint[2:3] == ['send']:
+                room_id = endpoint[1]
+                if user_id not in self.rooms.get(room_id, ()):
+                    return 403, {'errcode': 'M_FORBIDDEN', 'error': 'Not in room'}
+                async with self._changed:
+                    self.position += 1
+                    event = {'event_id': f'${self.position}', 'type': endpoint[3], 'sender': user_id,
+                             'content': content, 'origin_server_ts': int(time.time() * 1000)}
+                    self.events.append((self.position, room_id, event))
+                    self._changed.notify_all()
+                return 200, {'event_id': event['event_id']}
+            if method == 'GET' and endpoint == ['sync']:
+                return 200, await self._sync(user_id, query)
+
+        elif method == 'POST' and path[:4] == ['_matrix', 'media', 'v3', 'upload']:
+            self.uploads += 1
+            return 200, {'content_uri': f'mxc://{self.server_name}/{secrets.token_hex(12)}'}
+
+        return 404, {'errcode': 'M_UNRECOGNIZED', 'error': 'Unrecognized request'}
+
+    async def _sync(self, user_id, query):
+        since = int(query.get('since', 0))
+        timeout = int(query.get('timeout', 0)) / 1000
+
+        def new_events():
+            return [(pos, room_id, event) for pos, room_id, event in self.events
+                    if pos > since and user_id in self.rooms.get(room_id, ())]
+
+        async with self._changed:
+            if 'since' in query and timeout:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(new_events), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            events = new_events() if 'since' in query else []
+            position = self.position
+        joined = {}
+        for _, room_id, event in events:
+            joined.setdefault(room_id, {'timeline': {'events': []}})['timeline']['events'].append(event)
+        for room_id, members in self.rooms.items():
+            if user_id in members:
+                joined.setdefault(room_id, {'timeline': {'events': []}})
+        return {'next_batch': str(position), 'rooms': {'join': joined}}
+
+
+async def run_with_stand_in(args):
+    stand_in = StandInHomeserver(delay=args.stand_in_delay)
+    url = await stand_in.start()
+    try:
+        return await LoadTest(url, stand_in.admin_token, **dict(load_test_options(args), admin_url=url)).run()
+    finally:
+        await stand_in.stop()
+
+
+def load_test_options(args):
+    return {
+        'users': args.users,
+        'users_per_room': args.users_per_room,
+        'duration': args.duration,
+        'ramp_up': args.ramp_up,
+        'message_rate': args.message_rate,
+        'upload_rate': args.upload_rate,
+        'upload_size': args.upload_size,
+        'sync_timeout': args.sync_timeout,
+        'server_name': args.server_name,
+        'verify_tls': not args.insecure,
+        'cleanup': not args.keep_users,
+        'admin_url': args.admin_url,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic Matrix client load and report capacity')
+    parser.add_argument('--url', default=os.environ.get('SYNAPSE_URL', 'http://synapse:8008'),
+                        help='homeserver URL for client traffic, e.g. https://matrix.example.com to go '
+                             'through nginx (default: SYNAPSE_URL or http://synapse:8008)')
+    parser.add_argument('--admin-url', default=os.environ.get('SYNAPSE_URL', 'http://synapse:8008'),
+                        help='URL for the Synapse admin API, used to create and remove test users; nginx does '
+                             'not proxy it (default: SYNAPSE_URL or http://synapse:8008)')
+    parser.add_argument('--admin-token', default=os.environ.get('SYNAPSE_ADMIN_TOKEN'),
+                        help='Synapse admin access token (default: SYNAPSE_ADMIN_TOKEN)')
+    parser.add_argument('--stand-in', action='store_true', help='run against a local in-memory stand-in homeserver')
+    parser.add_argument('--stand-in-delay', type=float, default=0.0, help=argparse.SUPPRESS)
+    parser.add_argument('--users', type=int, default=10, help='number of simulated users')
+    parser.add_argument('--users-per-room', type=int, default=10, help='users sharing each test room')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of load after setup')
+    parser.add_argument('--ramp-up', type=float, default=10, help='seconds over which users start')
+    parser.add_argument('--message-rate', type=float, default=2.0, help='messages per user per minute')
+    parser.add_argument('--upload-rate', type=float, default=0.2, help='media uploads per user per minute')
+    parser.add_argument('--upload-size', type=int, default=64 * 1024, help='bytes per upload')
+    parser.add_argument('--sync-timeout', type=float, default=30, help='/sync long-poll timeout in seconds')
+    parser.add_argument('--server-name', help='server name for test user IDs (default: from the admin token)')
+    parser.add_argument('--insecure', action='store_true', help='skip TLS certificate verification')
+    parser.add_argument('--keep-users', action='store_true', help="don't deactivate the test users afterwards")
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--record', help='append the report to this JSON lines file')
+    args = parser.parse_args()
+
+    try:
+        if args.stand_in:
+            report = asyncio.run(run_with_stand_in(args))
+        else:
+            if not args.admin_token:
+                parser.error('--admin-token or SYNAPSE_ADMIN_TOKEN is required')
+            report = asyncio.run(LoadTest(args.url, args.admin_token, **load_test_options(args)).run())
+    except RuntimeError as e:
+        print(f"Load test failed: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print('Load test interrupted' + ('' if args.keep_users else '; test users were deactivated'), file=sys.stderr)
+        return 130
+
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    if args.record:
+        with open(args.record, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
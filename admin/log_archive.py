@@ -0,0 +1,510 @@
+"""
+Persistent, searchable archive of container logs.
+
+A LogCollector follows `docker compose logs` for each service and feeds
+lines into a LogArchive. The archive writes them into hourly segment files
+made of zlib-compressed blocks of lines. Each segment has a sidecar index
+mapping words (plus service:<name> and level:<level> terms) to the blocks
+that contain them, so a search only decompresses blocks that can match.
+While a segment is open, each block's postings are appended to a JSON lines
+log; the compressed index is written once, when the segment is sealed.
+Segments are evicted oldest first once the archive exceeds its disk budget.
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+BLOCK_LINES = 512
+MAX_TOKEN_LENGTH = 32
+SEGMENT_SUFFIX = '.log.z'
+INDEX_SUFFIX = '.idx.json.gz'
+INDEX_LOG_SUFFIX = '.idx.jsonl'
+STATE_FILE = 'collector_state.json'
+# Time range of the lines in each segment, so searches can skip segments unopened
+RANGES_FILE = 'segment_ranges.json'
+# Sealed segment indexes kept in memory, least recently used dropped first
+MAX_CACHED_INDEXES = 8
+
+LEVELS = ['debug', 'info', 'warning', 'error', 'critical']
+LEVEL_ALIASES = {
+    'debug': 'debug',
+    'info': 'info', 'notice': 'info', 'log': 'info',
+    'warn': 'warning', 'warning': 'warning',
+    'error': 'error', 'err': 'error',
+    'critical': 'critical', 'crit': 'critical', 'fatal': 'critical',
+    'panic': 'critical', 'alert': 'critical', 'emerg': 'critical',
+}
+
+TOKEN_RE = re.compile(r'[a-z0-9_]{2,}')
+# Synapse ("- ERROR -"), Postgres ("ERROR:") and generic upper-case levels
+LEVEL_RE = re.compile(r'\b(DEBUG|INFO|NOTICE|LOG|WARN|WARNING|ERROR|CRITICAL|FATAL|PANIC)\b')
+# nginx error log ("[error]")
+NGINX_LEVEL_RE = re.compile(r'\[(debug|info|notice|warn|error|crit|alert|emerg)\]')
+TIMESTAMP_RE = re.compile(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?Z\s?')
+
+
+def tokenize(text):
+    """Lower-case word tokens used for both indexing and querying."""
+    return {token[:MAX_TOKEN_LENGTH] for token in TOKEN_RE.findall(text.lower())}
+
+
+def detect_level(message):
+    """Best-effort log level of a message, defaulting to info."""
+    match = LEVEL_RE.search(message) or NGINX_LEVEL_RE.search(message)
+    if not match:
+        return 'info'
+    return LEVEL_ALIASES[match.group(1).lower()]
+
+
+def parse_docker_line(line):
+    """Split a `docker logs --timestamps` line into (epoch seconds, message)."""
+    match = TIMESTAMP_RE.match(line)
+    if not match:
+        return time.time(), line
+    ts = datetime.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    if match.group(2):
+        ts += float(f"0.{match.group(2)}")
+    return ts, line[match.end():]
+
+
+def segment_key(ts):
+    """Hourly partition key (UTC) for a timestamp."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y%m%d%H')
+
+
+def segment_end(key):
+    """End of a segment's hour; every line in the segment is older than this."""
+    return datetime.strptime(key, '%Y%m%d%H').replace(tzinfo=timezone.utc).timestamp() + 3600
+
+
+class LogArchive:
+    """Append-only, compressed and indexed store of log lines."""
+
+    def __init__(self, directory, max_bytes=1024 ** 3, block_lines=BLOCK_LINES):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.block_lines = block_lines
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+        self._open_key = None
+        self._pending = []
+        self._ranges = {}
+        self._loaded = False
+        self.last_ts = {}
+        # How many lines at exactly last_ts were archived, so a resume skips just those
+        self.seen_at_last_ts = {}
+
+    def _ensure_loaded(self):
+        """Create the archive directory and restore state on first use."""
+        if self._loaded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_state()
+        keys = self.segment_keys()
+        if keys:
+            self._open_key = keys[-1]
+        # Segments left unsealed by a restart across an hour boundary
+        for key in keys[:-1]:
+            if os.path.exists(self._path(key, INDEX_LOG_SUFFIX)):
+                self._seal_locked(key)
+        self._loaded = True
+
+    def open(self):
+        """Load persisted state; called before following logs so resumes work."""
+        with self._lock:
+            self._ensure_loaded()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _load_state(self):
+        path = os.path.join(self.directory, STATE_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    state = json.load(f)
+                if 'last_ts' in state:
+                    self.last_ts = state['last_ts']
+                    self.seen_at_last_ts = state.get('seen_at_last_ts', {})
+                else:
+                    # Older state files only held {service: last_ts}
+                    self.last_ts = state
+            except Exception as e:
+                logger.error(f"Failed to load log collector state: {e}")
+        path = os.path.join(self.directory, RANGES_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self._ranges = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load log segment ranges: {e}")
+
+    def _save_json(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def _save_state(self):
+        self._save_json(STATE_FILE, {'last_ts': self.last_ts, 'seen_at_last_ts': self.seen_at_last_ts})
+        self._save_json(RANGES_FILE, self._ranges)
+
+    def segment_keys(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[:-len(SEGMENT_SUFFIX)]
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _load_index(self, key):
+        index = self._indexes.get(key)
+        if index is not None:
+            self._indexes.move_to_end(key)
+        else:
+            path = self._path(key, INDEX_SUFFIX)
+            log_path = self._path(key, INDEX_LOG_SUFFIX)
+            if os.path.exists(path):
+                with gzip.open(path, 'rt') as f:
+                    index = json.load(f)
+            elif os.path.exists(log_path):
+                index = self._read_index_log(log_path)
+            else:
+                return None
+            self._indexes[key] = index
+            self._trim_index_cache()
+        return index
+
+    def _trim_index_cache(self):
+        # The open segment's index is extended on every flush, so it always stays
+        for key in list(self._indexes):
+            if len(self._indexes) <= MAX_CACHED_INDEXES:
+                break
+            if key != self._open_key:
+                del self._indexes[key]
+
+    def _read_index_log(self, path):
+        """Rebuild an open segment's index from its per-block postings log."""
+        index = {'blocks': [], 'postings': {}}
+        valid = []
+        with open(path, 'r') as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; that block is not searchable
+                continue
+            valid.append(line if line.endswith('\n') else line + '\n')
+            self._add_block(index, entry['block'], entry['terms'])
+        if len(valid) != len(lines) or (lines and not lines[-1].endswith('\n')):
+            # Drop the damaged line so the next block's postings start on a line of their own
+            with open(path + '.tmp', 'w') as f:
+                f.writelines(valid)
+            os.replace(path + '.tmp', path)
+        return index
+
+    @staticmethod
+    def _add_block(index, block, terms):
+        block_id = len(index['blocks'])
+        index['blocks'].append(block)
+        for term in terms:
+            index['postings'].setdefault(term, []).append(block_id)
+
+    def _seal_locked(self, key):
+        """Write a finished segment's compressed index and drop its postings log."""
+        index = self._load_index(key)
+        if index is None:
+            return
+        index_path = self._path(key, INDEX_SUFFIX)
+        with gzip.open(index_path + '.tmp', 'wt') as f:
+            json.dump(index, f)
+        os.replace(index_path + '.tmp', index_path)
+        log_path = self._path(key, INDEX_LOG_SUFFIX)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+    def append(self, service, ts, message):
+        """Add one log line; it is searchable immediately."""
+        record = [ts, service, detect_level(message), message]
+        with self._lock:
+            self._ensure_loaded()
+            self._pending.append(record)
+            last_ts = self.last_ts.get(service, 0)
+            if ts > last_ts:
+                self.last_ts[service] = ts
+                self.seen_at_last_ts[service] = 1
+            elif ts == last_ts:
+                self.seen_at_last_ts[service] = self.seen_at_last_ts.get(service, 0) + 1
+            if len(self._pending) >= self.block_lines:
+                self._flush_locked()
+
+    def resume_point(self, service):
+        """Return (last archived timestamp or None, lines archived at exactly that time)."""
+        with self._lock:
+            self._ensure_loaded()
+            return self.last_ts.get(service), self.seen_at_last_ts.get(service, 0)
+
+    def flush(self):
+        """Write any buffered lines to disk."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        self._ensure_loaded()
+        records, self._pending = self._pending, []
+
+        # Lines are partitioned by the hour they were logged, but never into
+        # a segment older than the open one, so sealed segments stay immutable
+        key = segment_key(max(r[0] for r in records))
+        if self._open_key and key < self._open_key:
+            key = self._open_key
+        if key != self._open_key:
+            if self._open_key:
+                self._seal_locked(self._open_key)
+            self._open_key = key
+
+        index = self._load_index(key) or {'blocks': [], 'postings': {}}
+        data = zlib.compress('\n'.join(json.dumps(r) for r in records).encode('utf-8'))
+        segment_path = self._path(key, SEGMENT_SUFFIX)
+        with open(segment_path, 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+
+        block = {
+            'offset': offset,
+            'length': len(data),
+            'count': len(records),
+            'min_ts': min(r[0] for r in records),
+            'max_ts': max(r[0] for r in records),
+        }
+        terms = set()
+        for ts, service, level, message in records:
+            terms.update(tokenize(message))
+            terms.add(f'service:{service}')
+            terms.add(f'level:{level}')
+        terms = sorted(terms)
+        # Appending this block's postings keeps each flush proportional to
+        # the block, not to everything the segment holds so far
+        with open(self._path(key, INDEX_LOG_SUFFIX), 'a') as f:
+            f.write(json.dumps({'block': block, 'terms': terms}) + '\n')
+        self._add_block(index, block, terms)
+        self._indexes[key] = index
+        self._trim_index_cache()
+        span = self._ranges.get(key, [block['min_ts'], block['max_ts']])
+        self._ranges[key] = [min(span[0], block['min_ts']), max(span[1], block['max_ts'])]
+        self._save_state()
+        self._evict_locked()
+
+    def disk_usage(self):
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(
+            os.path.getsize(os.path.join(self.directory, name))
+            for name in os.listdir(self.directory)
+            if name.endswith((SEGMENT_SUFFIX, INDEX_SUFFIX, INDEX_LOG_SUFFIX))
+        )
+
+    def _evict_locked(self):
+        keys = self.segment_keys()
+        total = self.disk_usage()
+        while total > self.max_bytes and len(keys) > 1:
+            key = keys.pop(0)
+            for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX, INDEX_LOG_SUFFIX):
+                path = self._path(key, suffix)
+                if os.path.exists(path):
+                    total -= os.path.getsize(path)
+                    os.remove(path)
+            self._indexes.pop(key, None)
+            self._ranges.pop(key, None)
+            logger.info(f"Evicted log segment {key} to stay within the disk budget")
+
+    def stats(self):
+        keys = self.segment_keys()
+        return {
+            'segments': len(keys),
+            'bytes': self.disk_usage(),
+            'max_bytes': self.max_bytes,
+            'oldest': keys[0] if keys else None,
+            'newest': keys[-1] if keys else None,
+        }
+
+    def search(self, query='', services=None, min_level=None, start=None, end=None, limit=200):
+        """Find matching lines, newest first.
+
+        query: every word must appear in the line (case-insensitive)
+        services: iterable of service names, or None for all
+        min_level: lowest level to include, e.g. 'warning'
+        start, end: epoch seconds bounding the line timestamps
+        """
+        search_start = time.monotonic()
+        words = tokenize(query)
+        services = set(services) if services else None
+        levels = set(LEVELS[LEVELS.index(min_level):]) if min_level else None
+
+        def matches(record):
+            ts, service, level, message = record
+            return ((start is None or ts >= start)
+                    and (end is None or ts <= end)
+                    and (services is None or service in services)
+                    and (levels is None or level in levels)
+                    and (not words or words <= tokenize(message)))
+
+        results = []
+        blocks_read = 0
+        segments_searched = 0
+
+        with self._lock:
+            self._ensure_loaded()
+            pending = list(self._pending)
+            keys = self.segment_keys()
+            ranges = dict(self._ranges)
+        for record in reversed(pending):
+            if matches(record):
+                results.append(record)
+
+        for key in reversed(keys):
+            if len(results) >= limit:
+                break
+            if start is not None and segment_end(key) <= start:
+                # This and every older segment ends before the window
+                break
+            span = ranges.get(key)
+            if span and ((start is not None and span[1] < start) or (end is not None and span[0] > end)):
+                continue
+            with self._lock:
+                index = self._load_index(key)
+                if not index:
+                    continue
+                # The open segment's index grows under the lock, so pick the
+                # candidate blocks while holding it
+                blocks = list(index['blocks'])
+                postings = index['postings']
+                candidates = set(range(len(blocks)))
+                for word in words:
+                    candidates &= set(postings.get(word, []))
+                if services is not None:
+                    candidates &= {b for s in services for b in postings.get(f'service:{s}', [])}
+                if levels is not None:
+                    candidates &= {b for lvl in levels for b in postings.get(f'level:{lvl}', [])}
+            segments_searched += 1
+            candidates = [
+                b for b in candidates
+                if (start is None or blocks[b]['max_ts'] >= start)
+                and (end is None or blocks[b]['min_ts'] <= end)
+            ]
+            if not candidates:
+                continue
+
+            with open(self._path(key, SEGMENT_SUFFIX), 'rb') as f:
+                for block_id in sorted(candidates, reverse=True):
+                    block = blocks[block_id]
+                    f.seek(block['offset'])
+                    data = zlib.decompress(f.read(block['length'])).decode('utf-8')
+                    blocks_read += 1
+                    for line in reversed(data.split('\n')):
+                        record = json.loads(line)
+                        if matches(record):
+                            results.append(record)
+                    if len(results) >= limit:
+                        break
+
+        results.sort(key=lambda r: r[0], reverse=True)
+        return {
+            'results': [
+                {
+                    'timestamp': datetime.fromtimestamp(ts, tz=timezone.utc).isoformat(),
+                    'service': service,
+                    'level': level,
+                    'message': message
+                }
+                for ts, service, level, message in results[:limit]
+            ],
+            'segments_searched': segments_searched,
+            'blocks_read': blocks_read,
+            'took_ms': round((time.monotonic() - search_start) * 1000, 1),
+        }
+
+
+class LogCollector:
+    """Follows `docker compose logs` for each service into a LogArchive."""
+
+    def __init__(self, archive, services, cwd, flush_interval=30):
+        self.archive = archive
+        self.services = services
+        self.cwd = str(cwd)
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.archive.open()
+        for service in self.services:
+            thread = threading.Thread(target=self._follow, args=(service,), daemon=True,
+                                      name=f'log-collector-{service}')
+            thread.start()
+            self._threads.append(thread)
+        flusher = threading.Thread(target=self._flush_loop, daemon=True, name='log-collector-flush')
+        flusher.start()
+        self._threads.append(flusher)
+        logger.info(f"Log collector following: {', '.join(self.services)}")
+
+    def stop(self):
+        self._stop.set()
+        self.archive.flush()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.archive.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush log archive: {e}")
+
+    def _follow(self, service):
+        backoff = 1
+        while not self._stop.is_set():
+            cmd = ['docker', 'compose', 'logs', '--follow', '--timestamps', '--no-color', '--no-log-prefix']
+            last_ts, skip = self.archive.resume_point(service)
+            if last_ts:
+                # Resume from the last archived timestamp instead of re-reading
+                # history. Several lines can share it (docker timestamps are often
+                # whole seconds), so those already archived are skipped by count.
+                since = datetime.fromtimestamp(last_ts, tz=timezone.utc)
+                cmd += ['--since', since.strftime('%Y-%m-%dT%H:%M:%S.%fZ')]
+            cmd.append(service)
+
+            try:
+                with subprocess.Popen(cmd, cwd=self.cwd, stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL, text=True) as proc:
+                    for line in proc.stdout:
+                        ts, message = parse_docker_line(line.rstrip('\n'))
+                        if last_ts and ts < last_ts:
+                            continue
+                        if last_ts and ts == last_ts and skip:
+                            skip -= 1
+                            continue
+                        self.archive.append(service, ts, message)
+                        backoff = 1
+                        if self._stop.is_set():
+                            proc.terminate()
+                            break
+            except Exception as e:
+                logger.error(f"Log collector for {service} failed: {e}")
+
+            # The stream ends when the container stops; retry until it is back
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, 60)
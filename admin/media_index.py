@@ -0,0 +1,288 @@
+"""
+Media store usage index.
+
+Walks the Synapse media store with a pool of os.scandir workers and keeps
+a persistent SQLite index of every file (path, size, mtime). Re-scans are
+incremental: a directory whose mtime has not changed since the last scan
+is not listed again, so only directories where media was added or removed
+are re-read. Usage reports are answered from the index.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Top-level media store directories and the category they are reported under
+MEDIA_CATEGORIES = {
+    'local_content': 'local',
+    'remote_content': 'remote',
+    'local_thumbnails': 'thumbnail',
+    'remote_thumbnail': 'thumbnail',
+    'url_cache': 'url_cache',
+    'url_cache_thumbnails': 'thumbnail',
+}
+
+# (label, maximum age in days); the last bucket catches everything older
+AGE_BUCKETS = [
+    ('< 7 days', 7),
+    ('7-30 days', 30),
+    ('30-90 days', 90),
+    ('90-365 days', 365),
+    ('> 1 year', None),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    category TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def categorize(rel_path):
+    """Return the report category for a path relative to the media store."""
+    top = rel_path.split('/', 1)[0]
+    return MEDIA_CATEGORIES.get(top, 'other')
+
+
+def scan_directory(path, known_mtime_ns):
+    """List one directory unless its mtime matches the indexed one.
+
+    Returns (mtime_ns, files, subdirs); files and subdirs are None when the
+    directory is unchanged. Runs in a worker thread, so it must not touch
+    the database.
+    """
+    mtime_ns = os.stat(path).st_mtime_ns
+    if mtime_ns == known_mtime_ns:
+        return mtime_ns, None, None
+
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    files.append((entry.name, st.st_size, st.st_mtime))
+            except OSError:
+                # File removed between listing and stat
+                continue
+    return mtime_ns, files, subdirs
+
+
+class MediaIndex:
+    """Persistent, incrementally updated index of the media store.
+
+    root may be a callable returning the path, resolved on each scan, so
+    that finding the media store doesn't have to happen at import time.
+    """
+
+    def __init__(self, root, index_file, workers=8):
+        self._root = root
+        self.index_file = str(index_file)
+        self.workers = workers
+        self._scan_lock = threading.Lock()
+
+    @property
+    def root(self):
+        return str(self._root() if callable(self._root) else self._root)
+
+    @property
+    def scanning(self):
+        return self._scan_lock.locked()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.index_file)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        return conn
+
+    @staticmethod
+    def _abs(root, rel_path):
+        return os.path.join(root, rel_path) if rel_path else root
+
+    def scan(self):
+        """Bring the index up to date with the media store.
+
+        Returns scan statistics, or None if a scan is already running.
+        """
+        if not self._scan_lock.acquire(blocking=False):
+            return None
+        try:
+            return self._scan()
+        finally:
+            self._scan_lock.release()
+
+    def _scan(self):
+        start_time = time.monotonic()
+        root = self.root
+        if not os.path.isdir(root):
+            raise FileNotFoundError(f"Media store not found: {root}")
+
+        conn = self._connect()
+        try:
+            known = {}
+            children = {}
+            for path, parent, mtime_ns in conn.execute('SELECT path, parent, mtime_ns FROM dirs'):
+                known[path] = mtime_ns
+                if parent is not None:
+                    children.setdefault(parent, []).append(path)
+
+            seen = set()
+            stats = {'dirs_listed': 0, 'dirs_unchanged': 0, 'errors': 0}
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = {}
+
+                def submit(rel_path, parent):
+                    seen.add(rel_path)
+                    future = pool.submit(scan_directory, self._abs(root, rel_path), known.get(rel_path))
+                    pending[future] = (rel_path, parent)
+
+                submit('', None)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        rel_path, parent = pending.pop(future)
+                        try:
+                            mtime_ns, files, subdirs = future.result()
+                        except OSError as e:
+                            logger.warning(f"Failed to scan {self._abs(root, rel_path)}: {e}")
+                            stats['errors'] += 1
+                            # Keep the existing entries rather than dropping them
+                            for child in children.get(rel_path, []):
+                                submit(child, rel_path)
+                            continue
+
+                        if files is None:
+                            stats['dirs_unchanged'] += 1
+                            child_paths = children.get(rel_path, [])
+                        else:
+                            stats['dirs_listed'] += 1
+                            prefix = f"{rel_path}/" if rel_path else ''
+                            child_paths = [prefix + name for name in subdirs]
+                            conn.execute('DELETE FROM files WHERE dir = ?', (rel_path,))
+                            conn.executemany(
+                                'INSERT OR REPLACE INTO files (path, dir, category, size, mtime) VALUES (?, ?, ?, ?, ?)',
+                                [
+                                    (prefix + name, rel_path, categorize(prefix + name), size, mtime)
+                                    for name, size, mtime in files
+                                ]
+                            )
+                            conn.execute(
+                                'INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)',
+                                (rel_path, parent, mtime_ns)
+                            )
+
+                        for child in child_paths:
+                            submit(child, rel_path)
+
+            # Anything indexed but not reached this time has been deleted
+            removed = [path for path in known if path not in seen]
+            conn.executemany('DELETE FROM files WHERE dir = ?', [(p,) for p in removed])
+            conn.executemany('DELETE FROM dirs WHERE path = ?', [(p,) for p in removed])
+            stats['dirs_removed'] = len(removed)
+
+            stats['finished'] = datetime.now().isoformat()
+            stats['duration_seconds'] = round(time.monotonic() - start_time, 2)
+            summary = self._summarize(conn)
+            summary['last_scan'] = stats
+            conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                ('summary', json.dumps(summary))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.info(
+            f"Media scan finished in {stats['duration_seconds']}s: {stats['dirs_listed']} "
+            f"directories listed, {stats['dirs_unchanged']} unchanged"
+        )
+        return stats
+
+    def _summarize(self, conn, now=None):
+        """Totals by category and by age bucket."""
+        now = now or time.time()
+        by_category = {
+            category: {'files': count, 'bytes': total}
+            for category, count, total in conn.execute(
+                'SELECT category, COUNT(*), COALESCE(SUM(size), 0) FROM files GROUP BY category'
+            )
+        }
+
+        cases = []
+        params = []
+        for label, max_days in AGE_BUCKETS:
+            if max_days is None:
+                cases.append('ELSE ?')
+                params.append(label)
+            else:
+                cases.append('WHEN mtime >= ? THEN ?')
+                params.extend([now - max_days * 86400, label])
+        rows = conn.execute(
+            f"SELECT CASE {' '.join(cases)} END AS bucket, COUNT(*), COALESCE(SUM(size), 0) "
+            f"FROM files GROUP BY bucket",
+            params
+        ).fetchall()
+        counts = {label: (count, total) for label, count, total in rows}
+        by_age = [
+            {
+                'bucket': label,
+                'files': counts.get(label, (0, 0))[0],
+                'bytes': counts.get(label, (0, 0))[1]
+            }
+            for label, _ in AGE_BUCKETS
+        ]
+
+        return {
+            'total_files': sum(c['files'] for c in by_category.values()),
+            'total_bytes': sum(c['bytes'] for c in by_category.values()),
+            'by_category': by_category,
+            'by_age': by_age,
+        }
+
+    def report(self, top_n=20):
+        """Return the summary from the last scan plus the top_n largest files."""
+        if not os.path.exists(self.index_file):
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'summary'").fetchone()
+            if not row:
+                return None
+            summary = json.loads(row[0])
+            summary['largest_files'] = [
+                {'path': path, 'category': category, 'bytes': size,
+                 'modified': datetime.fromtimestamp(mtime).isoformat()}
+                for path, category, size, mtime in conn.execute(
+                    'SELECT path, category, size, mtime FROM files ORDER BY size DESC LIMIT ?',
+                    (top_n,)
+                )
+            ]
+            return summary
+        finally:
+            conn.close()
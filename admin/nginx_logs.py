@@ -0,0 +1,481 @@
+"""
+Readers for the log files nginx writes to the shared nginx_logs volume.
+
+LogTailer reads only what was appended since the last read, surviving
+truncation and rotation (finishing a file renamed to <name>.1 before moving
+on), in fixed-size chunks so memory use doesn't grow with the file. MediaCacheStats turns the media cache log into hit ratios
+and bytes served from cache. AccessLogStats turns the JSON access log into
+per-endpoint request counts, status codes and latency percentiles.
+"""
+
+import calendar
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_BYTES = 1024 * 1024
+# What a rotated log is renamed to; it is read to the end before the new file
+ROTATED_SUFFIX = '.1'
+
+# $upstream_cache_status values for responses nginx served from its cache
+CACHE_HIT_STATUSES = {'HIT', 'STALE', 'UPDATING', 'REVALIDATED'}
+# ...and for responses it had to fetch from Synapse
+CACHE_MISS_STATUSES = {'MISS', 'EXPIRED', 'BYPASS'}
+
+MAX_HOURLY_BUCKETS = 48
+MAX_MINUTE_BUCKETS = 180
+MINUTE_FORMAT = '%Y-%m-%dT%H:%M'
+HOUR_FORMAT = '%Y-%m-%dT%H'
+
+# Matrix endpoints grouped by how they behave; the first match wins. /sync
+# is long-polled, so its latency is mostly the client's timeout.
+ROUTE_CLASSES = [
+    ('media', re.compile(r'^/_matrix/(media|client/v1/media|federation/v1/media)/')),
+    ('federation', re.compile(r'^/_matrix/(federation|key)/')),
+    ('sync', re.compile(r'^/_matrix/client/[^/]+(/org\.matrix\.[^/]+)?/sync$')),
+    ('messages', re.compile(r'^/_matrix/client/[^/]+/rooms/[^/]+/messages$')),
+    ('send', re.compile(r'^/_matrix/client/[^/]+/rooms/[^/]+/(send|state|redact)/')),
+    ('keys', re.compile(r'^/_matrix/client/[^/]+/(keys|sendToDevice)/')),
+    ('auth', re.compile(r'^/_matrix/client/[^/]+/(login|logout|register|refresh)')),
+    ('client_other', re.compile(r'^/_matrix/client/')),
+    ('synapse', re.compile(r'^/_synapse/')),
+    ('admin_console', re.compile(r'^/admin(/|$)')),
+    ('well_known', re.compile(r'^/\.well-known/')),
+]
+FEDERATION_PORT = '8448'
+
+
+class LogTailer:
+    """Yields complete lines appended to a file since the previous call."""
+
+    def __init__(self, path, inode=None, offset=0):
+        self.path = str(path)
+        self.inode = inode
+        self.offset = offset
+
+    def state(self):
+        return {'inode': self.inode, 'offset': self.offset}
+
+    def size(self):
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def read_lines(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        if self.inode is not None and (st is None or st.st_ino != self.inode):
+            # Rotated: lines written after the last read are still in the old file
+            try:
+                rotated = os.stat(self.path + ROTATED_SUFFIX)
+            except FileNotFoundError:
+                rotated = None
+            if rotated is not None and rotated.st_ino == self.inode and rotated.st_size > self.offset:
+                yield from self._read_from(self.path + ROTATED_SUFFIX)
+        if st is None:
+            return
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            # New file (rotated) or truncated: start from the beginning
+            self.inode = st.st_ino
+            self.offset = 0
+        yield from self._read_from(self.path)
+
+    def _read_from(self, path):
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            partial = b''
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                lines = (partial + chunk).split(b'\n')
+                # The last element is an incomplete line (or empty); keep it
+                # for the next chunk and only consume complete lines
+                partial = lines.pop()
+                for line in lines:
+                    self.offset += len(line) + 1
+                    yield line.decode('utf-8', errors='replace')
+
+
+class MediaCacheStats:
+    """Hourly media cache hit/miss counts from the nginx media cache log.
+
+    Log lines are '$time_iso8601 $upstream_cache_status $status
+    $body_bytes_sent $request_time' (see log_format media_cache).
+    """
+
+    def __init__(self, log_path, state_file):
+        self.state_file = str(state_file)
+        self.tailer = LogTailer(log_path)
+        self.hours = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            self.tailer.inode = state['tailer']['inode']
+            self.tailer.offset = state['tailer']['offset']
+            self.hours = state['hours']
+        except Exception as e:
+            logger.error(f"Failed to load media cache stats: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump({'tailer': self.tailer.state(), 'hours': self.hours}, f)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def update(self):
+        """Fold newly logged requests into the hourly buckets."""
+        with self._lock:
+            self._load()
+            parsed = 0
+            for line in self.tailer.read_lines():
+                parts = line.split()
+                if len(parts) < 4:
+                    continue
+                hour = parts[0][:13]
+                cache_status, body_bytes = parts[1], parts[3]
+                bucket = self.hours.setdefault(hour, {})
+                counts = bucket.setdefault(cache_status, [0, 0])
+                counts[0] += 1
+                counts[1] += int(body_bytes) if body_bytes.isdigit() else 0
+                parsed += 1
+
+            for hour in sorted(self.hours)[:-MAX_HOURLY_BUCKETS]:
+                del self.hours[hour]
+            if parsed:
+                self._save()
+            return parsed
+
+    def report(self, hours=24, now=None):
+        """Hit ratio and bytes served from cache over the most recent hours."""
+        now = now or time.time()
+        first = time.strftime(HOUR_FORMAT, time.gmtime(window_start(now, hours, 3600)))
+        with self._lock:
+            self._load()
+            recent = sorted(hour for hour in self.hours if hour >= first)
+            by_status = {}
+            series = []
+            for hour in recent:
+                hits = misses = saved = 0
+                for status, (requests, body_bytes) in self.hours[hour].items():
+                    totals = by_status.setdefault(status, {'requests': 0, 'bytes': 0})
+                    totals['requests'] += requests
+                    totals['bytes'] += body_bytes
+                    if status in CACHE_HIT_STATUSES:
+                        hits += requests
+                        saved += body_bytes
+                    elif status in CACHE_MISS_STATUSES:
+                        misses += requests
+                series.append({
+                    'hour': hour,
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+                    'bytes_saved': saved,
+                })
+
+        hits = sum(s['hits'] for s in series)
+        misses = sum(s['misses'] for s in series)
+        return {
+            'requests': sum(t['requests'] for t in by_status.values()),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+            'bytes_saved': sum(s['bytes_saved'] for s in series),
+            'bytes_total': sum(t['bytes'] for t in by_status.values()),
+            'by_status': by_status,
+            'hourly': series,
+        }
+
+
+def window_start(now, count, width):
+    """Start of the window made of the current bucket and the count - 1 before it."""
+    return now - now % width - (count - 1) * width
+
+
+def bucket_start(key, fmt):
+    """Unix time at which a (UTC) bucket key starts."""
+    return calendar.timegm(time.strptime(key, fmt))
+
+
+def classify_route(uri, port=None):
+    """Name the group of endpoints a request path belongs to."""
+    for name, pattern in ROUTE_CLASSES:
+        if pattern.match(uri):
+            return name
+    if port == FEDERATION_PORT:
+        return 'federation'
+    return 'element'
+
+
+class LatencySketch:
+    """Mergeable latency histogram with logarithmic bins.
+
+    Every value lands in the bin for ceil(log(value) / log(GAMMA)), so any
+    quantile is returned within about 2.5% of the true value while a bucket
+    holds only the bins it has seen. Two sketches merge by adding bin counts,
+    which is how minute buckets are combined into longer windows.
+    """
+
+    GAMMA = 1.05
+    MIN_VALUE = 0.001
+
+    def __init__(self):
+        self.bins = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = math.ceil(math.log(max(value, self.MIN_VALUE)) / math.log(self.GAMMA))
+        self.bins[index] = self.bins.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # Midpoint of the bin's (GAMMA^(i-1), GAMMA^i] range
+                value = 2 * self.GAMMA ** index / (self.GAMMA + 1)
+                return min(value, self.max)
+        return self.max
+
+    def to_json(self):
+        return {'n': self.count, 's': round(self.total, 3), 'm': self.max, 'b': self.bins}
+
+    @classmethod
+    def from_json(cls, data):
+        sketch = cls()
+        sketch.count, sketch.total, sketch.max = data['n'], data['s'], data['m']
+        sketch.bins = {int(index): count for index, count in data['b'].items()}
+        return sketch
+
+
+def parse_upstream_time(value):
+    """$upstream_response_time: '-' without an upstream, comma-separated on retries."""
+    total = None
+    for part in str(value).replace(':', ',').split(','):
+        try:
+            total = (total or 0.0) + float(part.strip())
+        except ValueError:
+            continue
+    return total
+
+
+class RouteStats:
+    """Request counts, status codes and latency of one route class in one bucket."""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.statuses = {}
+        self.latency = LatencySketch()
+        self.upstream = LatencySketch()
+
+    def add(self, status, body_bytes, request_time, upstream_time):
+        self.requests += 1
+        self.bytes += body_bytes
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latency.add(request_time)
+        if upstream_time is not None:
+            self.upstream.add(upstream_time)
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.bytes += other.bytes
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.latency.merge(other.latency)
+        self.upstream.merge(other.upstream)
+        return self
+
+    def to_json(self):
+        return {
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'statuses': self.statuses,
+            'latency': self.latency.to_json(),
+            'upstream': self.upstream.to_json(),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls()
+        stats.requests, stats.bytes, stats.statuses = data['requests'], data['bytes'], data['statuses']
+        stats.latency = LatencySketch.from_json(data['latency'])
+        stats.upstream = LatencySketch.from_json(data['upstream'])
+        return stats
+
+
+class AccessLogStats:
+    """Per-route request rates, status codes and latency from the JSON access log.
+
+    Each line is one JSON object (see log_format matrix_json) and is folded
+    into a minute bucket and an hourly bucket per route class, so memory
+    is bounded by the number of buckets kept, not by traffic.
+    """
+
+    def __init__(self, log_path, state_file):
+        self.state_file = str(state_file)
+        self.tailer = LogTailer(log_path)
+        self.minutes = {}
+        self.hours = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            self.tailer.inode = state['tailer']['inode']
+            self.tailer.offset = state['tailer']['offset']
+            for key, target in (('minutes', self.minutes), ('hours', self.hours)):
+                for bucket, routes in state[key].items():
+                    target[bucket] = {
+                        route: RouteStats.from_json(data) for route, data in routes.items()
+                    }
+        except Exception as e:
+            logger.error(f"Failed to load access log stats: {e}")
+
+    def _save(self):
+        state = {'tailer': self.tailer.state()}
+        for key, buckets in (('minutes', self.minutes), ('hours', self.hours)):
+            state[key] = {
+                bucket: {route: stats.to_json() for route, stats in routes.items()}
+                for bucket, routes in buckets.items()
+            }
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def add_line(self, line):
+        """Fold one log line into its buckets; returns False if it isn't a request."""
+        try:
+            entry = json.loads(line)
+            ts = float(entry['time'])
+            status = str(entry['status'])
+            request_time = float(entry['request_time'])
+        except (ValueError, KeyError, TypeError):
+            return False
+        route = classify_route(entry.get('uri', ''), str(entry.get('port', '')))
+        body_bytes = int(entry.get('bytes') or 0)
+        upstream_time = parse_upstream_time(entry.get('upstream_time', '-'))
+
+        minute = time.strftime('%Y-%m-%dT%H:%M', time.gmtime(ts))
+        for buckets, key in ((self.minutes, minute), (self.hours, minute[:13])):
+            stats = buckets.setdefault(key, {}).setdefault(route, RouteStats())
+            stats.add(status, body_bytes, request_time, upstream_time)
+        return True
+
+    def update(self):
+        """Fold newly logged requests into the minute and hourly buckets."""
+        with self._lock:
+            self._load()
+            parsed = 0
+            for line in self.tailer.read_lines():
+                if self.add_line(line):
+                    parsed += 1
+
+            for minute in sorted(self.minutes)[:-MAX_MINUTE_BUCKETS]:
+                del self.minutes[minute]
+            for hour in sorted(self.hours)[:-MAX_HOURLY_BUCKETS]:
+                del self.hours[hour]
+            if parsed:
+                self._save()
+            return parsed
+
+    def report(self, minutes=60, now=None):
+        """Per-route totals, percentiles and a per-bucket series.
+
+        Windows up to MAX_MINUTE_BUCKETS use minute buckets; longer ones
+        use the hourly buckets. Rates are over the whole window, or from
+        the oldest bucket still kept if that is more recent.
+        """
+        now = now or time.time()
+        if minutes <= MAX_MINUTE_BUCKETS:
+            width, count, fmt = 60, minutes, MINUTE_FORMAT
+        else:
+            width, count, fmt = 3600, math.ceil(minutes / 60), HOUR_FORMAT
+        start = window_start(now, count, width)
+        first = time.strftime(fmt, time.gmtime(start))
+        with self._lock:
+            self._load()
+            buckets = self.minutes if width == 60 else self.hours
+            recent = sorted(key for key in buckets if key >= first)
+            if buckets:
+                start = max(start, bucket_start(min(buckets), fmt))
+
+            totals = {}
+            series = []
+            for key in recent:
+                point = {'bucket': key, 'routes': {}}
+                for route, stats in buckets[key].items():
+                    totals.setdefault(route, RouteStats()).merge(stats)
+                    point['routes'][route] = {
+                        'requests': stats.requests,
+                        'p95': stats.latency.quantile(0.95),
+                    }
+                series.append(point)
+
+        seconds = max(now - start, 0)
+        routes = []
+        for route, stats in sorted(totals.items(), key=lambda item: item[1].requests, reverse=True):
+            errors = sum(n for status, n in stats.statuses.items() if status.startswith('5'))
+            routes.append({
+                'route': route,
+                'requests': stats.requests,
+                'requests_per_second': round(stats.requests / seconds, 3) if seconds else None,
+                'bytes': stats.bytes,
+                'statuses': stats.statuses,
+                'error_ratio': round(errors / stats.requests, 4) if stats.requests else None,
+                'p50': stats.latency.quantile(0.5),
+                'p95': stats.latency.quantile(0.95),
+                'p99': stats.latency.quantile(0.99),
+                'max': stats.latency.max,
+                'upstream_p95': stats.upstream.quantile(0.95),
+            })
+        return {
+            'bucket_seconds': width,
+            'buckets': len(recent),
+            'window_seconds': round(seconds),
+            'routes': routes,
+            'series': series,
+        }
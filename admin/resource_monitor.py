@@ -0,0 +1,399 @@
+"""
+Per-container resource sampling from the Docker Engine stats stream.
+
+Each compose service gets one long-lived stats stream over the Docker
+socket (the engine pushes a sample about once a second); samples are kept
+at a fixed interval in array-backed ring buffers: a fine-grained one
+covering the last hour and a coarse one of averaged buckets covering the
+last day. Memory use is fixed per service no matter how long it runs.
+"""
+
+import http.client
+import json
+import logging
+import socket
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+DOCKER_SOCKET = '/var/run/docker.sock'
+
+# Values kept for every sample. CPU is a percentage of one core, as in
+# `docker stats` (up to 100 x online_cpus), the rates are bytes per second
+# since the previous sample.
+FIELDS = (
+    'cpu_percent',
+    'online_cpus',
+    'memory_bytes',
+    'memory_limit',
+    'block_read_rate',
+    'block_write_rate',
+    'net_rx_rate',
+    'net_tx_rate',
+)
+
+FINE_WINDOW_SECONDS = 3600
+COARSE_WINDOW_SECONDS = 24 * 3600
+COARSE_BUCKET_SECONDS = 300
+DISCOVERY_INTERVAL_SECONDS = 60
+# Alerts use the average over this window so single spikes don't fire them
+ALERT_WINDOW_SECONDS = 300
+
+
+class RingBuffer:
+    """Fixed-capacity columns of floats that share one write position."""
+
+    def __init__(self, capacity, fields=FIELDS):
+        self.capacity = capacity
+        self.fields = fields
+        self.timestamps = array('d', [0.0]) * capacity
+        self.columns = [array('d', [0.0]) * capacity for _ in fields]
+        self.count = 0
+        self.position = 0
+
+    def append(self, ts, values):
+        self.timestamps[self.position] = ts
+        for column, value in zip(self.columns, values):
+            column[self.position] = value
+        self.position = (self.position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def indices(self):
+        """Slot indices from oldest to newest."""
+        start = (self.position - self.count) % self.capacity
+        return ((start + i) % self.capacity for i in range(self.count))
+
+    def latest(self):
+        if not self.count:
+            return None
+        i = (self.position - 1) % self.capacity
+        return self.timestamps[i], [column[i] for column in self.columns]
+
+    def average(self, since):
+        """Mean of each field over samples at or after `since`."""
+        sums = [0.0] * len(self.fields)
+        n = 0
+        for i in self.indices():
+            if self.timestamps[i] < since:
+                continue
+            for f, column in enumerate(self.columns):
+                sums[f] += column[i]
+            n += 1
+        return [s / n for s in sums] if n else None
+
+    def downsample(self, since, until, points):
+        """Average samples in [since, until) into at most `points` buckets.
+
+        Returns columns ({'timestamps': [...], field: [...]}) with empty
+        buckets left out.
+        """
+        width = (until - since) / points
+        sums = [[0.0] * len(self.fields) for _ in range(points)]
+        counts = [0] * points
+        for i in self.indices():
+            ts = self.timestamps[i]
+            if ts < since or ts >= until:
+                continue
+            bucket = int((ts - since) / width)
+            for f, column in enumerate(self.columns):
+                sums[bucket][f] += column[i]
+            counts[bucket] += 1
+
+        result = {'timestamps': []}
+        result.update({field: [] for field in self.fields})
+        for bucket, n in enumerate(counts):
+            if not n:
+                continue
+            result['timestamps'].append(round(since + bucket * width))
+            for f, field in enumerate(self.fields):
+                result[field].append(round(sums[bucket][f] / n, 2))
+        return result
+
+
+def parse_stats(stats):
+    """Extract cumulative counters from one Docker stats sample.
+
+    Returns None for samples of stopped containers, which carry no data.
+    """
+    memory = stats.get('memory_stats') or {}
+    cpu = stats.get('cpu_stats') or {}
+    if 'usage' not in memory or 'system_cpu_usage' not in cpu:
+        return None
+
+    # Same as `docker stats`: page cache that can be reclaimed isn't "used"
+    memory_stats = memory.get('stats') or {}
+    inactive = memory_stats.get('inactive_file', memory_stats.get('total_inactive_file', 0))
+
+    block_read = block_write = 0
+    for entry in (stats.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []:
+        op = entry.get('op', '').lower()
+        if op == 'read':
+            block_read += entry.get('value', 0)
+        elif op == 'write':
+            block_write += entry.get('value', 0)
+
+    networks = (stats.get('networks') or {}).values()
+    cpu_usage = cpu.get('cpu_usage') or {}
+    return {
+        'cpu_total': cpu_usage.get('total_usage', 0),
+        'system_total': cpu['system_cpu_usage'],
+        # Older engines only report per-core usage, one entry per core
+        'online_cpus': cpu.get('online_cpus') or len(cpu_usage.get('percpu_usage') or []) or 1,
+        'memory_bytes': max(0, memory['usage'] - inactive),
+        'memory_limit': memory.get('limit', 0),
+        'block_read': block_read,
+        'block_write': block_write,
+        'net_rx': sum(n.get('rx_bytes', 0) for n in networks),
+        'net_tx': sum(n.get('tx_bytes', 0) for n in networks),
+    }
+
+
+class ContainerSeries:
+    """Sampled resource history of one compose service."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.fine = RingBuffer(FINE_WINDOW_SECONDS // max(1, interval))
+        self.coarse = RingBuffer(COARSE_WINDOW_SECONDS // COARSE_BUCKET_SECONDS)
+        self._previous = None
+        self._previous_ts = None
+        self._bucket = None
+        self._bucket_sums = [0.0] * len(FIELDS)
+        self._bucket_count = 0
+        self._lock = threading.Lock()
+
+    def add(self, stats, now):
+        """Record a Docker stats sample if the sampling interval has passed.
+
+        Returns True if the sample was kept.
+        """
+        counters = parse_stats(stats)
+        if counters is None:
+            return False
+        with self._lock:
+            previous, previous_ts = self._previous, self._previous_ts
+            if previous is not None and (now <= previous_ts or now - previous_ts < self.interval):
+                return False
+            self._previous, self._previous_ts = counters, now
+            if previous is None:
+                # Rates need two samples
+                return False
+
+            elapsed = now - previous_ts
+            deltas = {key: counters[key] - previous[key] for key in (
+                'cpu_total', 'system_total', 'block_read', 'block_write', 'net_rx', 'net_tx'
+            )}
+            if any(delta < 0 for delta in deltas.values()):
+                # Counters went backwards: the container was recreated
+                return False
+
+            # system_cpu_usage counts every core, so scale the share of the
+            # host up to a percentage of one core like `docker stats` does
+            cpu_percent = (deltas['cpu_total'] / deltas['system_total'] * counters['online_cpus'] * 100
+                           if deltas['system_total'] else 0.0)
+            values = (
+                cpu_percent,
+                counters['online_cpus'],
+                counters['memory_bytes'],
+                counters['memory_limit'],
+                deltas['block_read'] / elapsed,
+                deltas['block_write'] / elapsed,
+                deltas['net_rx'] / elapsed,
+                deltas['net_tx'] / elapsed,
+            )
+            self.fine.append(now, values)
+            self._add_to_bucket(now, values)
+            return True
+
+    def _add_to_bucket(self, now, values):
+        bucket = int(now // COARSE_BUCKET_SECONDS) * COARSE_BUCKET_SECONDS
+        if self._bucket is not None and bucket != self._bucket:
+            self.coarse.append(self._bucket, [s / self._bucket_count for s in self._bucket_sums])
+            self._bucket_sums = [0.0] * len(FIELDS)
+            self._bucket_count = 0
+        self._bucket = bucket
+        for f, value in enumerate(values):
+            self._bucket_sums[f] += value
+        self._bucket_count += 1
+
+    def current(self):
+        with self._lock:
+            latest = self.fine.latest()
+        if latest is None:
+            return None
+        ts, values = latest
+        current = {'timestamp': ts}
+        current.update({field: round(value, 2) for field, value in zip(FIELDS, values)})
+        return current
+
+    def series(self, now):
+        """Last hour at one point per minute and last day at one per bucket."""
+        with self._lock:
+            return {
+                '1h': self.fine.downsample(now - FINE_WINDOW_SECONDS, now, 60),
+                '24h': self.coarse.downsample(
+                    now - COARSE_WINDOW_SECONDS, now, COARSE_WINDOW_SECONDS // COARSE_BUCKET_SECONDS
+                ),
+            }
+
+    def recent_average(self, now):
+        with self._lock:
+            average = self.fine.average(now - ALERT_WINDOW_SECONDS)
+        return dict(zip(FIELDS, average)) if average else None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to the Docker Engine API over its Unix socket."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def docker_stats_stream(container_id, socket_path=DOCKER_SOCKET):
+    """Yield stats samples for a container from one streaming API request."""
+    conn = UnixHTTPConnection(socket_path, timeout=60)
+    try:
+        conn.request('GET', f'/containers/{container_id}/stats?stream=true')
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise RuntimeError(f"Docker stats for {container_id} failed ({resp.status}): {resp.read()[:200]}")
+        while True:
+            line = resp.readline()
+            if not line:
+                return
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        conn.close()
+
+
+class ResourceSampler:
+    """Keeps one stats stream per compose service and samples it into series.
+
+    `discover` returns {service: container_id}; it is called once a minute
+    to pick up new and recreated containers. `stream` yields stats samples
+    for a container id (docker_stats_stream by default).
+    """
+
+    def __init__(self, discover, interval=10, cpu_alert_percent=90,
+                 memory_alert_percent=90, stream=docker_stats_stream):
+        self.discover = discover
+        self.interval = interval
+        self.cpu_alert_percent = cpu_alert_percent
+        self.memory_alert_percent = memory_alert_percent
+        self.stream = stream
+        self.series = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh_streams()
+            self._stop.wait(DISCOVERY_INTERVAL_SECONDS)
+
+    def refresh_streams(self):
+        """Start a stream for every container that doesn't have a live one."""
+        try:
+            containers = self.discover()
+        except Exception as e:
+            logger.error(f"Failed to list containers for resource sampling: {e}")
+            return
+        with self._lock:
+            for service, container_id in containers.items():
+                current = self._streams.get(service)
+                if current and current[0] == container_id and current[1].is_alive():
+                    continue
+                series = self.series.setdefault(service, ContainerSeries(self.interval))
+                thread = threading.Thread(
+                    target=self._follow,
+                    args=(service, container_id, series),
+                    name=f'resource-stream-{service}',
+                    daemon=True
+                )
+                self._streams[service] = (container_id, thread)
+                thread.start()
+
+    def _follow(self, service, container_id, series):
+        try:
+            for stats in self.stream(container_id):
+                if self._stop.is_set():
+                    return
+                with self._lock:
+                    if self._streams.get(service, (None,))[0] != container_id:
+                        # Replaced by a stream for a recreated container
+                        return
+                series.add(stats, time.time())
+        except Exception as e:
+            logger.error(f"Resource stream for {service} ended: {e}")
+
+    def alerts(self, now=None):
+        """Services whose recent average CPU or memory use is over threshold."""
+        now = now or time.time()
+        with self._lock:
+            services = sorted(self.series.items())
+        alerts = []
+        for service, series in services:
+            average = series.recent_average(now)
+            if not average:
+                continue
+            if average['cpu_percent'] >= self.cpu_alert_percent:
+                alerts.append({
+                    'service': service,
+                    'metric': 'cpu_percent',
+                    'value': round(average['cpu_percent'], 1),
+                    'threshold': self.cpu_alert_percent,
+                })
+            if average['memory_limit']:
+                memory_percent = average['memory_bytes'] / average['memory_limit'] * 100
+                if memory_percent >= self.memory_alert_percent:
+                    alerts.append({
+                        'service': service,
+                        'metric': 'memory_percent',
+                        'value': round(memory_percent, 1),
+                        'threshold': self.memory_alert_percent,
+                    })
+        return alerts
+
+    def report(self, now=None):
+        now = now or time.time()
+        # refresh_streams adds services from the discovery thread
+        with self._lock:
+            snapshot = [(service, series, self._streams.get(service))
+                        for service, series in sorted(self.series.items())]
+        services = {}
+        for service, series, stream in snapshot:
+            services[service] = {
+                'streaming': bool(stream and stream[1].is_alive()),
+                'current': series.current(),
+                'series': series.series(now),
+            }
+        return {
+            'interval_seconds': self.interval,
+            'services': services,
+            'alerts': self.alerts(now),
+            'thresholds': {
+                'cpu_percent': self.cpu_alert_percent,
+                'memory_percent': self.memory_alert_percent,
+            },
+        }
@@ -180,6 +180,44 @@ function closeLogs() {
     document.getElementById('logs-panel').style.display = 'none';
 }
 
+// Search archived logs
+async function searchLogs(event) {
+    event.preventDefault();
+    
+    const summary = document.getElementById('log-search-summary');
+    const results = document.getElementById('log-search-results');
+    const params = new URLSearchParams();
+    
+    const query = document.getElementById('log-search-query').value;
+    const service = document.getElementById('log-search-service').value;
+    const level = document.getElementById('log-search-level').value;
+    const range = document.getElementById('log-search-range').value;
+    if (query) params.set('q', query);
+    if (service) params.set('service', service);
+    if (level) params.set('level', level);
+    if (range) params.set('since', Date.now() / 1000 - parseInt(range, 10));
+    
+    summary.textContent = 'Searching...';
+    
+    try {
+        const data = await apiCall(`/admin/api/logs/search?${params.toString()}`);
+        
+        if (data && data.success) {
+            summary.textContent = `${data.results.length} matching lines in ${data.took_ms} ms ` +
+                `(${data.blocks_read} blocks read from ${data.segments_searched} segments, ` +
+                `archive ${formatBytes(data.archive.bytes)} of ${formatBytes(data.archive.max_bytes)})`;
+            results.textContent = data.results
+                .map(r => `${r.timestamp} ${r.service} [${r.level}] ${r.message}`)
+                .join('\n');
+            results.style.display = data.results.length ? 'block' : 'none';
+        } else {
+            summary.textContent = data ? (data.error || 'Search failed') : 'Search failed';
+        }
+    } catch (error) {
+        summary.textContent = `Error: ${error.message}`;
+    }
+}
+
 // Create backup
 async function createBackup() {
     showOutput('backup-output', 'Creating backup...', 'info');
@@ -192,11 +230,528 @@ async function createBackup() {
         } else {
             showOutput('backup-output', data.error || 'Backup failed', 'error');
         }
+        loadBackupHistory();
     } catch (error) {
         showOutput('backup-output', `Error: ${error.message}`, 'error');
     }
 }
 
+// Stream the latest backup back and check its checksums, optionally restoring it
+async function checkBackup(restore) {
+    try {
+        const data = await apiCall('/admin/api/backup/verify', 'POST', {restore});
+        if (!data || !data.success) {
+            showOutput('backup-output', data ? (data.error || 'Unknown error') : 'Failed to start', 'error');
+            return;
+        }
+        showOutput('backup-output', `${data.message}...`, 'info');
+        
+        // Poll until the check has finished, then show its outcome
+        const checkInterval = setInterval(async () => {
+            try {
+                const history = await apiCall('/admin/api/backup/history');
+                if (!history || history.running) return;
+                clearInterval(checkInterval);
+                
+                const last = history.history[0];
+                if (last && last.success) {
+                    const recovery = last.recovery_seconds ? ` Recovery took ${formatSeconds(last.recovery_seconds)}.` : '';
+                    showOutput('backup-output', `${last.filename}: ${last.files} files match their checksums.${recovery}`, 'success');
+                } else {
+                    showOutput('backup-output', last ? last.error : 'Backup check failed', 'error');
+                }
+                renderBackupHistory(history.history);
+            } catch (error) {
+                // Ignore errors during polling
+            }
+        }, 3000);
+    } catch (error) {
+        showOutput('backup-output', `Error: ${error.message}`, 'error');
+    }
+}
+
+function renderBackupHistory(history) {
+    const types = {backup: 'Backup', verify: 'Verify', restore_test: 'Test Restore'};
+    renderTable('backup-history', [
+        ['When', h => new Date(h.started).toLocaleString()],
+        ['Type', h => types[h.type] || h.type],
+        ['Backup', h => h.filename || '-'],
+        ['Result', h => h.success ? 'OK' : (h.error || 'Failed')],
+        ['Size', h => h.size_bytes ? formatBytes(h.size_bytes) : (h.compressed_bytes ? formatBytes(h.compressed_bytes) : '-')],
+        ['Throughput', h => {
+            const rate = h.type === 'backup' ? h.upload_bytes_per_second : h.bytes_per_second;
+            return rate ? `${formatBytes(rate)}/s` : '-';
+        }],
+        ['Database', h => h.database && h.database.success ?
+            `${h.database.users} users, ${h.database.events} events in ${formatSeconds(h.database.restore_seconds)}` : '-'],
+        ['Duration', h => formatSeconds(h.recovery_seconds || h.duration_seconds)]
+    ], history, 'No backups recorded yet');
+}
+
+async function loadBackupHistory() {
+    try {
+        const data = await apiCall('/admin/api/backup/history');
+        if (data && data.success) renderBackupHistory(data.history);
+    } catch (error) {
+        console.error('Error loading backup history:', error);
+    }
+}
+
+// Format a byte count for display
+function formatBytes(bytes) {
+    if (!bytes || bytes < 1) return '0 B';
+    const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+    const i = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+    return `${(bytes / Math.pow(1024, i)).toFixed(i === 0 ? 0 : 1)} ${units[i]}`;
+}
+
+// Start a database maintenance task
+async function runMaintenance(task) {
+    showOutput('maintenance-output', `Starting ${task}...`, 'info');
+    
+    try {
+        const data = await apiCall(`/admin/api/maintenance/${task}`, 'POST');
+        
+        if (data && data.success) {
+            showOutput('maintenance-output', data.message, 'success');
+        } else {
+            showOutput('maintenance-output', data.error || 'Failed to start task', 'error');
+        }
+    } catch (error) {
+        showOutput('maintenance-output', `Error: ${error.message}`, 'error');
+    }
+}
+
+// Load database maintenance history
+async function loadMaintenanceHistory() {
+    const historyDiv = document.getElementById('maintenance-history');
+    
+    try {
+        const data = await apiCall('/admin/api/maintenance/history');
+        
+        if (data && data.history) {
+            if (data.history.length === 0) {
+                historyDiv.innerHTML = '<p>No maintenance runs yet.</p>';
+                return;
+            }
+            historyDiv.innerHTML = '';
+            data.history.forEach(run => {
+                const runDiv = document.createElement('div');
+                runDiv.className = 'schedule-item';
+                
+                const info = document.createElement('div');
+                info.className = 'schedule-info';
+                
+                const title = document.createElement('div');
+                title.className = 'schedule-type';
+                title.textContent = `${run.task} - ${run.success ? 'OK' : 'Failed'}`;
+                info.appendChild(title);
+                
+                const details = document.createElement('div');
+                details.className = 'schedule-time';
+                details.textContent = run.success ?
+                    `${new Date(run.started).toLocaleString()} | ${run.rows_reclaimed || 0} rows, ` +
+                    `${formatBytes(run.bytes_reclaimed)} reclaimed | ${run.duration_seconds}s` :
+                    `${new Date(run.started).toLocaleString()} | ${run.error || 'Unknown error'}`;
+                info.appendChild(details);
+                
+                runDiv.appendChild(info);
+                historyDiv.appendChild(runDiv);
+            });
+        }
+    } catch (error) {
+        historyDiv.innerHTML = `<p class="error">Error loading maintenance history: ${error.message}</p>`;
+    }
+}
+
+// Render rows into a table inside a container; columns are [header, row => value] pairs
+function renderTable(containerId, columns, rows, emptyMessage = 'No data') {
+    const container = document.getElementById(containerId);
+    while (container.firstChild) {
+        container.removeChild(container.firstChild);
+    }
+    
+    if (!rows || rows.length === 0) {
+        const empty = document.createElement('p');
+        empty.textContent = emptyMessage;
+        container.appendChild(empty);
+        return;
+    }
+    
+    const table = document.createElement('table');
+    table.className = 'users-table';
+    const headRow = document.createElement('tr');
+    columns.forEach(([header]) => {
+        const th = document.createElement('th');
+        th.textContent = header;
+        headRow.appendChild(th);
+    });
+    const thead = document.createElement('thead');
+    thead.appendChild(headRow);
+    table.appendChild(thead);
+    
+    const tbody = document.createElement('tbody');
+    rows.forEach(row => {
+        const tr = document.createElement('tr');
+        columns.forEach(([, value]) => {
+            const td = document.createElement('td');
+            const content = value(row);
+            if (content instanceof Node) {
+                td.appendChild(content);
+            } else {
+                td.textContent = content;
+            }
+            tr.appendChild(td);
+        });
+        tbody.appendChild(tr);
+    });
+    table.appendChild(tbody);
+    container.appendChild(table);
+}
+
+// Draw a small line chart of a series of numbers as an inline SVG
+function sparkline(values, max = null, width = 120, height = 24) {
+    const svgNs = 'http://www.w3.org/2000/svg';
+    const svg = document.createElementNS(svgNs, 'svg');
+    svg.setAttribute('width', width);
+    svg.setAttribute('height', height);
+    svg.setAttribute('class', 'sparkline');
+    if (!values || values.length < 2) return svg;
+    
+    const top = max || Math.max(...values) || 1;
+    const points = values.map((v, i) =>
+        `${(i / (values.length - 1) * width).toFixed(1)},${(height - Math.min(v / top, 1) * (height - 2) - 1).toFixed(1)}`
+    );
+    const line = document.createElementNS(svgNs, 'polyline');
+    line.setAttribute('points', points.join(' '));
+    svg.appendChild(line);
+    return svg;
+}
+
+// Format a 0-1 ratio as a percentage
+function formatPercent(ratio) {
+    return `${((ratio || 0) * 100).toFixed(1)}%`;
+}
+
+// Load cached database analysis
+async function loadDbAnalysis() {
+    const summary = document.getElementById('db-analysis-summary');
+    
+    try {
+        const data = await apiCall('/admin/api/db/analysis');
+        if (!data || !data.success) {
+            summary.textContent = 'Failed to load database analysis';
+            return;
+        }
+        
+        const analysis = data.analysis;
+        if (!analysis) {
+            summary.textContent = 'Analyzing database, this may take a minute...';
+        } else if (analysis.error) {
+            summary.textContent = `Analysis failed: ${analysis.error}`;
+        } else {
+            summary.textContent = `Database size: ${formatBytes(analysis.database_bytes)} | ` +
+                `Analyzed ${new Date(analysis.generated).toLocaleString()} in ${analysis.duration_seconds}s` +
+                (data.running ? ' | Refreshing...' : '');
+            
+            renderTable('db-tables', [
+                ['Table', t => t.table],
+                ['Total', t => formatBytes(t.total_bytes)],
+                ['Indexes', t => formatBytes(t.index_bytes)],
+                ['Est. Bloat', t => `${formatBytes(t.bloat_bytes)} (${formatPercent(t.bloat_ratio)})`],
+                ['Dead Rows', t => `${t.dead_rows} (${formatPercent(t.dead_ratio)})`],
+                ['Seq / Index Scans', t => `${t.seq_scans} / ${t.index_scans}`]
+            ], analysis.tables);
+            
+            renderTable('db-indexes', [
+                ['Index', i => i.index],
+                ['Table', i => i.table],
+                ['Size', i => formatBytes(i.bytes)],
+                ['Scans', i => i.scans]
+            ], analysis.indexes);
+            
+            const rooms = analysis.rooms || {};
+            const stateRows = {};
+            (rooms.by_state || []).forEach(r => { stateRows[r.room_id] = r.state_rows; });
+            renderTable('db-rooms', [
+                ['Room', r => r.name || r.room_id],
+                ['Events', r => r.events],
+                ['State Rows', r => stateRows[r.room_id] !== undefined ? stateRows[r.room_id] : '-']
+            ], rooms.by_events);
+            
+            renderTable('db-statements', [
+                ['Query', q => q.query.length > 120 ? `${q.query.slice(0, 120)}...` : q.query],
+                ['Calls', q => q.calls],
+                ['Total (ms)', q => q.total_ms],
+                ['Mean (ms)', q => q.mean_ms]
+            ], analysis.slow_statements, 'pg_stat_statements is not enabled');
+        }
+        
+        if (data.running) {
+            setTimeout(loadDbAnalysis, 10000);
+        }
+    } catch (error) {
+        summary.textContent = `Error: ${error.message}`;
+    }
+}
+
+// Start a fresh database analysis
+async function refreshDbAnalysis() {
+    const summary = document.getElementById('db-analysis-summary');
+    try {
+        const data = await apiCall('/admin/api/db/analysis', 'POST');
+        if (data && data.success) {
+            summary.textContent = 'Analyzing database, this may take a minute...';
+            setTimeout(loadDbAnalysis, 5000);
+        }
+    } catch (error) {
+        summary.textContent = `Error: ${error.message}`;
+    }
+}
+
+// Load media store usage
+async function loadMediaUsage() {
+    const summary = document.getElementById('media-summary');
+    
+    try {
+        const data = await apiCall('/admin/api/media/usage');
+        if (!data || !data.success) {
+            summary.textContent = data && data.error ? data.error : 'Failed to load media usage';
+            return;
+        }
+        
+        const usage = data.usage;
+        if (!usage) {
+            summary.textContent = data.scanning ?
+                'Scanning media store for the first time...' :
+                'Media store has not been scanned yet. Click "Scan Now".';
+        } else {
+            const scan = usage.last_scan;
+            summary.textContent = `${usage.total_files} files, ${formatBytes(usage.total_bytes)} | ` +
+                `Last scan ${new Date(scan.finished).toLocaleString()} took ${scan.duration_seconds}s ` +
+                `(${scan.dirs_listed} directories changed)` +
+                (data.scanning ? ' | Scanning...' : '');
+            
+            renderTable('media-categories', [
+                ['Type', c => c.category],
+                ['Files', c => c.files],
+                ['Size', c => formatBytes(c.bytes)]
+            ], Object.entries(usage.by_category).map(([category, c]) => ({ category, ...c })));
+            
+            renderTable('media-ages', [
+                ['Age', a => a.bucket],
+                ['Files', a => a.files],
+                ['Size', a => formatBytes(a.bytes)]
+            ], usage.by_age);
+            
+            renderTable('media-largest', [
+                ['File', f => f.path],
+                ['Type', f => f.category],
+                ['Size', f => formatBytes(f.bytes)],
+                ['Modified', f => new Date(f.modified).toLocaleString()]
+            ], usage.largest_files);
+        }
+        
+        if (data.scanning) {
+            setTimeout(loadMediaUsage, 10000);
+        }
+    } catch (error) {
+        summary.textContent = `Error: ${error.message}`;
+    }
+}
+
+// Load nginx media cache hit rates
+async function loadMediaCacheStats() {
+    const status = document.getElementById('media-cache-status');
+    
+    try {
+        const data = await apiCall('/admin/api/media-cache');
+        if (!data || !data.success) {
+            status.textContent = data && data.error ? data.error : 'Failed to load media cache stats';
+            return;
+        }
+        
+        const stats = data.stats;
+        status.textContent = data.enabled ?
+            'Media cache is enabled.' :
+            'Media cache is disabled. Set ENABLE_MEDIA_CACHE=true in .env and run "docker compose up -d nginx" to enable it.';
+        document.getElementById('media-cache-hit-ratio').textContent =
+            stats.hit_ratio === null ? '-' : formatPercent(stats.hit_ratio);
+        document.getElementById('media-cache-requests').textContent = stats.requests;
+        document.getElementById('media-cache-bytes-saved').textContent = formatBytes(stats.bytes_saved);
+        
+        renderTable('media-cache-hourly', [
+            ['Hour', h => h.hour.replace('T', ' ') + ':00'],
+            ['Hits', h => h.hits],
+            ['Misses', h => h.misses],
+            ['Hit Ratio', h => h.hit_ratio === null ? '-' : formatPercent(h.hit_ratio)],
+            ['Served From Cache', h => formatBytes(h.bytes_saved)]
+        ], stats.hourly.slice().reverse(), 'No media requests logged yet');
+    } catch (error) {
+        status.textContent = `Error: ${error.message}`;
+    }
+}
+
+// Load request rates and latency per endpoint group from the nginx access log
+async function loadTraffic() {
+    const status = document.getElementById('traffic-status');
+    const minutes = document.getElementById('traffic-range').value;
+    
+    try {
+        const data = await apiCall(`/admin/api/nginx/traffic?minutes=${minutes}`);
+        if (!data || !data.success) {
+            status.textContent = data && data.error ? data.error : 'Failed to load traffic stats';
+            return;
+        }
+        
+        const traffic = data.traffic;
+        const unit = traffic.bucket_seconds === 60 ? 'minute' : 'hour';
+        status.textContent = traffic.buckets ?
+            `${traffic.buckets} ${unit}(s) with requests. Latency is nginx's request time; /sync is long-polled.` :
+            'No requests logged yet.';
+        
+        const statuses = r => Object.entries(r.statuses)
+            .sort(([a], [b]) => a.localeCompare(b))
+            .map(([code, count]) => `${code}: ${count}`).join(', ');
+        renderTable('traffic-table', [
+            ['Endpoints', r => r.route],
+            ['Requests', r => `${r.requests} (${r.requests_per_second}/s)`],
+            ['Status Codes', statuses],
+            ['5xx', r => formatPercent(r.error_ratio)],
+            ['p50 / p95 / p99', r => `${formatSeconds(r.p50)} / ${formatSeconds(r.p95)} / ${formatSeconds(r.p99)}`],
+            ['Upstream p95', r => formatSeconds(r.upstream_p95)],
+            ['p95 History', r => sparkline(traffic.series.map(p => p.routes[r.route] ? p.routes[r.route].p95 : 0))],
+            ['Sent', r => formatBytes(r.bytes)]
+        ], traffic.routes, 'No requests logged yet');
+    } catch (error) {
+        status.textContent = `Error: ${error.message}`;
+    }
+}
+
+// Load per-container CPU, memory, disk and network use
+async function loadResources() {
+    const status = document.getElementById('resources-status');
+    const range = document.getElementById('resources-range').value;
+    
+    try {
+        const data = await apiCall('/admin/api/resources');
+        if (!data || !data.success) {
+            status.textContent = data && data.error ? data.error : 'Failed to load resource usage';
+            return;
+        }
+        
+        const alerts = document.getElementById('resources-alerts');
+        alerts.textContent = data.alerts.map(a =>
+            `${a.service}: ${a.metric === 'cpu_percent' ? 'CPU' : 'memory'} at ${a.value}% ` +
+            `(threshold ${a.threshold}%, 5 minute average)`
+        ).join('\n');
+        alerts.className = data.alerts.length ? 'output show error' : 'output';
+        status.textContent = `Sampled every ${data.interval_seconds}s. CPU is a percentage of one core, as in docker stats.`;
+        
+        const rows = Object.entries(data.services).map(([name, service]) => ({name, ...service}));
+        const current = (row, field) => row.current ? row.current[field] : null;
+        renderTable('resources-table', [
+            ['Service', r => r.streaming ? r.name : `${r.name} (not sampling)`],
+            ['CPU', r => current(r, 'cpu_percent') === null ? '-' : `${current(r, 'cpu_percent').toFixed(1)}%`],
+            ['CPU History', r => sparkline(r.series[range].cpu_percent, 100 * (current(r, 'online_cpus') || 1))],
+            ['Memory', r => current(r, 'memory_bytes') === null ? '-' :
+                `${formatBytes(current(r, 'memory_bytes'))} / ${formatBytes(current(r, 'memory_limit'))}`],
+            ['Memory History', r => sparkline(r.series[range].memory_bytes, current(r, 'memory_limit'))],
+            ['Disk Read/Write', r => current(r, 'block_read_rate') === null ? '-' :
+                `${formatBytes(current(r, 'block_read_rate'))}/s / ${formatBytes(current(r, 'block_write_rate'))}/s`],
+            ['Network In/Out', r => current(r, 'net_rx_rate') === null ? '-' :
+                `${formatBytes(current(r, 'net_rx_rate'))}/s / ${formatBytes(current(r, 'net_tx_rate'))}/s`]
+        ], rows, 'No samples yet');
+    } catch (error) {
+        status.textContent = `Error: ${error.message}`;
+    }
+}
+
+// Format seconds as ms below one second
+function formatSeconds(seconds) {
+    if (seconds === null || seconds === undefined) return '-';
+    return seconds < 1 ? `${(seconds * 1000).toFixed(1)} ms` : `${seconds.toFixed(2)} s`;
+}
+
+// Load Synapse's own metrics: /sync latency, reactor, database and caches
+async function loadSynapsePerformance() {
+    const status = document.getElementById('synapse-perf-status');
+    
+    try {
+        const data = await apiCall('/admin/api/synapse/performance');
+        if (!data || !data.success) {
+            status.textContent = data && data.error ? data.error : 'Failed to load Synapse performance';
+            return;
+        }
+        
+        if (!data.enabled) {
+            status.textContent = 'Synapse metrics are disabled. Set ENABLE_METRICS=true in .env and run ' +
+                '"docker compose up -d synapse" to enable them.';
+        } else if (data.error) {
+            status.textContent = data.error;
+        } else if (!data.current) {
+            status.textContent = 'Waiting for the second metrics scrape...';
+        } else {
+            status.textContent = `Caches and transactions over the last ${Math.round(data.window_seconds / 60)} minutes.`;
+        }
+        
+        const alerts = document.getElementById('synapse-perf-alerts');
+        alerts.textContent = data.alerts.map(a => a.message).join('\n');
+        alerts.className = data.alerts.length ? 'output show error' : 'output';
+        
+        const c = data.current;
+        const history = data.history['1h'];
+        const metrics = [
+            ['/sync p50 / p95', c && `${formatSeconds(c.sync_p50)} / ${formatSeconds(c.sync_p95)}`, history.sync_p95],
+            ['/sync requests', c && `${c.sync_rate.toFixed(2)}/s`, history.sync_rate],
+            ['Reactor tick mean / p95', c && `${formatSeconds(c.reactor_tick_mean)} / ${formatSeconds(c.reactor_tick_p95)}`,
+                history.reactor_tick_p95],
+            ['DB transactions', c && `${c.db_txn_rate.toFixed(1)}/s, mean ${formatSeconds(c.db_txn_mean)}`, history.db_txn_mean],
+            ['Events persisted', c && `${c.events_persisted_rate.toFixed(2)}/s`, history.events_persisted_rate],
+            ['Event processing lag', c && formatSeconds(c.event_processing_lag), history.event_processing_lag],
+            ['Cache hit ratio', c && formatPercent(c.cache_hit_ratio), history.cache_hit_ratio]
+        ];
+        renderTable('synapse-perf-summary', [
+            ['Metric', m => m[0]],
+            ['Current', m => m[1] || '-'],
+            ['Last Hour', m => sparkline(m[2])]
+        ], metrics);
+        
+        renderTable('synapse-perf-caches', [
+            ['Cache', x => x.undersized ? `${x.name} (undersized)` : x.name],
+            ['Lookups', x => x.requests],
+            ['Hit Ratio', x => x.hit_ratio === null ? '-' : formatPercent(x.hit_ratio)],
+            ['Size', x => x.max_size ? `${x.size} / ${x.max_size}` : (x.size ?? '-')],
+            ['Evictions', x => x.evictions]
+        ], data.caches.slice(0, 20), 'No cache metrics yet');
+        
+        renderTable('synapse-perf-transactions', [
+            ['Transaction', t => t.slow ? `${t.desc} (slow)` : t.desc],
+            ['Count', t => t.count],
+            ['Mean', t => formatSeconds(t.mean_seconds)],
+            ['Total Time', t => formatSeconds(t.total_seconds)]
+        ], data.transactions, 'No transaction metrics yet');
+    } catch (error) {
+        status.textContent = `Error: ${error.message}`;
+    }
+}
+
+// Start a media store scan
+async function startMediaScan() {
+    const summary = document.getElementById('media-summary');
+    try {
+        const data = await apiCall('/admin/api/media/scan', 'POST');
+        if (data && data.success) {
+            summary.textContent = 'Scanning media store...';
+            setTimeout(loadMediaUsage, 5000);
+        } else {
+            summary.textContent = data.error || 'Failed to start scan';
+        }
+    } catch (error) {
+        summary.textContent = `Error: ${error.message}`;
+    }
+}
+
 // Show schedule form
 function showScheduleForm() {
     document.getElementById('schedule-form').style.display = 'block';
@@ -298,6 +853,16 @@ async function loadSchedules() {
     }
 }
 
+// Show a setting's toggle and status, marking values that are only staged
+function setSettingToggle(name, value, staged) {
+    const checkbox = document.getElementById(`enable-${name}`);
+    const status = document.getElementById(`${name}-status`);
+    if (!checkbox || !status) return;
+    checkbox.checked = value;
+    status.textContent = (value ? 'Enabled' : 'Disabled') + (staged ? ' (pending)' : '');
+    status.className = `status-text ${value ? 'status-enabled' : 'status-disabled'}`;
+}
+
 // Load server configuration settings
 async function loadServerSettings() {
     try {
@@ -305,24 +870,13 @@ async function loadServerSettings() {
         
         if (data && data.success) {
             const settings = data.settings;
+            const pending = data.pending || {};
             
-            // Update registration toggle
-            const registrationCheckbox = document.getElementById('enable-registration');
-            const registrationStatus = document.getElementById('registration-status');
-            if (registrationCheckbox && registrationStatus) {
-                registrationCheckbox.checked = settings.enable_registration;
-                registrationStatus.textContent = settings.enable_registration ? 'Enabled' : 'Disabled';
-                registrationStatus.className = `status-text ${settings.enable_registration ? 'status-enabled' : 'status-disabled'}`;
-            }
-            
-            // Update federation toggle
-            const federationCheckbox = document.getElementById('enable-federation');
-            const federationStatus = document.getElementById('federation-status');
-            if (federationCheckbox && federationStatus) {
-                federationCheckbox.checked = settings.enable_federation;
-                federationStatus.textContent = settings.enable_federation ? 'Enabled' : 'Disabled';
-                federationStatus.className = `status-text ${settings.enable_federation ? 'status-enabled' : 'status-disabled'}`;
-            }
+            ['registration', 'federation'].forEach(name => {
+                const key = `enable_${name}`;
+                const staged = key in pending;
+                setSettingToggle(name, staged ? pending[key] : settings[key], staged);
+            });
         }
     } catch (error) {
         console.error('Error loading server settings:', error);
@@ -331,72 +885,56 @@ async function loadServerSettings() {
         if (registrationStatus) registrationStatus.textContent = 'Error loading';
         if (federationStatus) federationStatus.textContent = 'Error loading';
     }
+    
+    loadPendingChanges();
+    loadConfigApplyHistory();
 }
 
-// Update server settings
-async function updateServerSettings(settingType, value) {
-    const outputDiv = document.getElementById('config-output');
-    
+// Show staged changes as a diff against .env and homeserver.yaml
+function renderPendingChanges(data) {
+    const box = document.getElementById('pending-changes');
+    const rows = [
+        ...data.env.map(c => ({...c, file: '.env'})),
+        ...data.homeserver.map(c => ({...c, file: 'homeserver.yaml'}))
+    ];
+    box.style.display = rows.length ? 'block' : 'none';
+    renderTable('pending-changes-table', [
+        ['File', c => c.file],
+        ['Key', c => c.key],
+        ['Current', c => JSON.stringify(c.current)],
+        ['New', c => JSON.stringify(c.new)]
+    ], rows, 'No pending changes');
+    document.getElementById('pending-changes-restart').textContent = data.restart_required
+        ? 'Applying will restart Synapse once.'
+        : 'Applying only updates .env; Synapse does not need a restart.';
+}
+
+async function loadPendingChanges() {
     try {
-        let body = {};
-        if (settingType === 'registration') {
-            body.enable_registration = value;
-        } else if (settingType === 'federation') {
-            body.enable_federation = value;
+        const data = await apiCall('/admin/api/config/pending');
+        if (data && data.success) {
+            renderPendingChanges(data);
+        } else if (data) {
+            showOutput('config-output', data.error || 'Failed to load pending changes', 'error');
         }
-        
-        showOutput('config-output', 'Updating settings and restarting Synapse...', 'info');
+    } catch (error) {
+        console.error('Error loading pending changes:', error);
+    }
+}
+
+// Stage a server setting; nothing is restarted until the changes are applied
+async function updateServerSettings(settingType, value) {
+    try {
+        const body = {};
+        body[`enable_${settingType}`] = value;
         
         const data = await apiCall('/admin/api/config/server-settings', 'POST', body);
         
         if (data && data.success) {
-            showOutput('config-output', data.message || 'Settings updated successfully! Waiting for Synapse to restart...', 'success');
-            
-            // Update status text
-            if (settingType === 'registration') {
-                const statusText = document.getElementById('registration-status');
-                statusText.textContent = value ? 'Enabled' : 'Disabled';
-                statusText.className = `status-text ${value ? 'status-enabled' : 'status-disabled'}`;
-            } else if (settingType === 'federation') {
-                const statusText = document.getElementById('federation-status');
-                statusText.textContent = value ? 'Enabled' : 'Disabled';
-                statusText.className = `status-text ${value ? 'status-enabled' : 'status-disabled'}`;
-            }
-            
-            // Poll for Synapse to be back up (check service status)
-            // Check every 3 seconds, up to 20 attempts (60 seconds total)
-            let attempts = 0;
-            const maxAttempts = 20;
-            const checkInterval = setInterval(async () => {
-                attempts++;
-                try {
-                    const statusData = await apiCall('/admin/api/status');
-                    if (statusData && statusData.services) {
-                        const synapseService = statusData.services.find(s => s.name === 'synapse');
-                        if (synapseService && synapseService.state === 'running') {
-                            clearInterval(checkInterval);
-                            showOutput('config-output', 'Settings applied successfully! Synapse is running.', 'success');
-                            setTimeout(() => {
-                                loadServerSettings();
-                                hideOutput('config-output');
-                            }, 3000);
-                        }
-                    }
-                } catch (error) {
-                    // Ignore errors during polling
-                }
-                
-                if (attempts >= maxAttempts) {
-                    clearInterval(checkInterval);
-                    showOutput('config-output', 'Settings updated, but Synapse restart is taking longer than expected. Please check service status.', 'success');
-                    setTimeout(() => {
-                        loadServerSettings();
-                        hideOutput('config-output');
-                    }, 3000);
-                }
-            }, 3000); // Check every 3 seconds
+            hideOutput('config-output');
+            loadServerSettings();
         } else {
-            const errorMsg = data ? (data.error || data.warning || 'Unknown error') : 'Failed to update settings';
+            const errorMsg = data ? (data.error || 'Unknown error') : 'Failed to stage setting';
             showOutput('config-output', errorMsg, 'error');
             // Revert checkbox
             loadServerSettings();
@@ -408,13 +946,97 @@ async function updateServerSettings(settingType, value) {
     }
 }
 
+// Apply all staged changes and wait for the result
+async function applyConfigChanges() {
+    try {
+        const data = await apiCall('/admin/api/config/apply', 'POST');
+        
+        if (!data || !data.success) {
+            showOutput('config-output', data ? (data.error || 'Unknown error') : 'Failed to apply changes', 'error');
+            return;
+        }
+        showOutput('config-output', `${data.message}...`, 'info');
+        
+        // Poll until the apply job has finished, then show its outcome
+        const checkInterval = setInterval(async () => {
+            try {
+                const history = await apiCall('/admin/api/config/apply/history');
+                if (!history || history.running) return;
+                clearInterval(checkInterval);
+                
+                const last = history.history[0];
+                if (last && last.success) {
+                    const downtime = last.restarted
+                        ? ` Synapse was unavailable for ${last.unavailable_seconds}s.`
+                        : '';
+                    showOutput('config-output', `Changes applied.${downtime}`, 'success');
+                } else {
+                    showOutput('config-output', last ? last.error : 'Applying changes failed', 'error');
+                }
+                loadServerSettings();
+            } catch (error) {
+                // Ignore errors during polling
+            }
+        }, 2000);
+    } catch (error) {
+        showOutput('config-output', `Error: ${error.message}`, 'error');
+    }
+}
+
+async function discardConfigChanges() {
+    try {
+        const data = await apiCall('/admin/api/config/pending', 'DELETE');
+        if (data && data.success) {
+            hideOutput('config-output');
+        } else {
+            showOutput('config-output', data ? (data.error || 'Unknown error') : 'Failed to discard changes', 'error');
+        }
+    } catch (error) {
+        showOutput('config-output', `Error: ${error.message}`, 'error');
+    }
+    loadServerSettings();
+}
+
+async function loadConfigApplyHistory() {
+    try {
+        const data = await apiCall('/admin/api/config/apply/history');
+        if (data && data.success) {
+            renderTable('config-apply-history', [
+                ['Started', r => new Date(r.started).toLocaleString()],
+                ['Changes', r => (r.env || []).concat(r.homeserver || []).map(c => c.key).join(', ')],
+                ['Restarted', r => r.restarted ? 'Yes' : 'No'],
+                ['Unavailable', r => r.unavailable_seconds != null ? `${r.unavailable_seconds}s` : '-'],
+                ['Result', r => r.success ? 'OK' : `Failed: ${r.error}`]
+            ], data.history.slice(0, 10), 'No changes applied yet');
+        }
+    } catch (error) {
+        console.error('Error loading config apply history:', error);
+    }
+}
+
+// Read the user filters shared by the statistics table and bulk actions
+function getUserFilters() {
+    const filters = {};
+    const createdAfter = document.getElementById('user-filter-created-after').value;
+    const createdBefore = document.getElementById('user-filter-created-before').value;
+    const inactiveDays = document.getElementById('user-filter-inactive-days').value;
+    if (createdAfter) filters.created_after = createdAfter;
+    if (createdBefore) filters.created_before = createdBefore;
+    if (inactiveDays) filters.inactive_days = inactiveDays;
+    if (document.getElementById('user-filter-never-logged-in').checked) filters.never_logged_in = 'true';
+    return filters;
+}
+
 // Load user statistics
 async function loadUserStats() {
     try {
-        const data = await apiCall('/admin/api/users/statistics');
+        const params = new URLSearchParams(getUserFilters());
+        const data = await apiCall(`/admin/api/users/statistics?${params.toString()}`);
         
         if (data && data.success) {
             const stats = data.statistics;
+            document.getElementById('user-filter-summary').textContent =
+                Object.keys(stats.filters || {}).length ? `${stats.matching_users} of ${stats.total_users} users match.` : '';
             
             // Update summary statistics
             document.getElementById('total-users').textContent = stats.total_users || 0;
@@ -539,13 +1161,140 @@ function refreshUserStats() {
     loadUserStats();
 }
 
+// Apply the user filters; a new dry run is needed before a bulk action
+function applyUserFilters(event) {
+    event.preventDefault();
+    lastBulkDryRun = null;
+    document.getElementById('bulk-user-run').disabled = true;
+    hideOutput('bulk-user-output');
+    loadUserStats();
+}
+
+// The dry run a bulk action was confirmed against
+let lastBulkDryRun = null;
+let bulkJobWasActive = false;
+
+async function bulkUserDryRun() {
+    const action = document.getElementById('bulk-user-action').value;
+    const filters = getUserFilters();
+    lastBulkDryRun = null;
+    document.getElementById('bulk-user-run').disabled = true;
+    
+    try {
+        const data = await apiCall('/admin/api/users/bulk', 'POST', {action, filters, dry_run: true});
+        if (!data || !data.success) {
+            showOutput('bulk-user-output', data ? (data.error || 'Unknown error') : 'Dry run failed', 'error');
+            return;
+        }
+        const more = data.count > data.sample.length ? `\n...and ${data.count - data.sample.length} more` : '';
+        showOutput('bulk-user-output', `${data.count} users would be affected.\n${data.sample.join('\n')}${more}`, 'info');
+        if (data.count > 0) {
+            lastBulkDryRun = {action, filters, count: data.count};
+            document.getElementById('bulk-user-run').disabled = false;
+        }
+    } catch (error) {
+        showOutput('bulk-user-output', `Error: ${error.message}`, 'error');
+    }
+}
+
+async function runBulkUserAction() {
+    const run = lastBulkDryRun;
+    if (!run || run.action !== document.getElementById('bulk-user-action').value) {
+        showOutput('bulk-user-output', 'Run a dry run for this action first', 'error');
+        return;
+    }
+    if (!confirm(`Apply ${run.action.replace('_', ' ')} to ${run.count} users? This cannot be undone.`)) {
+        return;
+    }
+    
+    try {
+        const data = await apiCall('/admin/api/users/bulk', 'POST', {
+            action: run.action,
+            filters: run.filters,
+            dry_run: false,
+            expected_count: run.count
+        });
+        if (!data || !data.success) {
+            showOutput('bulk-user-output', data ? (data.error || 'Unknown error') : 'Failed to start', 'error');
+            return;
+        }
+        lastBulkDryRun = null;
+        document.getElementById('bulk-user-run').disabled = true;
+        showOutput('bulk-user-output', data.message, 'success');
+        setTimeout(loadBulkUserJob, 1000);
+    } catch (error) {
+        showOutput('bulk-user-output', `Error: ${error.message}`, 'error');
+    }
+}
+
+async function pauseBulkUserAction() {
+    const data = await apiCall('/admin/api/users/bulk/pause', 'POST');
+    if (data) showOutput('bulk-user-output', data.success ? data.message : data.error, data.success ? 'info' : 'error');
+    setTimeout(loadBulkUserJob, 1000);
+}
+
+async function resumeBulkUserAction() {
+    const data = await apiCall('/admin/api/users/bulk/resume', 'POST');
+    if (data) showOutput('bulk-user-output', data.success ? data.message : data.error, data.success ? 'info' : 'error');
+    setTimeout(loadBulkUserJob, 1000);
+}
+
+// Show progress of the current or last bulk action, polling while it runs
+async function loadBulkUserJob() {
+    const status = document.getElementById('bulk-user-status');
+    try {
+        const data = await apiCall('/admin/api/users/bulk');
+        if (!data || !data.success) {
+            status.textContent = data && data.error ? data.error : 'Failed to load bulk action status';
+            return;
+        }
+        const job = data.job;
+        document.getElementById('bulk-user-pause').style.display = job && job.state === 'running' ? '' : 'none';
+        document.getElementById('bulk-user-resume').style.display =
+            job && (job.state === 'paused' || job.state === 'interrupted') ? '' : 'none';
+        if (!job) {
+            status.textContent = '';
+            return;
+        }
+        
+        const errors = job.errors.map(e => `${e.user}: ${e.error}`).join('\n');
+        status.textContent = `Last bulk action: ${job.action.replace('_', ' ')}, ${job.state}. ` +
+            `${job.done} done, ${job.failed} failed, ${job.remaining} remaining of ${job.total}.` +
+            (errors ? `\nRecent failures:\n${errors}` : '');
+        status.style.whiteSpace = 'pre-line';
+        
+        const active = job.state === 'running' || job.state === 'pending';
+        if (active) {
+            setTimeout(loadBulkUserJob, 3000);
+        } else if (bulkJobWasActive) {
+            // Refresh the table now that the users have changed
+            loadUserStats();
+        }
+        bulkJobWasActive = active;
+    } catch (error) {
+        status.textContent = `Error: ${error.message}`;
+    }
+}
+
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', () => {
     refreshStatus();
     loadSchedules();
     loadServerSettings();
     loadUserStats();
+    loadBulkUserJob();
+    loadMaintenanceHistory();
+    loadBackupHistory();
+    loadDbAnalysis();
+    loadMediaUsage();
+    loadMediaCacheStats();
+    loadTraffic();
+    loadResources();
+    loadSynapsePerformance();
     
     // Auto-refresh status every 30 seconds
     setInterval(refreshStatus, 30000);
+    setInterval(loadResources, 30000);
+    setInterval(loadSynapsePerformance, 30000);
+    setInterval(loadTraffic, 60000);
 });
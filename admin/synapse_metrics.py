@@ -0,0 +1,358 @@
+"""
+Synapse performance from its Prometheus metrics endpoint.
+
+Each scrape is parsed line by line as it is read, keeping only the metric
+families used here, folded into a small snapshot: cache counters, /sync
+and reactor tick histograms, database transaction timings and event
+persistence. Rates and percentiles come from the difference between
+snapshots and are kept in a fixed-size ring buffer. Caches that are full
+but still missing, and database transactions that are slow on average,
+are flagged.
+"""
+
+import logging
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+
+from resource_monitor import RingBuffer
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FIELDS = (
+    'sync_p50',
+    'sync_p95',
+    'sync_rate',
+    'reactor_tick_mean',
+    'reactor_tick_p95',
+    'db_txn_rate',
+    'db_txn_mean',
+    'events_persisted_rate',
+    'event_processing_lag',
+    'cache_hit_ratio',
+)
+
+HISTORY_SECONDS = 24 * 3600
+# Caches and transactions are judged over this window rather than one scrape
+ANALYSIS_WINDOW_SECONDS = 900
+# Ignore caches with fewer lookups than this in the window
+MIN_CACHE_REQUESTS = 100
+TOP_TRANSACTIONS = 20
+
+SYNC_SERVLET = 'SyncRestServlet'
+
+# Metric families read from a scrape; everything else is skipped before its
+# labels are parsed
+FAMILIES = (
+    'synapse_util_caches_cache_',
+    'synapse_http_server_response_time_seconds',
+    'python_twisted_reactor_tick_time',
+    'synapse_storage_transaction_time',
+    'synapse_storage_events_persisted_events',
+    'synapse_event_processing_lag',
+)
+
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)')
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_metrics(lines, families=FAMILIES):
+    """Yield (name, labels, value) for samples of the wanted families.
+
+    Works on any iterable of text or byte lines, so a response can be
+    parsed while it is still being read. A trailing _total is dropped from
+    counter names so old and new client library naming look the same.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line or line[0] == '#' or not line.startswith(families):
+            continue
+        match = SAMPLE_RE.match(line)
+        if not match:
+            continue
+        name, raw_labels, raw_value = match.groups()
+        try:
+            value = float(raw_value)
+        except ValueError:
+            continue
+        if name.endswith('_total'):
+            name = name[:-len('_total')]
+        labels = {
+            key: raw.replace('\\"', '"').replace('\\n', '\n').replace('\\\\', '\\')
+            for key, raw in LABEL_RE.findall(raw_labels or '')
+        }
+        yield name, labels, value
+
+
+def new_histogram():
+    return {'buckets': {}, 'sum': 0.0, 'count': 0.0}
+
+
+def add_to_histogram(histogram, name, family, labels, value):
+    suffix = name[len(family):]
+    if suffix == '_bucket':
+        le = float(labels.get('le', 'inf'))
+        histogram['buckets'][le] = histogram['buckets'].get(le, 0.0) + value
+    elif suffix == '_sum':
+        histogram['sum'] += value
+    elif suffix == '_count':
+        histogram['count'] += value
+
+
+def collect_snapshot(lines, now):
+    """Fold one scrape into the counters this module uses."""
+    snapshot = {
+        'time': now,
+        'caches': {},
+        'sync': new_histogram(),
+        'reactor': new_histogram(),
+        'transactions': {},
+        'events_persisted': 0.0,
+        'event_processing_lag': 0.0,
+    }
+    for name, labels, value in parse_metrics(lines):
+        if name.startswith('synapse_util_caches_cache_'):
+            field = name[len('synapse_util_caches_cache_'):]
+            if field == 'evicted_size' and labels.get('reason') != 'size':
+                continue
+            if field in ('hits', 'misses', 'size', 'max_size', 'evicted_size'):
+                cache = snapshot['caches'].setdefault(labels.get('name', ''), {})
+                cache[field] = cache.get(field, 0.0) + value
+        elif name.startswith('synapse_http_server_response_time_seconds'):
+            if labels.get('servlet') == SYNC_SERVLET:
+                add_to_histogram(snapshot['sync'], name, 'synapse_http_server_response_time_seconds', labels, value)
+        elif name.startswith('python_twisted_reactor_tick_time'):
+            add_to_histogram(snapshot['reactor'], name, 'python_twisted_reactor_tick_time', labels, value)
+        elif name in ('synapse_storage_transaction_time_sum', 'synapse_storage_transaction_time_count'):
+            totals = snapshot['transactions'].setdefault(labels.get('desc', ''), [0.0, 0.0])
+            totals[0 if name.endswith('_sum') else 1] += value
+        elif name == 'synapse_storage_events_persisted_events':
+            snapshot['events_persisted'] += value
+        elif name == 'synapse_event_processing_lag':
+            # Milliseconds behind the newest event, per background processor
+            snapshot['event_processing_lag'] = max(snapshot['event_processing_lag'], value / 1000)
+    return snapshot
+
+
+def histogram_quantile(buckets, q):
+    """Estimate a quantile from cumulative {upper bound: count} buckets."""
+    bounds = sorted(buckets)
+    if not bounds or not buckets[bounds[-1]]:
+        return None
+    rank = q * buckets[bounds[-1]]
+    lower = 0.0
+    previous_count = 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float('inf'):
+                return lower
+            if count == previous_count:
+                return bound
+            return lower + (bound - lower) * (rank - previous_count) / (count - previous_count)
+        lower, previous_count = bound, count
+    return lower
+
+
+def histogram_delta(current, previous):
+    return {
+        'buckets': {
+            le: count - previous['buckets'].get(le, 0.0)
+            for le, count in current['buckets'].items()
+        },
+        'sum': current['sum'] - previous['sum'],
+        'count': current['count'] - previous['count'],
+    }
+
+
+def counters_reset(current, previous):
+    """True if Synapse restarted between the two snapshots."""
+    return (
+        current['sync']['count'] < previous['sync']['count']
+        or current['reactor']['count'] < previous['reactor']['count']
+        or current['events_persisted'] < previous['events_persisted']
+    )
+
+
+def derive_rates(current, previous):
+    """History values for the interval between two snapshots."""
+    elapsed = current['time'] - previous['time']
+    sync = histogram_delta(current['sync'], previous['sync'])
+    reactor = histogram_delta(current['reactor'], previous['reactor'])
+
+    txn_time = txn_count = 0.0
+    for desc, (total, count) in current['transactions'].items():
+        before = previous['transactions'].get(desc, (0.0, 0.0))
+        txn_time += total - before[0]
+        txn_count += count - before[1]
+
+    hits = misses = 0.0
+    for name, cache in current['caches'].items():
+        before = previous['caches'].get(name, {})
+        hits += cache.get('hits', 0.0) - before.get('hits', 0.0)
+        misses += cache.get('misses', 0.0) - before.get('misses', 0.0)
+
+    return {
+        'sync_p50': histogram_quantile(sync['buckets'], 0.5) or 0.0,
+        'sync_p95': histogram_quantile(sync['buckets'], 0.95) or 0.0,
+        'sync_rate': sync['count'] / elapsed,
+        'reactor_tick_mean': reactor['sum'] / reactor['count'] if reactor['count'] else 0.0,
+        'reactor_tick_p95': histogram_quantile(reactor['buckets'], 0.95) or 0.0,
+        'db_txn_rate': txn_count / elapsed,
+        'db_txn_mean': txn_time / txn_count if txn_count else 0.0,
+        'events_persisted_rate': (current['events_persisted'] - previous['events_persisted']) / elapsed,
+        'event_processing_lag': current['event_processing_lag'],
+        # No lookups means nothing was missed
+        'cache_hit_ratio': hits / (hits + misses) if hits + misses else 1.0,
+    }
+
+
+def analyze_caches(current, baseline, hit_ratio_threshold, full_ratio=0.95):
+    """Per-cache hit ratio over the window and whether the cache looks too small.
+
+    A cache is undersized when it is (nearly) full, still evicting entries
+    to make room, and missing often enough to matter.
+    """
+    caches = []
+    for name, cache in current['caches'].items():
+        before = baseline['caches'].get(name, {}) if baseline else {}
+        hits = cache.get('hits', 0.0) - before.get('hits', 0.0)
+        misses = cache.get('misses', 0.0) - before.get('misses', 0.0)
+        evicted = cache.get('evicted_size', 0.0) - before.get('evicted_size', 0.0)
+        requests = hits + misses
+        hit_ratio = hits / requests if requests else None
+        size, max_size = cache.get('size'), cache.get('max_size')
+        full = bool(max_size) and size is not None and size >= full_ratio * max_size
+        undersized = (
+            full and requests >= MIN_CACHE_REQUESTS
+            and hit_ratio is not None and hit_ratio < hit_ratio_threshold
+            and (evicted > 0 or 'evicted_size' not in cache)
+        )
+        caches.append({
+            'name': name,
+            'requests': int(requests),
+            'hit_ratio': round(hit_ratio, 4) if hit_ratio is not None else None,
+            'size': int(size) if size is not None else None,
+            'max_size': int(max_size) if max_size else None,
+            'evictions': int(evicted),
+            'undersized': undersized,
+        })
+    caches.sort(key=lambda c: c['requests'], reverse=True)
+    return caches
+
+
+def analyze_transactions(current, baseline, slow_seconds):
+    """Database transactions by total time spent over the window."""
+    transactions = []
+    for desc, (total, count) in current['transactions'].items():
+        before = baseline['transactions'].get(desc, (0.0, 0.0)) if baseline else (0.0, 0.0)
+        window_time, window_count = total - before[0], count - before[1]
+        if window_count <= 0:
+            continue
+        mean = window_time / window_count
+        transactions.append({
+            'desc': desc,
+            'count': int(window_count),
+            'total_seconds': round(window_time, 3),
+            'mean_seconds': round(mean, 4),
+            'slow': mean >= slow_seconds,
+        })
+    transactions.sort(key=lambda t: t['total_seconds'], reverse=True)
+    return transactions[:TOP_TRANSACTIONS]
+
+
+class SynapseMetrics:
+    """Scrapes a Synapse metrics listener and keeps a rolling history."""
+
+    def __init__(self, url, interval=30, cache_hit_ratio_threshold=0.8,
+                 slow_transaction_seconds=0.5, fetch=None):
+        self.url = url
+        self.interval = interval
+        self.cache_hit_ratio_threshold = cache_hit_ratio_threshold
+        self.slow_transaction_seconds = slow_transaction_seconds
+        self.fetch = fetch or self._fetch
+        self.history = RingBuffer(HISTORY_SECONDS // max(1, interval), fields=HISTORY_FIELDS)
+        self.snapshots = deque(maxlen=ANALYSIS_WINDOW_SECONDS // max(1, interval) + 1)
+        self.last_error = None
+        self.last_scrape = None
+        self._lock = threading.Lock()
+
+    def _fetch(self, handle):
+        """Stream the metrics page into handle(lines)."""
+        with urllib.request.urlopen(self.url, timeout=10) as resp:
+            return handle(resp)
+
+    def scrape(self, now=None):
+        """Take one snapshot and record the interval since the previous one."""
+        now = now or time.time()
+        try:
+            snapshot = self.fetch(lambda lines: collect_snapshot(lines, now))
+        except (urllib.error.URLError, OSError) as e:
+            with self._lock:
+                self.last_error = f"Could not reach {self.url}: {e}"
+            return False
+
+        with self._lock:
+            self.last_error = None
+            self.last_scrape = now
+            previous = self.snapshots[-1] if self.snapshots else None
+            if previous and counters_reset(snapshot, previous):
+                # Synapse restarted: counters start again from zero
+                self.snapshots.clear()
+            elif previous and now > previous['time']:
+                values = derive_rates(snapshot, previous)
+                self.history.append(now, [values[field] for field in HISTORY_FIELDS])
+            self.snapshots.append(snapshot)
+        return True
+
+    def report(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            current = self.snapshots[-1] if self.snapshots else None
+            baseline = self.snapshots[0] if len(self.snapshots) > 1 else None
+            latest = self.history.latest()
+            history = {
+                '1h': self.history.downsample(now - 3600, now, 60),
+                '24h': self.history.downsample(now - HISTORY_SECONDS, now, 288),
+            }
+            last_error, last_scrape = self.last_error, self.last_scrape
+
+        caches = analyze_caches(current, baseline, self.cache_hit_ratio_threshold) if current else []
+        transactions = (
+            analyze_transactions(current, baseline, self.slow_transaction_seconds) if current else []
+        )
+        alerts = [
+            {'type': 'undersized_cache', 'name': c['name'],
+             'message': f"Cache {c['name']} is full and only hits {c['hit_ratio']:.0%} of lookups"}
+            for c in caches if c['undersized']
+        ] + [
+            {'type': 'slow_transaction', 'name': t['desc'],
+             'message': f"Database transaction {t['desc']} takes {t['mean_seconds']}s on average"}
+            for t in transactions if t['slow']
+        ]
+
+        current_values = None
+        if latest:
+            ts, values = latest
+            current_values = {'timestamp': ts}
+            current_values.update({
+                field: round(value, 4) for field, value in zip(HISTORY_FIELDS, values)
+            })
+        return {
+            'last_scrape': last_scrape,
+            'error': last_error,
+            'window_seconds': round(now - baseline['time']) if baseline else 0,
+            'current': current_values,
+            'caches': caches,
+            'transactions': transactions,
+            'alerts': alerts,
+            'history': history,
+            'thresholds': {
+                'cache_hit_ratio': self.cache_hit_ratio_threshold,
+                'slow_transaction_seconds': self.slow_transaction_seconds,
+            },
+        }
@@ -1,10 +1,13 @@
-"""Tests for admin console login and user statistics."""
+"""Tests for admin console login, user statistics, maintenance and configuration."""
 
 import json
+import subprocess
 import sys
 import os
+import time
+import urllib.error
 from datetime import datetime
-from unittest.mock import patch, MagicMock
+from unittest.mock import call, patch, MagicMock
 
 import pytest
 
@@ -18,7 +21,9 @@ os.environ.setdefault('ADMIN_CONSOLE_USERNAME', 'admin')
 os.environ.setdefault('ADMIN_CONSOLE_PASSWORD', 'testpass')
 os.environ.setdefault('ADMIN_CONSOLE_SECRET_KEY', 'test-secret')
 
+import app as app_module
 from app import app, SYNAPSE_TIMESTAMP_MULTIPLIER
+from nginx_logs import LogTailer
 
 
 @pytest.fixture
@@ -28,6 +33,24 @@ def client():
         yield client
 
 
+@pytest.fixture
+def logged_in_client(client):
+    with client.session_transaction() as sess:
+        sess['logged_in'] = True
+    yield client
+
+
+def make_db_connection(fetchall_results, rowcount=0, fetchone_result=None):
+    """Build a mock psycopg2 connection whose cursor returns canned rows."""
+    cursor = MagicMock()
+    cursor.fetchall.side_effect = list(fetchall_results)
+    cursor.fetchone.return_value = fetchone_result
+    cursor.rowcount = rowcount
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return conn
+
+
 class TestLogin:
     """Tests for the login endpoint."""
 
@@ -103,3 +126,676 @@ class TestCreationTimestamp:
         last_seen_ms = 1708000000000  # ~2024-02-15 in milliseconds
         result = datetime.fromtimestamp(last_seen_ms / SYNAPSE_TIMESTAMP_MULTIPLIER).strftime('%Y-%m-%d %H:%M:%S')
         assert result.startswith('2024-02-1')
+
+
+class TestUserFilters:
+    """Tests for the user filters shared by statistics and bulk actions."""
+
+    NOW = datetime(2024, 3, 1, 12, 0, 0)
+    # (name, creation_ts in seconds, admin, deactivated, last_login in ms)
+    USERS = [
+        ('@admin:example.com', int(datetime(2024, 1, 1).timestamp()), 1, 0, None),
+        ('@spam1:example.com', int(datetime(2024, 2, 20).timestamp()), 0, 0, None),
+        ('@spam2:example.com', int(datetime(2024, 2, 21, 23, 0).timestamp()), 0, 1, None),
+        ('@alice:example.com', int(datetime(2024, 1, 5).timestamp()), 0, 0,
+         int(datetime(2024, 2, 29).timestamp() * SYNAPSE_TIMESTAMP_MULTIPLIER)),
+        ('@bob:example.com', int(datetime(2023, 6, 1).timestamp()), 0, 0,
+         int(datetime(2023, 12, 1).timestamp() * SYNAPSE_TIMESTAMP_MULTIPLIER)),
+    ]
+
+    def matching(self, filters):
+        return [
+            user[0] for user in self.USERS
+            if app_module.user_matches_filters(user[1], user[4], filters, self.NOW)
+        ]
+
+    def test_parse_rejects_invalid_values(self):
+        assert app_module.parse_user_filters({'never_logged_in': 'true', 'inactive_days': '30'}) == \
+            {'never_logged_in': True, 'inactive_days': 30}
+        for params in ({'created_after': '01/02/2024'}, {'inactive_days': 'soon'}, {'inactive_days': '0'}):
+            with pytest.raises(ValueError):
+                app_module.parse_user_filters(params)
+
+    def test_filters(self):
+        assert self.matching({'never_logged_in': True}) == \
+            ['@admin:example.com', '@spam1:example.com', '@spam2:example.com']
+        # created_before includes the whole day
+        assert self.matching({'created_after': '2024-02-20', 'created_before': '2024-02-21'}) == \
+            ['@spam1:example.com', '@spam2:example.com']
+        assert self.matching({'inactive_days': 30}) == \
+            ['@admin:example.com', '@spam1:example.com', '@spam2:example.com', '@bob:example.com']
+
+    def test_bulk_selection_skips_admins_and_deactivated(self):
+        conn = make_db_connection([[u[:4] for u in self.USERS], [(u[0], u[4]) for u in self.USERS if u[4]]])
+        with patch.object(app_module, 'get_db_connection', return_value=conn):
+            assert app_module.select_bulk_users('deactivate', {'never_logged_in': True}) == ['@spam1:example.com']
+        conn = make_db_connection([[u[:4] for u in self.USERS], []])
+        with patch.object(app_module, 'get_db_connection', return_value=conn):
+            assert app_module.select_bulk_users('purge_media', {'created_after': '2024-02-01'}) == \
+                ['@spam1:example.com', '@spam2:example.com']
+
+    def test_statistics_endpoint_rejects_bad_filter(self, logged_in_client):
+        resp = logged_in_client.get('/api/users/statistics?inactive_days=-3')
+        assert resp.status_code == 400
+
+
+class TestBulkUserActions:
+    """Tests for the bulk user action endpoints."""
+
+    @pytest.fixture
+    def job(self, tmp_path):
+        job = app_module.BulkUserJob(tmp_path / 'bulk_user_job.json', rate=0)
+        with patch.object(app_module, 'bulk_user_job', job), \
+                patch.object(app_module, 'select_bulk_users', return_value=['@a:x', '@b:x', '@c:x']):
+            yield job
+
+    def test_dry_run_counts_without_starting(self, logged_in_client, job):
+        with patch.object(app_module, 'start_bulk_user_job') as start:
+            resp = logged_in_client.post('/api/users/bulk', json={
+                'action': 'deactivate', 'filters': {'never_logged_in': 'true'}
+            })
+        data = resp.get_json()
+        assert data['dry_run'] is True
+        assert data['count'] == 3
+        start.assert_not_called()
+        assert job.status() is None
+
+    def test_requires_filter_and_known_action(self, logged_in_client, job):
+        resp = logged_in_client.post('/api/users/bulk', json={'action': 'deactivate', 'filters': {}})
+        assert resp.status_code == 400
+        resp = logged_in_client.post('/api/users/bulk', json={'action': 'delete', 'filters': {'inactive_days': 5}})
+        assert resp.status_code == 400
+
+    def test_refuses_when_selection_changed_since_dry_run(self, logged_in_client, job):
+        resp = logged_in_client.post('/api/users/bulk', json={
+            'action': 'shadow_ban', 'filters': {'inactive_days': 90}, 'dry_run': False, 'expected_count': 2
+        })
+        assert resp.status_code == 409
+        assert resp.get_json()['count'] == 3
+
+    def test_starts_background_job(self, logged_in_client, job):
+        with patch.object(app_module, 'start_bulk_user_job') as start:
+            resp = logged_in_client.post('/api/users/bulk', json={
+                'action': 'shadow_ban', 'filters': {'inactive_days': 90}, 'dry_run': False, 'expected_count': 3
+            })
+        assert resp.get_json()['success'] is True
+        start.assert_called_once()
+
+        with patch.object(app_module, 'synapse_admin_request', return_value={}) as api:
+            app_module.run_bulk_user_job()
+        paths = sorted(call[0][1] for call in api.call_args_list)
+        assert paths[0] == '/_synapse/admin/v1/users/%40a%3Ax/shadow_ban'
+        status = logged_in_client.get('/api/users/bulk').get_json()['job']
+        assert (status['state'], status['done']) == ('completed', 3)
+
+    def test_purge_media_deletes_every_page(self):
+        pages = [{'total': app_module.PURGE_MEDIA_PAGE_SIZE}, {'total': 12}]
+        with patch.object(app_module, 'synapse_admin_request', side_effect=pages) as api:
+            app_module.perform_bulk_user_action('purge_media', '@spam:x')
+        assert api.call_count == 2
+        assert api.call_args[0][0] == 'DELETE'
+
+    def test_purge_media_pages_share_the_rate_limiter(self):
+        job = MagicMock()
+        pages = [{'total': app_module.PURGE_MEDIA_PAGE_SIZE}] * 2 + [{'total': 0}]
+        with patch.object(app_module, 'bulk_user_job', job), \
+                patch.object(app_module, 'synapse_admin_request', side_effect=pages):
+            app_module.perform_bulk_user_action('purge_media', '@spam:x')
+        # The job paces the first call; each later page waits its own turn
+        assert job.acquire.call_count == 2
+
+    def test_purge_media_stops_after_page_limit(self):
+        full = {'total': app_module.PURGE_MEDIA_PAGE_SIZE}
+        with patch.object(app_module, 'MAX_PURGE_MEDIA_PAGES', 3), \
+                patch.object(app_module, 'synapse_admin_request', return_value=full) as api:
+            with pytest.raises(RuntimeError, match='run the action again'):
+                app_module.perform_bulk_user_action('purge_media', '@spam:x')
+        assert api.call_count == 3
+
+
+class TestMaintenanceTasks:
+    """Tests for the database maintenance task types."""
+
+    def test_maintenance_task_types_are_schedulable(self):
+        """Every maintenance task type should produce a scheduled task function."""
+        for task_type in app_module.MAINTENANCE_TASKS:
+            assert callable(app_module.create_scheduled_task(task_type))
+
+    def test_unknown_task_type_is_rejected(self):
+        with pytest.raises(ValueError):
+            app_module.create_scheduled_task('drop_everything')
+
+    def test_prune_user_ips_reports_rows_and_bytes(self):
+        """Pruning should report deleted rows and the table size reduction."""
+        conn = make_db_connection(
+            [[('user_ips', 1000, 0, 8192000)], [('user_ips', 958, 42, 8000000)]],
+            rowcount=42
+        )
+        with patch.object(app_module, 'get_db_connection', return_value=conn):
+            result = app_module.prune_user_ips()
+        assert result['success'] is True
+        assert result['rows_reclaimed'] == 42
+        assert result['bytes_reclaimed'] == 192000
+        conn.commit.assert_called_once()
+
+    def test_purge_remote_media_uses_admin_api(self):
+        """Remote media purge should report files deleted and bytes measured beforehand."""
+        conn = make_db_connection([], fetchone_result=(5242880,))
+        with patch.object(app_module, 'get_db_connection', return_value=conn), \
+                patch.object(app_module, 'synapse_admin_request', return_value={'deleted': 12}) as api:
+            result = app_module.purge_remote_media()
+        assert result == {'success': True, 'rows_reclaimed': 12, 'bytes_reclaimed': 5242880}
+        method, path = api.call_args[0][:2]
+        assert method == 'POST'
+        assert path.startswith('/_synapse/admin/v1/purge_media_cache?before_ts=')
+
+    def test_run_maintenance_task_records_history(self, tmp_path):
+        """Results, including duration, should be appended to the history file."""
+        history_file = tmp_path / 'maintenance_history.json'
+        with patch.object(app_module, 'MAINTENANCE_HISTORY_FILE', history_file), \
+                patch.object(app_module, 'vacuum_largest_tables',
+                             return_value={'success': True, 'rows_reclaimed': 7, 'bytes_reclaimed': 0}):
+            result = app_module.run_maintenance_task('vacuum')
+        assert result['task'] == 'vacuum'
+        assert 'duration_seconds' in result
+        history = json.loads(history_file.read_text())
+        assert history[-1]['rows_reclaimed'] == 7
+
+    def test_run_maintenance_task_records_failures(self, tmp_path):
+        """A task that raises should be recorded as a failure, not crash the scheduler."""
+        history_file = tmp_path / 'maintenance_history.json'
+        with patch.object(app_module, 'MAINTENANCE_HISTORY_FILE', history_file), \
+                patch.object(app_module, 'list_rooms', side_effect=RuntimeError('SYNAPSE_ADMIN_TOKEN is not configured')), \
+                patch.object(app_module, 'get_db_connection', return_value=make_db_connection([[]])):
+            result = app_module.run_maintenance_task('purge_history')
+        assert result['success'] is False
+        assert 'SYNAPSE_ADMIN_TOKEN' in result['error']
+
+    def test_purge_still_active_at_deadline_is_a_failure(self, tmp_path):
+        def admin_api(method, path, body=None):
+            return {'purge_id': 'p1'} if method == 'POST' else {'status': 'active'}
+
+        with patch.object(app_module, 'MAINTENANCE_HISTORY_FILE', tmp_path / 'maintenance_history.json'), \
+                patch.object(app_module, 'PURGE_STATUS_TIMEOUT', 0), \
+                patch.object(app_module, 'list_rooms', return_value=['!room:x']), \
+                patch.object(app_module, 'synapse_admin_request', side_effect=admin_api), \
+                patch.object(app_module, 'get_db_connection', return_value=make_db_connection([[], [], []])):
+            result = app_module.run_maintenance_task('purge_history')
+        assert result['success'] is False
+        assert result['error'] == 'timed out waiting for purge'
+        assert (result['rooms_purged'], result['rooms_timed_out']) == (0, ['!room:x'])
+
+    def test_purge_history_continues_after_network_error(self, tmp_path):
+        def admin_api(method, path, body=None):
+            if '%21down' in path:
+                raise urllib.error.URLError(TimeoutError('timed out'))
+            return {'purge_id': 'p1'} if method == 'POST' else {'status': 'complete'}
+
+        with patch.object(app_module, 'MAINTENANCE_HISTORY_FILE', tmp_path / 'maintenance_history.json'), \
+                patch.object(app_module, 'list_rooms', return_value=['!down:x', '!up:x']), \
+                patch.object(app_module, 'synapse_admin_request', side_effect=admin_api), \
+                patch.object(app_module.time, 'sleep'), \
+                patch.object(app_module, 'get_db_connection', return_value=make_db_connection([[], []])):
+            result = app_module.run_maintenance_task('purge_history')
+        assert result['success'] is False
+        assert (result['rooms_purged'], result['rooms_failed']) == (1, ['!down:x'])
+
+    def test_vacuum_quotes_schema_qualified_names(self):
+        conn = make_db_connection([
+            [('public', 'events'), ('other schema', 'odd"name')],
+            [('events', 10, 5, 8192)],
+            [('events', 10, 0, 8192)],
+        ])
+        sql = sys.modules['psycopg2'].sql
+        sql.reset_mock()
+        with patch.object(app_module, 'get_db_connection', return_value=conn):
+            result = app_module.vacuum_largest_tables()
+        assert result['rows_reclaimed'] == 5
+        assert sql.Identifier.call_args_list == [call('public', 'events'), call('other schema', 'odd"name')]
+        sql.SQL.assert_called_with('VACUUM (ANALYZE) {}')
+        vacuum = sql.SQL.return_value.format.return_value
+        assert conn.cursor().execute.call_args_list.count(call(vacuum)) == 2
+
+    def test_run_maintenance_endpoint_starts_each_task_once(self, logged_in_client, tmp_path):
+        scheduler = MagicMock()
+        with patch.object(app_module, 'get_scheduler', return_value=scheduler):
+            assert logged_in_client.post('/api/maintenance/vacuum').status_code == 200
+            # The first request reserved the task before its job ran
+            assert logged_in_client.post('/api/maintenance/vacuum').status_code == 409
+        assert scheduler.add_job.call_count == 1
+        assert scheduler.add_job.call_args.kwargs['kwargs'] == {'reserved': True}
+
+        with patch.object(app_module, 'MAINTENANCE_HISTORY_FILE', tmp_path / 'maintenance_history.json'), \
+                patch.object(app_module, 'vacuum_largest_tables', return_value={'success': True}):
+            result = app_module.run_maintenance_task('vacuum', reserved=True)
+        assert result['success'] is True
+        assert 'vacuum' not in app_module.running_maintenance
+
+    def test_run_maintenance_endpoint_rejects_unknown_task(self, logged_in_client):
+        resp = logged_in_client.post('/api/maintenance/drop_everything')
+        assert resp.status_code == 400
+
+
+class TestBackups:
+    """Tests for backups, backup verification and restore tests."""
+
+    @pytest.fixture
+    def backup_env(self, tmp_path):
+        project = tmp_path / 'project'
+        (project / 'synapse_data').mkdir(parents=True)
+        (project / 'synapse_data' / 'homeserver.yaml').write_text('server_name: example.com\n')
+
+        def fake_dump(path):
+            with open(path, 'wb') as f:
+                f.write(b'PGDMP fake dump')
+
+        store = app_module.LocalBackupStore(tmp_path / 'backups')
+        with patch.object(app_module, 'PROJECT_DIR', project), \
+                patch.object(app_module, 'BACKUP_HISTORY_FILE', tmp_path / 'backup_history.json'), \
+                patch.object(app_module, 'RESTORE_TEST_DIR', str(tmp_path / 'scratch')), \
+                patch.object(app_module, 'get_backup_store', return_value=store), \
+                patch.object(app_module, 'dump_database', side_effect=fake_dump):
+            yield store
+
+    def test_backup_is_recorded_with_checksum(self, backup_env):
+        result = app_module.backup_to_s3()
+        assert result['success'] is True
+        history = app_module.load_backup_history()
+        assert history[-1]['type'] == 'backup'
+        assert history[-1]['files'] == 2
+        _, sha256 = backup_env.open(result['filename'])
+        assert sha256 == history[-1]['sha256']
+
+    def test_verify_latest_backup(self, backup_env):
+        app_module.backup_to_s3()
+        entry = app_module.check_backup()
+        assert entry['success'] is True
+        assert entry['sha256_ok'] is True
+        assert entry['type'] == 'verify'
+
+    def test_restore_test_records_recovery_time(self, backup_env, tmp_path):
+        app_module.backup_to_s3()
+        restored = []
+
+        def fake_restore(dump):
+            restored.append(dump.read())
+            assert (tmp_path / 'scratch' / 'synapse_data' / 'homeserver.yaml').exists()
+            return {'success': True, 'users': 3, 'events': 42, 'restore_seconds': 0.1}
+
+        with patch.object(app_module, 'restore_database_dump', side_effect=fake_restore):
+            entry = app_module.check_backup(restore=True)
+        assert entry['success'] is True
+        assert restored == [b'PGDMP fake dump']
+        assert entry['database']['events'] == 42
+        assert entry['recovery_seconds'] >= 0
+        # The scratch copy is removed afterwards
+        assert not (tmp_path / 'scratch').exists()
+
+    def test_failed_database_restore_fails_the_test(self, backup_env):
+        app_module.backup_to_s3()
+        with patch.object(app_module, 'restore_database_dump',
+                          return_value={'success': False, 'error': 'pg_restore failed: boom'}):
+            entry = app_module.check_backup(restore=True)
+        assert entry['success'] is False
+        assert entry['error'] == 'pg_restore failed: boom'
+
+    def test_no_backups(self, backup_env):
+        entry = app_module.check_backup()
+        assert entry['success'] is False
+        assert entry['error'] == 'No backups found'
+
+    def test_only_one_backup_check_at_a_time(self, logged_in_client):
+        scheduler = MagicMock()
+        with patch.object(app_module, 'get_scheduler', return_value=scheduler), \
+                patch.dict(app_module.backup_check_state, {'running': False}):
+            assert logged_in_client.post('/api/backup/verify', json={'restore': True}).status_code == 200
+            assert logged_in_client.post('/api/backup/verify', json={}).status_code == 409
+            # A scheduled run can't start alongside it either
+            assert app_module.check_backup(restore=True) is None
+        scheduler.add_job.assert_called_once()
+        assert scheduler.add_job.call_args.kwargs['kwargs']['reserved'] is True
+
+    def test_verify_endpoint_validates_name(self, logged_in_client):
+        resp = logged_in_client.post('/api/backup/verify', json={'filename': '../../etc/passwd'})
+        assert resp.status_code == 400
+
+    def test_restore_test_is_schedulable(self):
+        assert callable(app_module.create_scheduled_task('restore_test'))
+        assert callable(app_module.create_scheduled_task('verify_backup'))
+
+
+class TestDatabaseAnalysis:
+    """Tests for the cached database size and bloat analysis."""
+
+    def test_analyze_tables_computes_ratios_and_bloat(self):
+        conn = make_db_connection([
+            [('events', 800, 200, 1000, 90, 10, 30, 3000, 70, None)],
+            [('events', 819200, 409600)]
+        ])
+        tables = app_module.analyze_tables(conn.cursor())
+        assert tables[0]['dead_ratio'] == 0.1
+        assert tables[0]['seq_scan_ratio'] == 0.3
+        assert tables[0]['bloat_bytes'] == 409600
+        assert tables[0]['bloat_ratio'] == 0.5
+
+    def test_slow_statements_none_without_extension(self):
+        conn = make_db_connection([], fetchone_result=None)
+        assert app_module.analyze_slow_statements(conn.cursor(), conn) is None
+
+    def test_run_db_analysis_caches_connection_errors(self, tmp_path):
+        cache_file = tmp_path / 'db_analysis.json'
+        with patch.object(app_module, 'DB_ANALYSIS_FILE', cache_file), \
+                patch.object(app_module, 'get_db_connection', return_value=None):
+            app_module.run_db_analysis()
+        cached = json.loads(cache_file.read_text())
+        assert cached['error'] == 'Failed to connect to database'
+        assert 'generated' in cached
+
+    def test_start_db_analysis_schedules_only_once(self):
+        scheduler = MagicMock()
+        with patch.object(app_module, 'get_scheduler', return_value=scheduler), \
+                patch.dict(app_module.db_analysis_state, {'running': False}):
+            assert app_module.start_db_analysis() is True
+            # Still reserved until the scheduled run finishes
+            assert app_module.start_db_analysis() is False
+            assert app_module.run_db_analysis() is None
+        scheduler.add_job.assert_called_once()
+        assert scheduler.add_job.call_args.kwargs['kwargs'] == {'reserved': True}
+
+    def test_start_db_analysis_releases_reservation_when_scheduling_fails(self):
+        scheduler = MagicMock()
+        scheduler.add_job.side_effect = RuntimeError('scheduler stopped')
+        with patch.object(app_module, 'get_scheduler', return_value=scheduler), \
+                patch.dict(app_module.db_analysis_state, {'running': False}):
+            with pytest.raises(RuntimeError):
+                app_module.start_db_analysis()
+            assert app_module.db_analysis_state['running'] is False
+
+    def test_get_analysis_serves_fresh_cache_without_recomputing(self, logged_in_client, tmp_path):
+        cache_file = tmp_path / 'db_analysis.json'
+        cache_file.write_text(json.dumps({'database_bytes': 123, 'generated': datetime.now().isoformat()}))
+        with patch.object(app_module, 'DB_ANALYSIS_FILE', cache_file), \
+                patch.object(app_module, 'start_db_analysis') as start:
+            resp = logged_in_client.get('/api/db/analysis')
+        assert resp.get_json()['analysis']['database_bytes'] == 123
+        start.assert_not_called()
+
+    def test_get_analysis_refreshes_stale_cache(self, logged_in_client, tmp_path):
+        cache_file = tmp_path / 'db_analysis.json'
+        cache_file.write_text(json.dumps({'generated': '2020-01-01T00:00:00'}))
+        with patch.object(app_module, 'DB_ANALYSIS_FILE', cache_file), \
+                patch.object(app_module, 'start_db_analysis') as start:
+            resp = logged_in_client.get('/api/db/analysis')
+        assert resp.get_json()['running'] is True
+        start.assert_called_once()
+
+
+class TestLogSearch:
+    """Tests for the /api/logs/search endpoint."""
+
+    def test_search_rejects_invalid_level(self, logged_in_client):
+        resp = logged_in_client.get('/api/logs/search?level=loud')
+        assert resp.status_code == 400
+
+    def test_search_rejects_invalid_service(self, logged_in_client):
+        resp = logged_in_client.get('/api/logs/search?service=synapse;rm')
+        assert resp.status_code == 400
+
+    def test_search_uses_archive(self, logged_in_client, tmp_path):
+        archive = app_module.LogArchive(tmp_path / 'logs')
+        archive.append('synapse', 1708000000, 'synapse - ERROR - database is locked')
+        with patch.object(app_module, 'log_archive', archive):
+            resp = logged_in_client.get('/api/logs/search?q=locked&service=synapse&level=error&since=1707999000')
+        data = resp.get_json()
+        assert data['success'] is True
+        assert data['results'][0]['message'] == 'synapse - ERROR - database is locked'
+
+
+HOMESERVER_YAML = """server_name: "example.com"
+# Generated registration setting
+enable_registration: true
+enable_registration_without_verification: true
+allow_public_rooms_over_federation: false
+
+# Federation disabled - block all federation
+federation_domain_whitelist:
+  - example.com
+report_stats: false
+"""
+
+
+@pytest.fixture
+def config_files(tmp_path):
+    """Point the app at a temporary .env, homeserver.yaml and data files."""
+    env_file = tmp_path / '.env'
+    env_file.write_text('SERVER_NAME=example.com\nENABLE_REGISTRATION=true\nENABLE_FEDERATION=false\n')
+    homeserver = tmp_path / 'homeserver.yaml'
+    homeserver.write_text(HOMESERVER_YAML)
+    with patch.object(app_module, 'ENV_FILE', env_file), \
+            patch.object(app_module, 'HOMESERVER_YAML', homeserver), \
+            patch.object(app_module, 'PENDING_CHANGES_FILE', tmp_path / 'pending.json'), \
+            patch.object(app_module, 'CONFIG_APPLY_HISTORY_FILE', tmp_path / 'history.json'):
+        yield env_file, homeserver
+
+
+class TestStagedConfig:
+    """Tests for staging server settings and applying them with one restart."""
+
+    def test_set_yaml_keys_keeps_comments_and_other_keys(self):
+        text = app_module.set_yaml_top_level_keys(HOMESERVER_YAML, {
+            'federation_domain_whitelist': [],
+            'enable_registration': False,
+            'new_key': 1,
+        })
+        assert '# Generated registration setting' in text
+        assert '# Federation disabled - block all federation' in text
+        assert 'federation_domain_whitelist: []\nreport_stats: false\n' in text
+        assert 'enable_registration: false\n' in text
+        assert text.endswith('new_key: 1\n')
+
+    def test_staging_does_not_restart(self, logged_in_client, config_files):
+        with patch.object(app_module, 'run_command') as run:
+            resp = logged_in_client.post('/api/config/server-settings', json={'enable_federation': True})
+        run.assert_not_called()
+        data = resp.get_json()
+        assert data['pending'] == {'enable_federation': True}
+        assert data['env'] == [{'key': 'ENABLE_FEDERATION', 'current': 'false', 'new': 'true'}]
+        assert {c['key'] for c in data['homeserver']} == {
+            'federation_domain_whitelist', 'allow_public_rooms_over_federation'
+        }
+        assert data['restart_required'] is True
+
+    def test_staging_current_value_clears_pending(self, logged_in_client, config_files):
+        logged_in_client.post('/api/config/server-settings', json={'enable_registration': False})
+        resp = logged_in_client.post('/api/config/server-settings', json={'enable_registration': True})
+        assert resp.get_json()['pending'] == {}
+
+    def test_staging_rejects_non_boolean(self, logged_in_client, config_files):
+        resp = logged_in_client.post('/api/config/server-settings', json={'enable_registration': 'yes'})
+        assert resp.status_code == 400
+
+    def test_apply_writes_everything_with_one_restart(self, config_files):
+        env_file, homeserver = config_files
+        app_module.save_pending_changes({'enable_registration': False, 'enable_federation': True})
+        written = {}
+        commands = []
+
+        def fake_run(cmd, cwd=None, input=None):
+            commands.append(cmd)
+            if input is not None:
+                written['text'] = input
+            return {'success': True, 'stdout': '', 'stderr': '', 'returncode': 0}
+
+        with patch.object(app_module, 'run_command', side_effect=fake_run), \
+                patch.object(app_module, 'synapse_healthy', side_effect=[False, False, True]), \
+                patch.object(app_module, 'HEALTH_POLL_INTERVAL', 0):
+            record = app_module.apply_pending_changes()
+
+        assert record['success'] is True
+        assert commands.count('docker compose restart synapse') == 1
+        assert 'ENABLE_REGISTRATION=false' in env_file.read_text()
+        assert 'ENABLE_FEDERATION=true' in env_file.read_text()
+        assert 'enable_registration_without_verification: false' in written['text']
+        assert 'federation_domain_whitelist: []' in written['text']
+        assert record['recovered'] is True
+        assert record['unavailable_seconds'] >= 0
+        assert app_module.load_pending_changes() == {}
+        assert app_module.load_config_apply_history()[-1]['success'] is True
+
+    def test_failed_homeserver_write_restores_env(self, config_files):
+        env_file, homeserver = config_files
+        original_env = env_file.read_text()
+        app_module.save_pending_changes({'enable_registration': False, 'enable_federation': True})
+        failed = {'success': False, 'stdout': '', 'stderr': 'service "synapse" is not running', 'returncode': 1}
+
+        with patch.object(app_module, 'run_command', return_value=failed) as run:
+            record = app_module.apply_pending_changes()
+
+        assert record['success'] is False
+        assert 'is not running' in record['error']
+        assert '.env was restored' in record['error']
+        assert env_file.read_text() == original_env
+        assert run.call_count == 1
+        # Still staged, so it can be applied once Synapse is back
+        assert app_module.load_pending_changes() == {'enable_registration': False, 'enable_federation': True}
+
+    def test_env_update_rewrites_bind_mounted_file_in_place(self, config_files):
+        env_file, _ = config_files
+        env_file.chmod(0o600)
+        inode = env_file.stat().st_ino
+        # A single-file bind mount can't be renamed over
+        with patch.object(app_module.os, 'replace', side_effect=OSError(18, 'Invalid cross-device link')):
+            assert app_module.update_env_values({'ENABLE_REGISTRATION': 'false', 'NEW_KEY': 'x'}) is True
+        text = env_file.read_text()
+        assert 'ENABLE_REGISTRATION=false\n' in text and text.endswith('NEW_KEY=x\n')
+        assert env_file.stat().st_ino == inode
+        assert env_file.stat().st_mode & 0o777 == 0o600
+
+    def test_failed_env_write_restores_original(self, config_files):
+        env_file, _ = config_files
+        original = env_file.read_text()
+        with patch.object(app_module.os, 'fsync', side_effect=[OSError('I/O error'), None]):
+            assert app_module.update_env_values({'ENABLE_REGISTRATION': 'false'}) is False
+        assert env_file.read_text() == original
+
+    def test_apply_env_only_change_skips_restart(self, config_files):
+        env_file, homeserver = config_files
+        env_file.write_text('ENABLE_REGISTRATION=false\n')
+        app_module.save_pending_changes({'enable_registration': True})
+        with patch.object(app_module, 'run_command') as run:
+            record = app_module.apply_pending_changes()
+        run.assert_not_called()
+        assert record['success'] is True
+        assert record['restarted'] is False
+        assert 'ENABLE_REGISTRATION=true' in env_file.read_text()
+
+    def test_downtime_measured_from_first_failed_health_check(self):
+        with patch.object(app_module, 'synapse_healthy', side_effect=[True, False, False, True]), \
+                patch.object(app_module, 'HEALTH_POLL_INTERVAL', 0.05):
+            result, measurement = app_module.measure_synapse_downtime(
+                lambda: time.sleep(0.1) or 'done'
+            )
+        assert result == 'done'
+        assert measurement['recovered'] is True
+        assert 0.05 <= measurement['unavailable_seconds'] < 1
+
+    def test_apply_endpoint_rejects_nothing_pending(self, logged_in_client, config_files):
+        resp = logged_in_client.post('/api/config/apply')
+        assert resp.status_code == 400
+
+
+class TestSynapsePerformance:
+    """Tests for the Synapse performance endpoint."""
+
+    def test_reports_scraped_metrics(self, logged_in_client, tmp_path):
+        fixtures = app_module.Path(__file__).parent / 'fixtures'
+        pending = ['synapse_metrics_1.prom', 'synapse_metrics_2.prom']
+
+        def fetch(handle):
+            with open(fixtures / pending.pop(0), 'rb') as f:
+                return handle(f)
+
+        metrics = app_module.SynapseMetrics('http://synapse:9000/_synapse/metrics', fetch=fetch)
+        env_file = tmp_path / '.env'
+        env_file.write_text('ENABLE_METRICS=true\n')
+        with patch.object(app_module, 'synapse_metrics', metrics), \
+                patch.object(app_module, 'ENV_FILE', env_file):
+            app_module.scrape_synapse_metrics()
+            metrics.snapshots[-1]['time'] -= 60
+            app_module.scrape_synapse_metrics()
+            resp = logged_in_client.get('/api/synapse/performance')
+        data = resp.get_json()
+        assert data['enabled'] is True
+        assert data['current']['sync_rate'] == 1.0
+        assert {a['name'] for a in data['alerts']} == {'getEvent', 'persist_events'}
+
+    def test_scrape_skipped_when_disabled(self, tmp_path):
+        env_file = tmp_path / '.env'
+        env_file.write_text('ENABLE_METRICS=false\n')
+        with patch.object(app_module, 'ENV_FILE', env_file), \
+                patch.object(app_module.synapse_metrics, 'scrape') as scrape:
+            app_module.scrape_synapse_metrics()
+        scrape.assert_not_called()
+
+
+class TestNginxTraffic:
+    """Tests for the nginx traffic endpoint."""
+
+    def test_reports_routes_and_clamps_window(self, logged_in_client, tmp_path):
+        log = tmp_path / 'access.json.log'
+        log.write_text(json.dumps({
+            'time': f'{time.time():.3f}', 'port': '443', 'method': 'GET', 'uri': '/_matrix/client/v3/sync',
+            'status': '200', 'bytes': '512', 'request_time': '29.900', 'upstream_time': '29.899',
+        }) + '\n')
+        stats = app_module.AccessLogStats(log, tmp_path / 'state.json')
+        with patch.object(app_module, 'access_log_stats', stats):
+            resp = logged_in_client.get('/api/nginx/traffic?minutes=999999')
+        data = resp.get_json()
+        assert data['success'] is True
+        assert data['minutes'] == app_module.DEFAULT_TRAFFIC_MINUTES
+        assert data['traffic']['routes'][0]['route'] == 'sync'
+        assert data['traffic']['routes'][0]['requests'] == 1
+
+    def test_rotates_large_log_only_once_caught_up(self, tmp_path):
+        log = tmp_path / 'access.json.log'
+        log.write_text('{}\n')
+        tailer = LogTailer(log)
+        with patch.object(app_module, 'NGINX_LOG_MAX_BYTES', 1), \
+                patch.object(app_module, 'run_command', return_value={'success': True}) as run:
+            # Lines not yet read must not be rotated away under the tailer
+            app_module.rotate_nginx_log(tailer, 'access.json.log')
+            run.assert_not_called()
+            list(tailer.read_lines())
+            app_module.rotate_nginx_log(tailer, 'access.json.log')
+        command = run.call_args[0][0]
+        assert 'mv -f /var/log/nginx/shared/access.json.log /var/log/nginx/shared/access.json.log.1' in command
+        assert 'nginx -s reopen' in command
+
+
+class TestStartup:
+    """Tests for lazy backend loading and the explicit startup hook."""
+
+    def test_import_does_not_load_heavy_backends_or_start_scheduler(self):
+        """Importing the app must stay fast: no boto3/psycopg2/yaml/apscheduler, no scheduler."""
+        bench = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_startup.py')
+        result = subprocess.run([sys.executable, bench, '--child'], capture_output=True, text=True, check=True)
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        assert measurement['heavy_modules_loaded'] == []
+        assert measurement['scheduler_started'] is False
+
+    def test_import_does_not_read_homeserver_yaml(self, tmp_path):
+        """On a real deployment homeserver.yaml exists; importing must still not load yaml."""
+        homeserver_yaml = tmp_path / 'homeserver.yaml'
+        homeserver_yaml.write_text('server_name: example.com\nmedia_store_path: /data/media_store\n')
+        bench = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_startup.py')
+        result = subprocess.run(
+            [sys.executable, bench, '--child'], capture_output=True, text=True, check=True,
+            env=dict(os.environ, HOMESERVER_YAML=str(homeserver_yaml))
+        )
+        measurement = json.loads(result.stdout.strip().splitlines()[-1])
+        assert measurement['heavy_modules_loaded'] == []
+
+    def test_parse_schedule_trigger(self):
+        assert app_module.parse_schedule_trigger('daily') is not None
+        assert app_module.parse_schedule_trigger('0 4 * * 1') is not None
+        assert app_module.parse_schedule_trigger('every tuesday') is None
@@ -0,0 +1,161 @@
+"""Tests for checksummed backup archives and streaming verification."""
+
+import errno
+import gzip
+import io
+import os
+import tarfile
+from unittest.mock import patch
+
+import pytest
+
+from backup_archive import (
+    DATABASE_DUMP_NAME,
+    LocalBackupStore,
+    create_archive,
+    verify_archive,
+)
+
+
+class OneChunkAtATime(io.RawIOBase):
+    """A stream that, like an S3 body, can't seek and returns short reads."""
+
+    def __init__(self, data, chunk=4096):
+        self.data = io.BytesIO(data)
+        self.chunk = chunk
+
+    def read(self, size=-1):
+        return self.data.read(self.chunk if size < 0 else min(size, self.chunk))
+
+
+@pytest.fixture
+def project(tmp_path):
+    root = tmp_path / 'project'
+    (root / 'synapse_data' / 'media_store' / 'local_content').mkdir(parents=True)
+    (root / 'synapse_data' / 'homeserver.yaml').write_text('server_name: example.com\n')
+    (root / 'synapse_data' / 'media_store' / 'local_content' / 'abc').write_bytes(bytes(range(256)) * 1000)
+    dump = tmp_path / 'dump.pgdump'
+    dump.write_bytes(b'PGDMP' + b'\0' * 5000)
+    return root, dump
+
+
+def build(project):
+    root, dump = project
+    out = io.BytesIO()
+    stats = create_archive(out, root, ['synapse_data'], [(DATABASE_DUMP_NAME, dump)])
+    return out.getvalue(), stats
+
+
+class TestArchive:
+    def test_round_trip_verifies(self, project):
+        data, stats = build(project)
+        assert stats['files'] == 3
+        assert stats['size_bytes'] == len(data)
+
+        report = verify_archive(OneChunkAtATime(data), expected_sha256=stats['sha256'])
+        assert report['ok'] is True
+        assert report['sha256_ok'] is True
+        assert report['files'] == 3
+        assert report['bytes'] == stats['bytes']
+        assert report['compressed_bytes'] == len(data)
+
+    def test_detects_corrupted_member(self, project):
+        data, stats = build(project)
+        # Re-pack with one file changed but the original manifest kept
+        members = []
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+            for member in tar:
+                content = tar.extractfile(member).read() if member.isfile() else None
+                if member.name == 'synapse_data/homeserver.yaml':
+                    content = b'server_name: evil.com\n'
+                    member.size = len(content)
+                members.append((member, content))
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode='w:gz') as tar:
+            for member, content in members:
+                tar.addfile(member, io.BytesIO(content) if content is not None else None)
+
+        report = verify_archive(io.BytesIO(out.getvalue()), expected_sha256=stats['sha256'])
+        assert report['ok'] is False
+        assert report['mismatched'] == ['synapse_data/homeserver.yaml']
+        assert report['sha256_ok'] is False
+
+    def test_truncated_archive_raises(self, project):
+        data, _ = build(project)
+        with pytest.raises((tarfile.TarError, EOFError, gzip.BadGzipFile)):
+            verify_archive(io.BytesIO(data[:len(data) // 2]))
+
+    def test_archive_without_manifest_is_not_ok(self, tmp_path):
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode='w:gz') as tar:
+            info = tarfile.TarInfo('synapse_data/homeserver.yaml')
+            tar.addfile(info, io.BytesIO(b''))
+        report = verify_archive(io.BytesIO(out.getvalue()))
+        assert report['ok'] is False
+        assert 'manifest' in report['error']
+
+    def test_restore_extracts_files_and_streams_dump(self, project, tmp_path):
+        data, _ = build(project)
+        scratch = tmp_path / 'scratch'
+        received = []
+
+        def restore_database(dump):
+            received.append(dump.read(5))
+            return {'success': True}
+
+        report = verify_archive(io.BytesIO(data), extract_to=str(scratch), restore_database=restore_database)
+        assert report['ok'] is True
+        assert received == [b'PGDMP']
+        assert report['database'] == {'success': True}
+        assert (scratch / 'synapse_data' / 'homeserver.yaml').read_text() == 'server_name: example.com\n'
+        assert not (scratch / DATABASE_DUMP_NAME).exists()
+
+    def test_refuses_paths_outside_scratch_dir(self, tmp_path):
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode='w:gz') as tar:
+            tar.addfile(tarfile.TarInfo('../escape'), io.BytesIO(b''))
+        with pytest.raises(ValueError):
+            verify_archive(io.BytesIO(out.getvalue()), extract_to=str(tmp_path / 'scratch'))
+
+
+class TestLocalBackupStore:
+    def test_save_keeps_newest_and_records_checksum(self, tmp_path):
+        store = LocalBackupStore(tmp_path / 'backups', keep=2)
+        for day in ('01', '02', '03'):
+            path = tmp_path / 'tmp.tar.gz'
+            path.write_bytes(day.encode())
+            store.save(str(path), f'matrix-backup-202401{day}_030000.tar.gz', f'sha-{day}')
+
+        assert [b['name'] for b in store.list()] == [
+            'matrix-backup-20240103_030000.tar.gz',
+            'matrix-backup-20240102_030000.tar.gz',
+        ]
+        stream, sha256 = store.open('matrix-backup-20240103_030000.tar.gz')
+        with stream:
+            assert stream.read() == b'03'
+        assert sha256 == 'sha-03'
+        with pytest.raises(ValueError):
+            store.open('../etc/passwd')
+
+    def test_save_moves_archive_across_filesystems(self, tmp_path):
+        (tmp_path / 'tmp').mkdir()
+        source = tmp_path / 'tmp' / 'build.tar.gz'
+        source.write_bytes(b'archive')
+        real_rename, real_replace = os.rename, os.replace
+
+        def same_dir_only(real):
+            def rename(src, dst):
+                # Like /tmp and the admin_data volume: no renames between directories
+                if os.path.dirname(os.path.abspath(src)) != os.path.dirname(os.path.abspath(dst)):
+                    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+                return real(src, dst)
+            return rename
+
+        store = LocalBackupStore(tmp_path / 'backups')
+        with patch('os.rename', same_dir_only(real_rename)), patch('os.replace', same_dir_only(real_replace)):
+            store.save(str(source), 'matrix-backup-20240101_030000.tar.gz', 'sha')
+        assert not source.exists()
+        assert sorted(os.listdir(tmp_path / 'backups')) == [
+            'matrix-backup-20240101_030000.tar.gz', 'matrix-backup-20240101_030000.tar.gz.sha256'
+        ]
+        assert (tmp_path / 'backups' / 'matrix-backup-20240101_030000.tar.gz').read_bytes() == b'archive'
@@ -0,0 +1,120 @@
+"""Tests for resumable bulk user jobs and their rate limiter."""
+
+import json
+import threading
+
+from bulk_users import BulkUserJob, RateLimiter
+
+USERS = [f'@spam{i}:example.com' for i in range(30)]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter:
+    def test_spaces_calls_after_burst(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+        for _ in range(6):
+            limiter.acquire()
+        # Two calls from the burst, then one every half second
+        assert clock.now == 2.0
+
+    def test_zero_rate_is_unlimited(self):
+        RateLimiter(rate=0, sleep=lambda s: (_ for _ in ()).throw(AssertionError)).acquire()
+
+
+class TestBulkUserJob:
+    def test_applies_action_to_every_user_and_records_failures(self, tmp_path):
+        job = BulkUserJob(tmp_path / 'job.json', workers=3, rate=0)
+        job.create('deactivate', USERS, {'never_logged_in': True})
+        calls = []
+        lock = threading.Lock()
+
+        def perform(action, user):
+            with lock:
+                calls.append((action, user))
+            if user == '@spam7:example.com':
+                raise RuntimeError('Synapse admin API failed (404)')
+
+        status = job.run(perform)
+        assert sorted(user for _, user in calls) == sorted(USERS)
+        assert {action for action, _ in calls} == {'deactivate'}
+        assert status['state'] == 'completed'
+        assert (status['done'], status['failed'], status['remaining']) == (29, 1, 0)
+        assert status['errors'] == [{'user': '@spam7:example.com', 'error': 'Synapse admin API failed (404)'}]
+        assert status['filters'] == {'never_logged_in': True}
+
+    def test_pause_and_resume_skip_processed_users(self, tmp_path):
+        job = BulkUserJob(tmp_path / 'job.json', workers=2, rate=0)
+        job.create('shadow_ban', USERS)
+        processed = []
+
+        def perform(action, user):
+            processed.append(user)
+            if len(processed) == 5:
+                job.pause()
+
+        status = job.run(perform)
+        assert status['state'] == 'paused'
+        first_run = len(processed)
+        assert first_run < len(USERS)
+        assert status['done'] == first_run
+
+        # A new instance, as after an admin console restart
+        resumed = BulkUserJob(tmp_path / 'job.json', workers=2, rate=0)
+        assert resumed.status()['remaining'] == len(USERS) - first_run
+        status = resumed.run(lambda action, user: processed.append(user))
+        assert status['state'] == 'completed'
+        assert sorted(processed) == sorted(USERS)
+
+    def test_restart_mid_job_is_reported_as_interrupted(self, tmp_path):
+        job_file = tmp_path / 'job.json'
+        BulkUserJob(job_file).create('purge_media', USERS[:3])
+        job = json.loads(job_file.read_text())
+        job['state'] = 'running'
+        job_file.write_text(json.dumps(job))
+        # Including a progress line cut short by the restart
+        (tmp_path / 'job.json.progress').write_text(
+            json.dumps({'user': USERS[0], 'error': None}) + '\n{"user": "@spa'
+        )
+
+        status = BulkUserJob(job_file).status()
+        assert status['state'] == 'interrupted'
+        assert (status['done'], status['remaining']) == (1, 2)
+
+    def test_acquire_paces_extra_calls_only_while_running(self, tmp_path):
+        job = BulkUserJob(tmp_path / 'job.json', workers=1, rate=1000)
+        job.create('purge_media', USERS[:2])
+        acquired = []
+
+        def perform(action, user):
+            job.acquire()
+            acquired.append(job._limiter is not None)
+
+        job.run(perform)
+        assert acquired == [True, True]
+        # Outside a run there is nothing to wait for
+        job.acquire()
+        assert job._limiter is None
+
+    def test_new_job_replaces_finished_one(self, tmp_path):
+        job = BulkUserJob(tmp_path / 'job.json', rate=0)
+        job.create('deactivate', USERS[:2])
+        job.run(lambda action, user: None)
+        job.create('purge_media', USERS[2:4])
+        status = job.status()
+        assert (status['action'], status['state'], status['done'], status['remaining']) == ('purge_media', 'pending', 0, 2)
+
+    def test_no_job(self, tmp_path):
+        job = BulkUserJob(tmp_path / 'job.json')
+        assert job.status() is None
+        assert job.run(lambda action, user: None) is None
@@ -0,0 +1,200 @@
+"""Tests for the load generator, run against the in-memory stand-in homeserver."""
+
+import asyncio
+
+import pytest
+
+from loadtest import HTTPClient, LoadTest, StandInHomeserver, classify_outcome, format_report
+
+
+def run_against_stand_in(**options):
+    async def scenario():
+        stand_in = StandInHomeserver(server_name='example.com')
+        url = await stand_in.start()
+        try:
+            report = await LoadTest(url, stand_in.admin_token, **options).run()
+        finally:
+            await stand_in.stop()
+        return report, stand_in
+    return asyncio.run(scenario())
+
+
+async def serve_once(response):
+    """A server that answers every connection's first request with `response`, then closes."""
+    async def handle(reader, writer):
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+class TestHTTPClient:
+    def test_reads_chunked_body(self):
+        async def scenario():
+            server, url = await serve_once(
+                b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n'
+            )
+            client = HTTPClient(url)
+            try:
+                return await client.request('GET', '/')
+            finally:
+                await client.close()
+                server.close()
+        assert asyncio.run(scenario()) == (200, b'hello world')
+
+    def test_reconnects_after_server_closes_kept_alive_connection(self):
+        async def scenario():
+            server, url = await serve_once(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            client = HTTPClient(url)
+            try:
+                return [await client.request('GET', '/') for _ in range(3)]
+            finally:
+                await client.close()
+                server.close()
+        assert asyncio.run(scenario()) == [(200, b'ok')] * 3
+
+    def test_times_out(self):
+        async def scenario():
+            async def never_answer(reader, writer):
+                await asyncio.sleep(5)
+            server = await asyncio.start_server(never_answer, '127.0.0.1', 0)
+            client = HTTPClient(f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}")
+            try:
+                await client.request('GET', '/', timeout=0.1)
+            finally:
+                await client.close()
+                server.close()
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(scenario())
+
+
+class TestLoadTest:
+    def test_drives_sync_messages_and_uploads(self):
+        report, stand_in = run_against_stand_in(
+            users=6, users_per_room=3, duration=1.5, ramp_up=0.2, message_rate=240,
+            upload_rate=60, upload_size=1024, sync_timeout=0.5,
+        )
+        ops = report['operations']
+        assert report['users'] == 6
+        assert report['error_ratio'] == 0
+        assert ops['setup_create_user']['ok'] == 6
+        assert ops['setup_create_room']['ok'] == 2
+        assert ops['setup_join']['ok'] == 4
+        assert ops['initial_sync']['ok'] == 6
+        assert ops['send_message']['ok'] > 0
+        assert ops['upload_media']['ok'] == stand_in.uploads > 0
+        # Other members saw the messages through their long-polls
+        assert ops['message_delivery']['ok'] > 0
+        assert ops['message_delivery']['p95_ms'] is not None
+        # The test users are deactivated afterwards
+        assert ops['cleanup_deactivate']['ok'] == 6
+        assert all(user['deactivated'] for user in stand_in.users.values())
+        assert 'send_message' in format_report(report)
+
+    def test_rejected_admin_token_fails_setup(self):
+        async def scenario():
+            stand_in = StandInHomeserver()
+            url = await stand_in.start()
+            try:
+                await LoadTest(url, 'wrong-token', users=2, duration=0.1).run()
+            finally:
+                await stand_in.stop()
+        with pytest.raises(RuntimeError, match='Admin token'):
+            asyncio.run(scenario())
+
+    def test_non_admin_token_cannot_create_users(self):
+        async def scenario():
+            stand_in = StandInHomeserver(server_name='example.com')
+            url = await stand_in.start()
+            stand_in.tokens['user-token'] = '@someone:example.com'
+            try:
+                test = LoadTest(url, 'user-token', users=2, duration=0.1)
+                with pytest.raises(RuntimeError, match='No test users'):
+                    await test.run()
+                return test.stats['setup_create_user'].outcomes
+            finally:
+                await stand_in.stop()
+        assert asyncio.run(scenario()) == {'http_403': 2}
+
+    def test_cancelled_run_deactivates_test_users(self):
+        async def scenario():
+            stand_in = StandInHomeserver(server_name='example.com')
+            url = await stand_in.start()
+            try:
+                run = asyncio.create_task(
+                    LoadTest(url, stand_in.admin_token, users=4, duration=60, ramp_up=0, sync_timeout=0.5).run()
+                )
+                # Wait until the load phase has started, then interrupt it as Ctrl-C would
+                while len(stand_in.tokens) < 5:
+                    await asyncio.sleep(0.01)
+                await asyncio.sleep(0.3)
+                run.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await run
+            finally:
+                await stand_in.stop()
+            return stand_in
+        stand_in = asyncio.run(scenario())
+        assert len(stand_in.users) == 4
+        assert all(user.get('deactivated') for user in stand_in.users.values())
+
+    def test_failed_setup_deactivates_users_already_created(self):
+        class NoRoomIds(StandInHomeserver):
+            async def _route(self, method, target, headers, body):
+                if target.endswith('/createRoom'):
+                    return 200, {'room_id': None}
+                return await super()._route(method, target, headers, body)
+
+        async def scenario():
+            stand_in = NoRoomIds(server_name='example.com')
+            url = await stand_in.start()
+            try:
+                with pytest.raises(ExceptionGroup):
+                    await LoadTest(url, stand_in.admin_token, users=3, duration=0.1).run()
+            finally:
+                await stand_in.stop()
+            return stand_in
+        stand_in = asyncio.run(scenario())
+        assert len(stand_in.users) == 3
+        assert all(user.get('deactivated') for user in stand_in.users.values())
+
+    def test_admin_calls_use_admin_url(self):
+        class BehindNginx(StandInHomeserver):
+            """Reached on two ports; the public one, like nginx, doesn't serve the admin API."""
+
+            public_port = None
+
+            async def _route(self, method, target, headers, body):
+                if target.startswith('/_synapse/admin') and headers['host'].endswith(f':{self.public_port}'):
+                    return 404, {'errcode': 'M_UNRECOGNIZED', 'error': 'Not proxied'}
+                return await super()._route(method, target, headers, body)
+
+        async def scenario():
+            stand_in = BehindNginx(server_name='example.com')
+            admin_url = await stand_in.start()
+            public = await asyncio.start_server(stand_in._handle, '127.0.0.1', 0)
+            stand_in.public_port = public.sockets[0].getsockname()[1]
+            try:
+                return await LoadTest(
+                    f'http://127.0.0.1:{stand_in.public_port}', stand_in.admin_token, admin_url=admin_url,
+                    users=2, duration=0.5, ramp_up=0, sync_timeout=0.2,
+                ).run(), stand_in
+            finally:
+                public.close()
+                await stand_in.stop()
+        report, stand_in = asyncio.run(scenario())
+        assert report['error_ratio'] == 0
+        assert report['operations']['setup_login']['ok'] == 2
+        assert report['operations']['initial_sync']['ok'] == 2
+        assert all(user['deactivated'] for user in stand_in.users.values())
+
+    def test_rate_limited_responses_are_counted_separately(self):
+        assert classify_outcome(200) == 'ok'
+        assert classify_outcome(429) == 'rate_limited'
+        # nginx's limit_req rejects with 503
+        assert classify_outcome(503) == 'rate_limited'
+        assert classify_outcome(502) == 'http_502'
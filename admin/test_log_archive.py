@@ -0,0 +1,196 @@
+"""Tests for the compressed, indexed log archive."""
+
+import os
+import subprocess
+import time
+
+import pytest
+
+from log_archive import MAX_CACHED_INDEXES, LogArchive, LogCollector, detect_level, parse_docker_line, tokenize
+
+# 2024-02-15 12:26:40 UTC
+BASE_TS = 1708000000
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return LogArchive(tmp_path / 'logs', block_lines=100)
+
+
+def fill(archive, lines=2000, hours=3):
+    """Append synthetic synapse and nginx lines spread over several hours."""
+    for i in range(lines):
+        ts = BASE_TS + i * (hours * 3600 / lines)
+        archive.append('synapse', ts, f"synapse.access.http.8008 - INFO - GET /sync request {i}")
+        if i % 500 == 0:
+            archive.append('nginx', ts, f"[error] upstream timed out while reading response {i}")
+    archive.flush()
+
+
+class TestParsing:
+    def test_parse_docker_line(self):
+        ts, message = parse_docker_line('2024-02-15T12:26:40.500000000Z hello world')
+        assert ts == pytest.approx(BASE_TS + 0.5)
+        assert message == 'hello world'
+
+    def test_parse_docker_line_without_timestamp(self):
+        ts, message = parse_docker_line('no timestamp here')
+        assert message == 'no timestamp here'
+        assert abs(ts - time.time()) < 5
+
+    def test_detect_level(self):
+        assert detect_level('2024 - synapse.handlers - ERROR - boom') == 'error'
+        assert detect_level('2024 [warn] 1#1: something') == 'warning'
+        assert detect_level('FATAL:  password authentication failed') == 'critical'
+        assert detect_level('plain line') == 'info'
+
+    def test_tokenize_is_case_insensitive(self):
+        assert tokenize('Connection REFUSED to @user:example.org') >= {'connection', 'refused', 'example', 'org'}
+
+
+class TestLogArchive:
+    def test_pending_lines_are_searchable(self, archive):
+        archive.append('synapse', BASE_TS, 'first line')
+        result = archive.search('first')
+        assert [r['message'] for r in result['results']] == ['first line']
+
+    def test_partitioned_into_hourly_segments(self, archive):
+        fill(archive)
+        assert len(archive.segment_keys()) >= 3
+
+    def test_search_by_text_reads_only_matching_blocks(self, archive):
+        fill(archive)
+        result = archive.search('timed out')
+        assert len(result['results']) == 4
+        assert all(r['service'] == 'nginx' for r in result['results'])
+        assert result['blocks_read'] <= 4
+
+    def test_search_filters_service_level_and_time(self, archive):
+        fill(archive)
+        assert len(archive.search(min_level='error')['results']) == 4
+        assert len(archive.search(services=['nginx'], limit=1000)['results']) == 4
+        result = archive.search(services=['synapse'], start=BASE_TS, end=BASE_TS + 60, limit=1000)
+        # One synapse line every 5.4 seconds
+        assert len(result['results']) == 12
+
+    def test_results_are_newest_first_and_limited(self, archive):
+        fill(archive)
+        results = archive.search('sync', limit=5)['results']
+        assert len(results) == 5
+        assert results[0]['message'].endswith('request 1999')
+        assert [r['timestamp'] for r in results] == sorted((r['timestamp'] for r in results), reverse=True)
+
+    def test_reopened_archive_keeps_index_and_resume_point(self, archive, tmp_path):
+        fill(archive)
+        reopened = LogArchive(tmp_path / 'logs')
+        reopened.open()
+        assert reopened.last_ts['synapse'] == pytest.approx(BASE_TS + 1999 * 3 * 3600 / 2000)
+        assert len(reopened.search('timed out')['results']) == 4
+
+    def test_oldest_segments_evicted_over_budget(self, tmp_path):
+        archive = LogArchive(tmp_path / 'logs', max_bytes=1, block_lines=100)
+        fill(archive)
+        keys = archive.segment_keys()
+        assert len(keys) == 1
+        assert sorted(os.listdir(tmp_path / 'logs')) == sorted(
+            [keys[0] + '.log.z', keys[0] + '.idx.jsonl', 'collector_state.json', 'segment_ranges.json']
+        )
+
+    def test_only_sealed_segments_get_a_compressed_index(self, archive, tmp_path):
+        fill(archive)
+        keys = archive.segment_keys()
+        files = os.listdir(tmp_path / 'logs')
+        assert all(key + '.idx.json.gz' in files and key + '.idx.jsonl' not in files for key in keys[:-1])
+        # The open segment only has its append-only postings log
+        assert keys[-1] + '.idx.json.gz' not in files
+        with open(tmp_path / 'logs' / (keys[-1] + '.idx.jsonl')) as f:
+            assert len(f.readlines()) == len(archive._load_index(keys[-1])['blocks'])
+
+    def test_open_segment_index_is_rebuilt_after_restart(self, archive, tmp_path):
+        fill(archive)
+        newest = archive.search('sync', limit=1)['results']
+        # Including a postings line cut short by a crash
+        log_path = tmp_path / 'logs' / (archive.segment_keys()[-1] + '.idx.jsonl')
+        with open(log_path, 'a') as f:
+            f.write('{"block": {"offs')
+
+        reopened = LogArchive(tmp_path / 'logs', block_lines=100)
+        assert reopened.search('sync', limit=1)['results'] == newest
+        reopened.append('synapse', BASE_TS + 3 * 3600 - 1, 'same hour')
+        reopened.flush()
+        assert len(LogArchive(tmp_path / 'logs').search('same hour')['results']) == 1
+        # Continuing into the next hour seals the segment it had open
+        reopened.append('synapse', BASE_TS + 5 * 3600, 'next hour')
+        reopened.flush()
+        assert os.path.exists(str(log_path).replace('.idx.jsonl', '.idx.json.gz'))
+        assert not os.path.exists(log_path)
+        assert len(reopened.search('timed out')['results']) == 4
+
+    def test_index_cache_is_bounded_and_keeps_open_segment(self, tmp_path):
+        archive = LogArchive(tmp_path / 'logs', block_lines=10)
+        fill(archive, lines=400, hours=MAX_CACHED_INDEXES * 2)
+        keys = archive.segment_keys()
+        assert len(keys) > MAX_CACHED_INDEXES
+        # A search over everything touches every segment's index
+        assert len(archive.search('timed out')['results']) == 1
+        assert archive.search('request', start=BASE_TS, end=BASE_TS + 1)['segments_searched'] >= 1
+        assert len(archive._indexes) <= MAX_CACHED_INDEXES
+        assert keys[-1] in archive._indexes
+
+    def test_time_window_skips_other_segments_without_loading_them(self, archive, tmp_path):
+        fill(archive)
+        reopened = LogArchive(tmp_path / 'logs')
+        loaded = []
+        load_index = reopened._load_index
+        reopened._load_index = lambda key: loaded.append(key) or load_index(key)
+
+        result = reopened.search(services=['synapse'], start=BASE_TS, end=BASE_TS + 60, limit=1000)
+        assert len(result['results']) == 12
+        assert loaded == [reopened.segment_keys()[0]]
+        assert result['segments_searched'] == 1
+
+    def test_late_lines_in_a_newer_segment_are_still_found(self, archive):
+        fill(archive)
+        # Replayed history lands in the open segment, hours after its own time
+        archive.append('postgres', BASE_TS + 10, 'ERROR: replayed line')
+        archive.flush()
+        result = archive.search('replayed', start=BASE_TS, end=BASE_TS + 60)
+        assert [r['service'] for r in result['results']] == ['postgres']
+
+
+class TestLogCollector:
+    def test_resume_keeps_lines_sharing_the_last_timestamp(self, tmp_path, monkeypatch):
+        archive = LogArchive(tmp_path / 'logs')
+        archive.append('synapse', BASE_TS, 'first')
+        archive.append('synapse', BASE_TS, 'second')
+        archive.flush()
+        collector = LogCollector(LogArchive(tmp_path / 'logs'), ['synapse'], cwd=tmp_path)
+        commands = []
+
+        class FakeLogs:
+            """`docker compose logs --since` replays the lines at the resume timestamp too."""
+
+            def __init__(self, cmd, **kwargs):
+                commands.append(cmd)
+                self.stdout = iter([
+                    '2024-02-15T12:26:40Z first\n',
+                    '2024-02-15T12:26:40Z second\n',
+                    '2024-02-15T12:26:40Z third, same second\n',
+                    '2024-02-15T12:26:41Z fourth\n',
+                ])
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                collector._stop.set()
+
+        monkeypatch.setattr(subprocess, 'Popen', FakeLogs)
+        collector.archive.open()
+        collector._follow('synapse')
+
+        assert commands[0][commands[0].index('--since') + 1] == '2024-02-15T12:26:40.000000Z'
+        messages = [r['message'] for r in collector.archive.search(limit=10)['results']]
+        # Each line once: the two already archived aren't duplicated, the third isn't lost
+        assert sorted(messages) == ['first', 'fourth', 'second', 'third, same second']
+        assert collector.archive.resume_point('synapse') == (BASE_TS + 1, 1)
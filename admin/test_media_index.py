@@ -0,0 +1,99 @@
+"""Tests for the incremental media store index."""
+
+import os
+import shutil
+import time
+
+import pytest
+
+from media_index import MediaIndex, categorize, scan_directory
+
+
+def write_file(path, size, age_days=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b'x' * size)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def media_store(tmp_path):
+    root = tmp_path / 'media_store'
+    write_file(root / 'local_content' / 'ab' / 'cd' / 'efgh', 1000)
+    write_file(root / 'local_content' / 'ab' / 'ce' / 'fghi', 3000, age_days=40)
+    write_file(root / 'remote_content' / 'example.org' / 'aa' / 'bb' / 'cccc', 5000, age_days=400)
+    write_file(root / 'local_thumbnails' / 'ab' / 'cd' / 'efgh' / '32-32-image-png-crop', 200)
+    return root
+
+
+@pytest.fixture
+def index(media_store, tmp_path):
+    return MediaIndex(media_store, tmp_path / 'data' / 'media_index.sqlite3', workers=4)
+
+
+class TestCategorize:
+    def test_known_directories(self):
+        assert categorize('local_content/ab/cd/efgh') == 'local'
+        assert categorize('remote_content/example.org/aa/bb/cccc') == 'remote'
+        assert categorize('remote_thumbnail/example.org/aa/bb/cccc/32-32') == 'thumbnail'
+
+    def test_unknown_directory(self):
+        assert categorize('temp/file') == 'other'
+
+
+class TestScanDirectory:
+    def test_unchanged_directory_is_not_listed(self, media_store):
+        path = media_store / 'local_content'
+        mtime_ns, files, subdirs = scan_directory(str(path), None)
+        assert subdirs == ['ab']
+        assert scan_directory(str(path), mtime_ns) == (mtime_ns, None, None)
+
+
+class TestMediaIndex:
+    def test_report_before_scan_is_none(self, index):
+        assert index.report() is None
+
+    def test_full_scan_totals(self, index):
+        index.scan()
+        report = index.report()
+        assert report['total_files'] == 4
+        assert report['total_bytes'] == 9200
+        assert report['by_category']['local'] == {'files': 2, 'bytes': 4000}
+        assert report['by_category']['remote'] == {'files': 1, 'bytes': 5000}
+        assert report['by_category']['thumbnail'] == {'files': 1, 'bytes': 200}
+
+    def test_age_buckets(self, index):
+        index.scan()
+        by_age = {b['bucket']: b for b in index.report()['by_age']}
+        assert by_age['< 7 days']['files'] == 2
+        assert by_age['30-90 days']['bytes'] == 3000
+        assert by_age['> 1 year']['bytes'] == 5000
+
+    def test_largest_files_ordered_by_size(self, index):
+        index.scan()
+        largest = index.report(top_n=2)['largest_files']
+        assert [f['bytes'] for f in largest] == [5000, 3000]
+        assert largest[0]['path'] == 'remote_content/example.org/aa/bb/cccc'
+
+    def test_rescan_only_lists_changed_directories(self, index, media_store):
+        first = index.scan()
+        assert first['dirs_unchanged'] == 0
+
+        second = index.scan()
+        assert second['dirs_listed'] == 0
+
+        write_file(media_store / 'local_content' / 'ab' / 'cd' / 'new1', 700)
+        third = index.scan()
+        assert third['dirs_listed'] == 1
+        assert index.report()['by_category']['local'] == {'files': 3, 'bytes': 4700}
+
+    def test_removed_directories_are_dropped(self, index, media_store):
+        index.scan()
+        shutil.rmtree(media_store / 'remote_content' / 'example.org' / 'aa')
+        index.scan()
+        assert 'remote' not in index.report()['by_category']
+
+    def test_missing_media_store_raises(self, tmp_path):
+        index = MediaIndex(tmp_path / 'missing', tmp_path / 'index.sqlite3')
+        with pytest.raises(FileNotFoundError):
+            index.scan()
@@ -0,0 +1,271 @@
+"""Tests for the nginx log tailer, media cache and access log statistics."""
+
+import json
+import random
+
+import pytest
+
+from nginx_logs import (
+    AccessLogStats,
+    LatencySketch,
+    LogTailer,
+    MediaCacheStats,
+    classify_route,
+    parse_upstream_time,
+)
+
+T0 = 1_700_000_000  # 2023-11-14T22:13:20Z
+MEDIA_NOW = 1_708_003_800  # 2024-02-15T13:30:00Z
+
+
+def append(path, *lines):
+    with open(path, 'a') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+
+class TestLogTailer:
+    def test_reads_only_new_complete_lines(self, tmp_path):
+        path = tmp_path / 'access.log'
+        append(path, 'one', 'two')
+        tailer = LogTailer(path)
+        assert list(tailer.read_lines()) == ['one', 'two']
+
+        with open(path, 'a') as f:
+            f.write('three\nfou')
+        assert list(tailer.read_lines()) == ['three']
+        with open(path, 'a') as f:
+            f.write('r\n')
+        assert list(tailer.read_lines()) == ['four']
+
+    def test_missing_file_yields_nothing(self, tmp_path):
+        assert list(LogTailer(tmp_path / 'missing.log').read_lines()) == []
+
+    def test_restarts_after_truncation(self, tmp_path):
+        path = tmp_path / 'access.log'
+        append(path, 'old line one', 'old line two')
+        tailer = LogTailer(path)
+        list(tailer.read_lines())
+        path.write_text('')
+        append(path, 'new')
+        assert list(tailer.read_lines()) == ['new']
+
+    def test_restarts_after_rotation(self, tmp_path):
+        path = tmp_path / 'access.log'
+        append(path, 'a', 'b', 'c')
+        tailer = LogTailer(path)
+        list(tailer.read_lines())
+        path.rename(tmp_path / 'access.log.1')
+        append(path, 'd', 'e', 'f', 'g')
+        assert list(tailer.read_lines()) == ['d', 'e', 'f', 'g']
+
+    def test_finishes_rotated_file_before_moving_on(self, tmp_path):
+        path = tmp_path / 'access.log'
+        append(path, 'a', 'b')
+        tailer = LogTailer(path)
+        list(tailer.read_lines())
+        # Written after the last read, then rotated away before the next one
+        append(path, 'c')
+        path.rename(tmp_path / 'access.log.1')
+        assert list(tailer.read_lines()) == ['c']
+        append(path, 'd')
+        assert list(tailer.read_lines()) == ['d']
+
+    def test_rotated_file_read_before_new_file_exists(self, tmp_path):
+        path = tmp_path / 'access.log'
+        append(path, 'a')
+        tailer = LogTailer(path)
+        list(tailer.read_lines())
+        append(path, 'b')
+        path.rename(tmp_path / 'access.log.1')
+        assert list(tailer.read_lines()) == ['b']
+        assert list(tailer.read_lines()) == []
+        append(path, 'c')
+        assert list(tailer.read_lines()) == ['c']
+
+
+class TestMediaCacheStats:
+    @pytest.fixture
+    def log(self, tmp_path):
+        path = tmp_path / 'media-cache.log'
+        append(
+            path,
+            '2024-02-15T12:00:01+00:00 MISS 200 1000 0.120',
+            '2024-02-15T12:00:02+00:00 HIT 200 1000 0.001',
+            '2024-02-15T12:30:00+00:00 HIT 200 1000 0.001',
+            '2024-02-15T13:00:00+00:00 HIT 206 500 0.001',
+            '2024-02-15T13:00:01+00:00 - 200 700 0.050',
+        )
+        return path
+
+    def test_report_hit_ratio_and_bytes_saved(self, log, tmp_path):
+        stats = MediaCacheStats(log, tmp_path / 'state.json')
+        assert stats.update() == 5
+        report = stats.report(now=MEDIA_NOW)
+        assert report['requests'] == 5
+        assert report['hits'] == 3
+        assert report['misses'] == 1
+        assert report['hit_ratio'] == 0.75
+        assert report['bytes_saved'] == 2500
+        assert [h['hour'] for h in report['hourly']] == ['2024-02-15T12', '2024-02-15T13']
+        assert report['hourly'][0]['hit_ratio'] == pytest.approx(2 / 3, abs=1e-4)
+
+    def test_state_persists_between_instances(self, log, tmp_path):
+        state = tmp_path / 'state.json'
+        MediaCacheStats(log, state).update()
+        append(log, '2024-02-15T13:10:00+00:00 HIT 200 100 0.001')
+
+        stats = MediaCacheStats(log, state)
+        assert stats.update() == 1
+        assert stats.report(now=MEDIA_NOW)['hits'] == 4
+        assert json.loads(state.read_text())['tailer']['offset'] == log.stat().st_size
+
+    def test_report_covers_only_recent_hours(self, log, tmp_path):
+        stats = MediaCacheStats(log, tmp_path / 'state.json')
+        stats.update()
+        assert [h['hour'] for h in stats.report(hours=1, now=MEDIA_NOW)['hourly']] == ['2024-02-15T13']
+        # Nothing logged in the last day
+        assert stats.report(now=MEDIA_NOW + 2 * 86400)['requests'] == 0
+
+    def test_empty_report(self, tmp_path):
+        stats = MediaCacheStats(tmp_path / 'missing.log', tmp_path / 'state.json')
+        stats.update()
+        assert stats.report()['hit_ratio'] is None
+
+
+def access_line(ts, uri, status=200, request_time=0.1, upstream_time='0.090', port=443, nbytes=100):
+    return json.dumps({
+        'time': f'{ts:.3f}', 'port': str(port), 'method': 'GET', 'uri': uri,
+        'status': str(status), 'bytes': str(nbytes),
+        'request_time': f'{request_time:.3f}', 'upstream_time': upstream_time,
+    })
+
+
+class TestLatencySketch:
+    def test_quantiles_within_relative_error(self):
+        rng = random.Random(1)
+        values = sorted(rng.lognormvariate(-3, 1) for _ in range(5000))
+        sketch = LatencySketch()
+        for value in values:
+            sketch.add(value)
+        for q in (0.5, 0.95, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.03)
+
+    def test_merge_matches_single_sketch(self):
+        whole, left, right = LatencySketch(), LatencySketch(), LatencySketch()
+        for i in range(1, 200):
+            whole.add(i / 100)
+            (left if i % 2 else right).add(i / 100)
+        merged = LatencySketch.from_json(json.loads(json.dumps(left.to_json()))).merge(right)
+        assert merged.count == whole.count
+        assert merged.quantile(0.95) == whole.quantile(0.95)
+
+    def test_empty_sketch(self):
+        assert LatencySketch().quantile(0.5) is None
+
+
+class TestRouteClassification:
+    @pytest.mark.parametrize('uri,port,route', [
+        ('/_matrix/client/v3/sync', '443', 'sync'),
+        ('/_matrix/client/unstable/org.matrix.simplified_msc3575/sync', '443', 'sync'),
+        ('/_matrix/client/v3/rooms/!a:x/send/m.room.message/t1', '443', 'send'),
+        ('/_matrix/client/v3/rooms/!a:x/messages', '443', 'messages'),
+        ('/_matrix/client/v1/media/download/x/y', '443', 'media'),
+        ('/_matrix/federation/v1/send/123', '8448', 'federation'),
+        ('/_matrix/key/v2/server', '443', 'federation'),
+        ('/_matrix/client/v3/login', '443', 'auth'),
+        ('/_matrix/client/v3/keys/query', '443', 'keys'),
+        ('/_matrix/client/v3/profile/@a:x', '443', 'client_other'),
+        ('/admin/api/status', '443', 'admin_console'),
+        ('/bundles/abc/app.js', '443', 'element'),
+        ('/', '8448', 'federation'),
+    ])
+    def test_classify(self, uri, port, route):
+        assert classify_route(uri, port) == route
+
+    def test_upstream_time_with_retries(self):
+        assert parse_upstream_time('-') is None
+        assert parse_upstream_time('0.5, 0.25') == 0.75
+        assert parse_upstream_time('0.1 : 0.2') == pytest.approx(0.3)
+
+
+class TestAccessLogStats:
+    @pytest.fixture
+    def log(self, tmp_path):
+        path = tmp_path / 'access.json.log'
+        lines = [access_line(T0 + i, '/_matrix/client/v3/sync', request_time=30.0) for i in range(4)]
+        lines += [access_line(T0 + 60 + i, '/_matrix/client/v3/rooms/!a:x/send/m.room.message/t', request_time=0.05 * (i + 1))
+                  for i in range(20)]
+        lines.append(access_line(T0 + 61, '/_matrix/client/v3/rooms/!a:x/send/m.room.message/u', status=502,
+                                 upstream_time='-', request_time=0.002))
+        lines.append('not json')
+        append(path, *lines)
+        return path
+
+    def test_minute_buckets_and_percentiles(self, log, tmp_path):
+        stats = AccessLogStats(log, tmp_path / 'state.json')
+        assert stats.update() == 25
+        # The window ends at the start of 22:15, two minutes after the first request
+        report = stats.report(minutes=60, now=T0 + 100)
+        assert report['bucket_seconds'] == 60
+        assert report['buckets'] == 2
+        assert [p['bucket'] for p in report['series']] == ['2023-11-14T22:13', '2023-11-14T22:14']
+
+        routes = {r['route']: r for r in report['routes']}
+        send = routes['send']
+        assert send['requests'] == 21
+        assert send['statuses'] == {'200': 20, '502': 1}
+        assert send['error_ratio'] == pytest.approx(1 / 21, abs=1e-4)
+        assert send['p50'] == pytest.approx(0.5, rel=0.05)
+        assert send['p99'] == pytest.approx(0.95, rel=0.03)
+        assert send['upstream_p95'] == pytest.approx(0.09, rel=0.05)
+        assert routes['sync']['p50'] == pytest.approx(30.0, rel=0.05)
+        assert routes['sync']['requests_per_second'] == round(4 / 120, 3)
+
+    def test_state_persists_between_instances(self, log, tmp_path):
+        state = tmp_path / 'state.json'
+        AccessLogStats(log, state).update()
+        append(log, access_line(T0 + 62, '/_matrix/client/v3/sync'))
+
+        stats = AccessLogStats(log, state)
+        assert stats.update() == 1
+        routes = {r['route']: r for r in stats.report(now=T0 + 100)['routes']}
+        assert routes['sync']['requests'] == 5
+        assert routes['send']['requests'] == 21
+
+    def test_long_windows_use_hourly_buckets(self, log, tmp_path):
+        stats = AccessLogStats(log, tmp_path / 'state.json')
+        stats.update()
+        report = stats.report(minutes=24 * 60, now=T0 + 100)
+        assert report['bucket_seconds'] == 3600
+        assert report['series'][0]['bucket'] == '2023-11-14T22'
+        assert sum(r['requests'] for r in report['routes']) == 25
+
+    def test_old_minute_buckets_are_dropped(self, tmp_path):
+        path = tmp_path / 'access.json.log'
+        append(path, *(access_line(T0 + i * 60, '/') for i in range(200)))
+        stats = AccessLogStats(path, tmp_path / 'state.json')
+        stats.update()
+        assert len(stats.minutes) == 180
+        report = stats.report(minutes=180, now=T0 - 20 + 199 * 60)
+        assert report['routes'][0]['requests'] == 180
+        # Only 180 minutes of data are kept, so the rate covers just those
+        assert report['window_seconds'] == 179 * 60
+        assert report['routes'][0]['requests_per_second'] == round(180 / (179 * 60), 3)
+
+    def test_rates_cover_the_whole_window(self, tmp_path):
+        path = tmp_path / 'access.json.log'
+        # Two busy minutes long ago, then one request in the last hour
+        append(path, *(access_line(T0 + i, '/') for i in range(100)))
+        append(path, access_line(T0 + 3 * 3600, '/'))
+        stats = AccessLogStats(path, tmp_path / 'state.json')
+        stats.update()
+        now = T0 + 3 * 3600 + 40 - (T0 + 3 * 3600) % 60
+        report = stats.report(minutes=60, now=now)
+        assert report['buckets'] == 1
+        assert report['window_seconds'] == 59 * 60 + 40
+        assert report['routes'][0]['requests'] == 1
+        assert report['routes'][0]['requests_per_second'] == round(1 / (59 * 60 + 40), 3)
+        # A quiet hour reports no traffic rather than the last busy minutes
+        assert stats.report(minutes=60, now=now + 2 * 3600)['routes'] == []
@@ -0,0 +1,162 @@
+"""Tests for container resource sampling and the ring buffers behind it."""
+
+import threading
+
+from resource_monitor import (
+    COARSE_BUCKET_SECONDS,
+    ContainerSeries,
+    ResourceSampler,
+    RingBuffer,
+    parse_stats,
+)
+
+GB = 1024 ** 3
+T0 = 1_700_000_000
+
+
+def make_stats(cpu_total, system_total, memory=GB, inactive=0, limit=4 * GB,
+               read=0, write=0, rx=0, tx=0, online_cpus=1):
+    """Build a Docker stats sample with the given cumulative counters."""
+    return {
+        'cpu_stats': {'cpu_usage': {'total_usage': cpu_total}, 'system_cpu_usage': system_total,
+                      'online_cpus': online_cpus},
+        'memory_stats': {'usage': memory, 'limit': limit, 'stats': {'inactive_file': inactive}},
+        'blkio_stats': {'io_service_bytes_recursive': [
+            {'op': 'read', 'value': read},
+            {'op': 'write', 'value': write},
+        ]},
+        'networks': {'eth0': {'rx_bytes': rx, 'tx_bytes': tx}},
+    }
+
+
+class TestRingBuffer:
+    def test_wraps_and_keeps_most_recent(self):
+        ring = RingBuffer(3, fields=('value',))
+        for i in range(5):
+            ring.append(T0 + i, [i])
+        assert ring.count == 3
+        assert [ring.timestamps[i] for i in ring.indices()] == [T0 + 2, T0 + 3, T0 + 4]
+        assert ring.latest() == (T0 + 4, [4.0])
+
+    def test_downsample_averages_buckets_and_skips_empty(self):
+        ring = RingBuffer(10, fields=('value',))
+        for ts, value in [(0, 1), (5, 3), (25, 10)]:
+            ring.append(T0 + ts, [value])
+        series = ring.downsample(T0, T0 + 30, 3)
+        assert series == {'timestamps': [T0, T0 + 20], 'value': [2.0, 10.0]}
+
+    def test_average_since(self):
+        ring = RingBuffer(10, fields=('value',))
+        for ts, value in [(0, 100), (10, 2), (20, 4)]:
+            ring.append(T0 + ts, [value])
+        assert ring.average(T0 + 10) == [3.0]
+        assert ring.average(T0 + 30) is None
+
+
+class TestParseStats:
+    def test_excludes_reclaimable_cache(self):
+        counters = parse_stats(make_stats(0, 0, memory=2 * GB, inactive=GB))
+        assert counters['memory_bytes'] == GB
+
+    def test_online_cpus_falls_back_to_per_core_usage(self):
+        stats = make_stats(0, 0)
+        del stats['cpu_stats']['online_cpus']
+        assert parse_stats(stats)['online_cpus'] == 1
+        stats['cpu_stats']['cpu_usage']['percpu_usage'] = [0, 0, 0, 0]
+        assert parse_stats(stats)['online_cpus'] == 4
+
+    def test_stopped_container_has_no_data(self):
+        assert parse_stats({'memory_stats': {}, 'cpu_stats': {}}) is None
+
+
+class TestContainerSeries:
+    def test_rates_from_consecutive_samples(self):
+        series = ContainerSeries(interval=10)
+        assert series.add(make_stats(0, 0), T0) is False
+        # Samples inside the interval are dropped
+        assert series.add(make_stats(10, 100), T0 + 1) is False
+        assert series.add(make_stats(25, 100, read=1000, write=500, rx=2000, tx=4000), T0 + 10) is True
+
+        current = series.current()
+        assert current['cpu_percent'] == 25.0
+        assert current['block_read_rate'] == 100.0
+        assert current['block_write_rate'] == 50.0
+        assert current['net_rx_rate'] == 200.0
+        assert current['net_tx_rate'] == 400.0
+        assert current['memory_bytes'] == GB
+
+    def test_cpu_percent_is_per_core_like_docker_stats(self):
+        series = ContainerSeries(interval=10)
+        series.add(make_stats(0, 0, online_cpus=4), T0)
+        # One core busy out of four is a quarter of the host
+        series.add(make_stats(25, 100, online_cpus=4), T0 + 10)
+        assert series.current()['cpu_percent'] == 100.0
+        assert series.current()['online_cpus'] == 4
+
+    def test_counter_reset_starts_new_baseline(self):
+        series = ContainerSeries(interval=10)
+        series.add(make_stats(1000, 1000), T0)
+        assert series.add(make_stats(10, 10), T0 + 10) is False
+        assert series.add(make_stats(20, 20), T0 + 20) is True
+        assert series.current()['cpu_percent'] == 100.0
+
+    def test_coarse_buckets_average_fine_samples(self):
+        series = ContainerSeries(interval=10)
+        start = T0 - T0 % COARSE_BUCKET_SECONDS
+        cpu = system = 0
+        series.add(make_stats(cpu, system), start)
+        for step in range(1, COARSE_BUCKET_SECONDS // 10 + 2):
+            # 50% CPU in the first bucket, 10% after it
+            cpu += 50 if step * 10 < COARSE_BUCKET_SECONDS else 10
+            system += 100
+            series.add(make_stats(cpu, system), start + step * 10)
+
+        assert series.coarse.count == 1
+        assert series.coarse.latest() is not None
+        day = series.series(start + COARSE_BUCKET_SECONDS + 20)['24h']
+        assert day['cpu_percent'] == [50.0]
+
+        hour = series.series(start + COARSE_BUCKET_SECONDS + 20)['1h']
+        assert len(hour['timestamps']) <= 60
+        # The last minute holds four samples at 50% and two at 10%
+        assert hour['cpu_percent'][-1] == round((4 * 50 + 2 * 10) / 6, 2)
+
+
+class TestResourceSampler:
+    def test_one_stream_per_container_and_alerts(self):
+        done = threading.Event()
+        streams = []
+
+        def fake_stream(container_id):
+            streams.append(container_id)
+            yield make_stats(0, 0, memory=3 * GB, limit=4 * GB)
+            yield make_stats(95, 100, memory=3 * GB, limit=4 * GB)
+            done.set()
+
+        sampler = ResourceSampler(
+            lambda: {'synapse': 'abc123'},
+            interval=0,
+            cpu_alert_percent=90,
+            memory_alert_percent=70,
+            stream=fake_stream
+        )
+        sampler.refresh_streams()
+        assert done.wait(5)
+        sampler._streams['synapse'][1].join(5)
+        # A finished stream is restarted on the next discovery
+        sampler.refresh_streams()
+        sampler._streams['synapse'][1].join(5)
+        assert streams == ['abc123', 'abc123']
+
+        report = sampler.report()
+        assert report['services']['synapse']['current']['cpu_percent'] == 95.0
+        alerts = {(a['service'], a['metric']) for a in report['alerts']}
+        assert alerts == {('synapse', 'cpu_percent'), ('synapse', 'memory_percent')}
+
+    def test_discovery_failure_is_logged_not_raised(self):
+        def broken():
+            raise RuntimeError('docker not reachable')
+
+        sampler = ResourceSampler(broken, stream=lambda cid: iter(()))
+        sampler.refresh_streams()
+        assert sampler.report()['services'] == {}
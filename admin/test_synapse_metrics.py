@@ -0,0 +1,122 @@
+"""Tests for Synapse metrics parsing and analysis, against canned scrapes."""
+
+import urllib.error
+from pathlib import Path
+
+import pytest
+
+from synapse_metrics import (
+    SynapseMetrics,
+    collect_snapshot,
+    histogram_quantile,
+    parse_metrics,
+)
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+T0 = 1_700_000_000
+
+
+def fixture_fetch(*names):
+    """A fetch function that serves the given fixture files in turn."""
+    pending = list(names)
+
+    def fetch(handle):
+        with open(FIXTURES / pending.pop(0), 'rb') as f:
+            return handle(f)
+    return fetch
+
+
+@pytest.fixture
+def metrics():
+    metrics = SynapseMetrics(
+        'http://synapse:9000/_synapse/metrics',
+        interval=30,
+        fetch=fixture_fetch('synapse_metrics_1.prom', 'synapse_metrics_2.prom')
+    )
+    assert metrics.scrape(now=T0)
+    assert metrics.scrape(now=T0 + 60)
+    return metrics
+
+
+class TestParsing:
+    def test_skips_other_families_and_comments(self):
+        lines = [
+            '# HELP process_cpu_seconds_total CPU',
+            'process_cpu_seconds_total 12.5',
+            'synapse_event_processing_lag{name="federation_sender"} 1500.0',
+        ]
+        assert list(parse_metrics(lines)) == [
+            ('synapse_event_processing_lag', {'name': 'federation_sender'}, 1500.0)
+        ]
+
+    def test_labels_with_escapes_and_total_suffix(self):
+        lines = [b'synapse_storage_events_persisted_events_total{desc="a \\"quoted\\" name",x="1"} 7']
+        assert list(parse_metrics(lines)) == [
+            ('synapse_storage_events_persisted_events', {'desc': 'a "quoted" name', 'x': '1'}, 7.0)
+        ]
+
+    def test_snapshot_sums_sync_label_sets_only(self):
+        with open(FIXTURES / 'synapse_metrics_1.prom', 'rb') as f:
+            snapshot = collect_snapshot(f, T0)
+        # Both /sync tags, but not the send servlet
+        assert snapshot['sync']['count'] == 210
+        assert snapshot['sync']['buckets'][float('inf')] == 210
+        assert snapshot['caches']['getEvent']['evicted_size'] == 50
+        assert snapshot['transactions']['persist_events'] == [50.0, 100.0]
+        assert snapshot['events_persisted'] == 5000
+        assert snapshot['event_processing_lag'] == 1.5
+
+    def test_histogram_quantile_interpolates(self):
+        buckets = {0.1: 30, 0.5: 40, 1.0: 50, 5.0: 55, 30.0: 60, float('inf'): 60}
+        assert histogram_quantile(buckets, 0.5) == pytest.approx(0.1)
+        assert histogram_quantile(buckets, 0.95) == pytest.approx(15.0)
+        assert histogram_quantile({float('inf'): 0}, 0.5) is None
+
+
+class TestSynapseMetrics:
+    def test_rates_between_scrapes(self, metrics):
+        current = metrics.report(now=T0 + 60)['current']
+        assert current['sync_rate'] == 1.0
+        assert current['sync_p50'] == pytest.approx(0.1)
+        assert current['sync_p95'] == pytest.approx(15.0)
+        assert current['reactor_tick_mean'] == pytest.approx(0.003)
+        assert current['reactor_tick_p95'] == pytest.approx(0.055)
+        assert current['events_persisted_rate'] == 10.0
+        assert current['event_processing_lag'] == 2.5
+        assert current['db_txn_rate'] == pytest.approx(1010 / 60, abs=1e-3)
+        assert current['cache_hit_ratio'] == pytest.approx(1300 / 1510, abs=1e-4)
+
+    def test_flags_undersized_cache_and_slow_transaction(self, metrics):
+        report = metrics.report(now=T0 + 60)
+        caches = {c['name']: c for c in report['caches']}
+        assert caches['getEvent']['undersized'] is True
+        assert caches['getEvent']['hit_ratio'] == 0.6
+        assert caches['getEvent']['evictions'] == 200
+        assert caches['get_users_in_room']['undersized'] is False
+
+        transactions = {t['desc']: t for t in report['transactions']}
+        assert transactions['persist_events']['mean_seconds'] == 1.2
+        assert transactions['persist_events']['slow'] is True
+        assert transactions['get_events']['slow'] is False
+        assert {(a['type'], a['name']) for a in report['alerts']} == {
+            ('undersized_cache', 'getEvent'),
+            ('slow_transaction', 'persist_events'),
+        }
+
+    def test_restart_drops_interval_instead_of_negative_rates(self):
+        metrics = SynapseMetrics(
+            'http://synapse:9000/_synapse/metrics',
+            fetch=fixture_fetch('synapse_metrics_2.prom', 'synapse_metrics_1.prom')
+        )
+        metrics.scrape(now=T0)
+        metrics.scrape(now=T0 + 60)
+        assert metrics.history.count == 0
+        assert len(metrics.snapshots) == 1
+
+    def test_unreachable_listener_is_reported(self):
+        def fetch(handle):
+            raise urllib.error.URLError('connection refused')
+
+        metrics = SynapseMetrics('http://synapse:9000/_synapse/metrics', fetch=fetch)
+        assert metrics.scrape(now=T0) is False
+        assert 'connection refused' in metrics.report(now=T0)['error']
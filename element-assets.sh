@@ -0,0 +1,46 @@
+#!/bin/sh
+set -e
+
+# Extract Element Web into the element_static volume so nginx can serve it
+# directly, with precompressed .gz files for gzip_static.
+# Run after pulling a new Element image: docker compose run --rm element-assets
+
+DEST=/srv/element
+
+if ! touch "$DEST/.write-test" 2>/dev/null; then
+    echo "ERROR: $DEST is not writable by uid $(id -u). Run the element-assets service as root (user: root in docker-compose.yml)." >&2
+    exit 1
+fi
+rm -f "$DEST/.write-test"
+
+if [ "${ELEMENT_STATIC_ASSETS:-false}" != "true" ]; then
+    # nginx falls back to proxying the element container when no files are here
+    echo "ELEMENT_STATIC_ASSETS is not enabled, removing any extracted Element files"
+    rm -rf "$DEST/current" "$DEST/.new" "$DEST/.old"
+    exit 0
+fi
+
+echo "Extracting Element Web assets..."
+rm -rf "$DEST/.new"
+mkdir -p "$DEST/.new"
+cp -a /app/. "$DEST/.new/"
+cp /config.json "$DEST/.new/config.json"
+
+echo "Precompressing assets..."
+find "$DEST/.new" -type f \( -name '*.js' -o -name '*.css' -o -name '*.html' -o -name '*.json' \
+    -o -name '*.svg' -o -name '*.wasm' -o -name '*.txt' -o -name '*.ttf' -o -name '*.map' \) \
+    -size +1k | while read -r file; do
+    gzip -9 -c "$file" > "$file.gz"
+    # gzip_static needs the .gz to share the original's modification time
+    touch -r "$file" "$file.gz"
+done
+
+# Swap the new version in; requests during the swap fall back to the proxy
+rm -rf "$DEST/.old"
+if [ -d "$DEST/current" ]; then
+    mv "$DEST/current" "$DEST/.old"
+fi
+mv "$DEST/.new" "$DEST/current"
+rm -rf "$DEST/.old"
+
+echo "Element Web assets ready: $(du -sh "$DEST/current" | cut -f1)"
@@ -252,6 +252,9 @@ fi
 echo "Starting Matrix services..."
 docker compose up -d
 
+# Extract Element Web for nginx to serve directly (if ELEMENT_STATIC_ASSETS=true)
+docker compose run --rm element-assets
+
 # Install systemd timers for auto-updates and scheduled reboots
 echo "Setting up systemd timers for auto-updates..."
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
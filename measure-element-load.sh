@@ -0,0 +1,61 @@
+#!/bin/bash
+set -e
+
+# Measure Element Web first-load cost: bytes transferred and time for
+# index.html, config.json and the scripts and stylesheets it references,
+# fetched the way a browser would (with compression).
+#
+# Usage: ./measure-element-load.sh [https://matrix.yourdomain.com]
+# Run it before and after changing ELEMENT_STATIC_ASSETS to compare.
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+BASE_URL="$1"
+if [ -z "$BASE_URL" ] && [ -f "$SCRIPT_DIR/.env" ]; then
+    BASE_URL="https://$(grep '^MATRIX_DOMAIN=' "$SCRIPT_DIR/.env" | cut -d= -f2)"
+fi
+if [ -z "$BASE_URL" ]; then
+    echo "Usage: $0 https://matrix.yourdomain.com"
+    exit 1
+fi
+BASE_URL="${BASE_URL%/}"
+
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf "$TMP_DIR"' EXIT
+
+total_bytes=0
+total_time=0
+count=0
+
+fetch() {
+    local path="$1"
+    local result
+    # size_download is the compressed size on the wire
+    result=$(curl -sk -o "$TMP_DIR/body" -D "$TMP_DIR/headers" -H 'Accept-Encoding: gzip' \
+        -w '%{http_code} %{size_download} %{time_total}' "$BASE_URL/$path")
+    read -r code bytes seconds <<< "$result"
+    encoding=$(grep -i '^content-encoding:' "$TMP_DIR/headers" | tr -d '\r' | cut -d' ' -f2)
+    cache=$(grep -i '^cache-control:' "$TMP_DIR/headers" | tr -d '\r' | cut -d' ' -f2-)
+    printf '%-4s %10s B %7ss  %-5s %-45s %s\n' "$code" "$bytes" "$seconds" "${encoding:--}" "${cache:--}" "/$path"
+    total_bytes=$((total_bytes + bytes))
+    total_time=$(echo "$total_time + $seconds" | awk '{print $1 + $3}')
+    count=$((count + 1))
+}
+
+echo "Measuring Element Web first load from $BASE_URL"
+echo ""
+printf '%-4s %12s %8s  %-5s %-45s %s\n' "HTTP" "Bytes" "Time" "Enc" "Cache-Control" "Path"
+
+fetch ""
+cp "$TMP_DIR/body" "$TMP_DIR/index.html"
+fetch "config.json"
+
+# Scripts and stylesheets referenced by index.html
+grep -oE '(src|href)="[^"]+\.(js|css)"' "$TMP_DIR/index.html" | cut -d'"' -f2 | sed 's|^/||' | sort -u > "$TMP_DIR/assets"
+while read -r asset; do
+    fetch "$asset"
+done < "$TMP_DIR/assets"
+
+echo ""
+echo "Requests:          $count"
+echo "Bytes transferred: $total_bytes"
+echo "Total time:        ${total_time}s (sequential)"
@@ -0,0 +1,20 @@
+#!/bin/sh
+
+# Keep the logs nginx writes for the admin console bounded. The admin console
+# rotates them once it has read them; this only steps in when it isn't running
+# to do so, rotating a log that grows past the limit to <name>.1.
+# Runs from nginx's /docker-entrypoint.d at container start.
+
+LOG_DIR=/var/log/nginx/shared
+LIMIT_KB=$((${NGINX_SHARED_LOG_MAX_MB:-500} * 1024))
+
+(
+    while sleep 600; do
+        for log in "$LOG_DIR/access.json.log" "$LOG_DIR/media-cache.log"; do
+            [ -f "$log" ] || continue
+            if [ "$(du -k "$log" | cut -f1)" -gt "$LIMIT_KB" ]; then
+                mv -f "$log" "$log.1" && nginx -s reopen
+            fi
+        done
+    done
+) &
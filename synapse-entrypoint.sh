@@ -41,9 +41,9 @@ database:
 # Enable registration (controlled by ENABLE_REGISTRATION env var)
 # When enabled, anyone with the domain link can create a user profile
 # Note: Email notifications require SMTP configuration (see README Step 6)
-# To disable registration after creating admin user:
-#   1. Set ENABLE_REGISTRATION=false in your .env file
-#   2. Restart: docker compose restart synapse
+# To disable registration after creating admin user, use the admin
+# console's Server Configuration section, or set both keys below to false
+# and restart: docker compose restart synapse
 enable_registration: ${ENABLE_REGISTRATION:-true}
 enable_registration_without_verification: ${ENABLE_REGISTRATION:-true}
 
@@ -101,9 +101,9 @@ EOF
             cat >> /data/homeserver.yaml << EOF
 
 # Federation disabled - block all federation
-# To enable federation:
-#   1. Set ENABLE_FEDERATION=true in your .env file
-#   2. Restart: docker compose restart synapse
+# To enable federation, use the admin console's Server Configuration
+# section, or set federation_domain_whitelist: [] and restart:
+#   docker compose restart synapse
 federation_domain_whitelist:
   - ${SYNAPSE_SERVER_NAME}
 EOF
@@ -116,6 +116,66 @@ EOF
     fi
 fi
 
+# Optional Prometheus metrics listener for the admin console (ENABLE_METRICS).
+# It is only reachable on the internal Docker network: the port isn't
+# published and nginx doesn't proxy it. This runs on every boot, not just
+# the first, so metrics can be switched on and off for an existing config.
+if [ -f /data/homeserver.yaml ]; then
+    python3 - <<'PYEOF' || echo "WARNING: Could not update the metrics listener in homeserver.yaml"
+import os
+import re
+
+path = '/data/homeserver.yaml'
+begin = '# BEGIN metrics (managed by synapse-entrypoint.sh)'
+end = '# END metrics'
+enabled = os.environ.get('ENABLE_METRICS', 'false') == 'true'
+port = int(os.environ.get('SYNAPSE_METRICS_PORT', '9000'))
+
+with open(path) as f:
+    original = f.read()
+
+# Drop the blocks added by a previous boot
+lines = []
+managed = removed = False
+for line in original.splitlines(keepends=True):
+    if line.strip() == begin:
+        managed = removed = True
+    elif managed and line.strip() == end:
+        managed = False
+    elif not managed:
+        lines.append(line)
+if removed:
+    # ...including the blank line that separated the enable_metrics block
+    while lines and not lines[-1].strip():
+        lines.pop()
+
+if enabled:
+    start = next((i for i, line in enumerate(lines) if re.match(r'^listeners\s*:', line)), None)
+    if start is None:
+        print("WARNING: No listeners section in homeserver.yaml, metrics listener not added")
+    else:
+        item = next((line for line in lines[start + 1:] if line.strip() and not line.lstrip().startswith('#')), '')
+        indent = re.match(r'^(\s*)', item).group(1) if item.lstrip().startswith('- ') else '  '
+        lines[start + 1:start + 1] = [
+            f"{indent}{begin}\n",
+            f"{indent}- port: {port}\n",
+            f"{indent}  type: metrics\n",
+            f"{indent}  bind_addresses: ['0.0.0.0']\n",
+            f"{indent}{end}\n",
+        ]
+    if not any(re.match(r'^enable_metrics\s*:', line) for line in lines):
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        lines += [f"\n{begin}\n", "enable_metrics: true\n", f"{end}\n"]
+
+updated = ''.join(lines)
+if updated != original:
+    with open(path, 'w') as f:
+        f.write(updated)
+    print(f"Metrics listener {'enabled on port %d' % port if enabled else 'disabled'}")
+PYEOF
+fi
+
 # Ensure data directory ownership matches UID/GID
 if [ -n "$UID" ]; then
     DESIRED_OWNER="$UID:${GID:-991}"
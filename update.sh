@@ -22,6 +22,10 @@ docker compose pull >> $LOG_FILE 2>&1
 echo "[$(date)] Restarting services..." >> $LOG_FILE
 docker compose up -d >> $LOG_FILE 2>&1
 
+# Refresh the Element Web files nginx serves directly (if ELEMENT_STATIC_ASSETS=true)
+echo "[$(date)] Refreshing Element Web assets..." >> $LOG_FILE
+docker compose run --rm element-assets >> $LOG_FILE 2>&1
+
 # Clean up old images
 echo "[$(date)] Cleaning up old images..." >> $LOG_FILE
 docker image prune -af >> $LOG_FILE 2>&1